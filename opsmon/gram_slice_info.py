@@ -1,26 +1,18 @@
-import glob
 import json
-import os
 import sys
 
+from gram.am.gram import snapshot_format
+from gram.am.gram import journal_format
+
 def find_latest_snapshot():
     SNAPSHOT_DIRECTORY = '/etc/gram/snapshots/gram'
-    files = glob.glob(SNAPSHOT_DIRECTORY + "/" + "*.json")
-    latest_snapshot = None
-    latest_ctime = None
-    for file in files:
-        stat = os.stat(file)
-        ctime = stat.st_ctime
-        if latest_snapshot is None or latest_ctime < ctime:
-            latest_snapshot = file
-            latest_ctime = ctime
-    return latest_snapshot
+    # Uses the snapshot catalog's pointer to the latest snapshot
+    return snapshot_format.find_latest_snapshot(SNAPSHOT_DIRECTORY)
 
 def parse_snapshot(snapshot_filename):
-    snapshot_data = None
-    with open(snapshot_filename, 'r') as snapshot_file:
-        snapshot_data = json.load(snapshot_file)
-#        print "DATA = %s" % snapshot_data
+    # Snapshots may be JSON or binary and may be followed by a journal
+    # of later changes: read them with the GRAM loader
+    snapshot_data = journal_format.load_state(snapshot_filename)
     objects_by_urn = {}
     objects_by_uid = {}
     if snapshot_data is not None:
@@ -51,7 +51,7 @@ from gcf.geni.am.am3 import *
 from gram import config
 from gram import constants
 from gram.gram_manager import GramManager
-from gram.rspec_handler import generateAdvertisement
+from gram.advertisement_cache import advertisement
 import gram.open_stack_interface
 
 class GramReferenceAggregateManager(ReferenceAggregateManager):
@@ -111,14 +111,10 @@ class GramReferenceAggregateManager(ReferenceAggregateManager):
             return ret
 
         stitching_state = self._gram_manager.getStitchingState()
-        result = generateAdvertisement(self._gram_manager._aggregate_urn, \
-                                           stitching_state)
-        
-        if 'geni_compressed' in options and options['geni_compressed']:
-            try:
-                result = base64.b64encode(zlib.compress(result))
-            except Exception, exc:
-                self.logger.error("Error compressing and encoding resource list")
+        compressed = 'geni_compressed' in options and \
+            options['geni_compressed']
+        result = advertisement.get(self._gram_manager._aggregate_urn, \
+                                       stitching_state, compressed)
                 
         return self.successResult(result)
 
@@ -302,8 +298,10 @@ class GramReferenceAggregateManager(ReferenceAggregateManager):
         #             break
         #         time.sleep(1)
 
-        # Save the state with the new allocation and operational states
-        self._gram_manager.persist_state()
+        # Save the state of the slice with the new allocation and
+        # operational states
+        with the_slice.getReadLock():
+            self._gram_manager.persist_state(the_slice)
 
         return self.successResult([s.status(errors[s.getSliverURN()])
                                    for s in slivers])
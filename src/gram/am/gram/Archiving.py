@@ -25,12 +25,14 @@
 # to/from files using JSON
 
 import datetime
+import os
 import time
 import json
 import pdb
 from resources import Slice, VirtualMachine, NetworkLink, NetworkInterface
 import stitching
 import config
+import snapshot_format
 from open_stack_interface import _execCommand
 from manage_ssh_proxy import SSHProxyTable, _addNewProxy
 import re
@@ -87,8 +89,9 @@ class GramJSONEncoder(json.JSONEncoder):
                 "slice_urn":o.getSliceURN(),
                 "user_urn":o.getUserURN(),
                 "expiration":expiration_time,
-                "manifest_rspec":o.getManifestRspec(),
-                "request_rspec":o.getRequestRspec(),
+                "manifest_rspec_id":o.getManifestRspecId(),
+                "request_rspec_id":o.getRequestRspecId(),
+                "rspecs":o.getRspecs(),
                 "last_subnet_assigned":o._last_subnet_assigned,
                 "next_vm_num":o._next_vm_num,
                 "slivers":[sliver.getSliverURN() for sliver in o.getAllSlivers().values()]
@@ -119,8 +122,8 @@ class GramJSONEncoder(json.JSONEncoder):
                     "network_interfaces":[nic.getSliverURN() for nic in o.getNetworkInterfaces()],
                     "last_octet":o.getLastOctet(),
                     "os_image":o.getOSImageName(),
-                    "request_rspec":o.getRequestRspec(),
-                    "manifest_rspec":o.getManifestRspec(),
+                    "request_rspec_id":o.getRequestRspecId(),
+                    "manifest_rspec_id":o.getManifestRspecId(),
                     "os_type":o.getOSType(),
                     "os_version":o.getOSVersion(),
                     "vm_flavor":o.getVMFlavor(),
@@ -151,8 +154,8 @@ class GramJSONEncoder(json.JSONEncoder):
                     "creation":creation_time,
                     "allocation_state":o.getAllocationState(),
                     "operational_state":o.getOperationalState(),
-                    "request_rspec":o.getRequestRspec(),
-                    "manifest_rspec":o.getManifestRspec(),
+                    "request_rspec_id":o.getRequestRspecId(),
+                    "manifest_rspec_id":o.getManifestRspecId(),
                     "device_number":o.getDeviceNumber(),
                     "mac_address":o.getMACAddress(),
                     "ip_address":o.getIPAddress(),
@@ -183,8 +186,8 @@ class GramJSONEncoder(json.JSONEncoder):
                     "expiration":expiration_time,
                     "creation":creation_time,
                     "allocation_state":o.getAllocationState(),
-                    "request_rspec":o.getRequestRspec(),
-                    "manifest_rspec":o.getManifestRspec(),
+                    "request_rspec_id":o.getRequestRspecId(),
+                    "manifest_rspec_id":o.getManifestRspecId(),
                     "operational_state":o.getOperationalState(),
                     "subnet":o.getSubnet(),
                     "endpoints":[ep.getSliverURN() for ep in o.getEndpoints()],
@@ -201,7 +204,31 @@ class GramJSONEncoder(json.JSONEncoder):
 # of the JSON encoding of all slices and then all slivers
 def write_state(filename, gram_manager, slices, stitching_handler):
     #print "WS.CALL " + str(slices) + " " + filename
-    file = open(filename, "w")
+    state = []
+    if gram_manager:
+        manager_persistent_state = gram_manager.getPersistentState()
+        state.append({"GRAM_MANAGER_STATE" : manager_persistent_state})
+
+    # Save the SSH address/proxy table
+    state.append({"SSH_PROXY": SSHProxyTable._get()})
+
+    encoder = GramJSONEncoder(stitching_handler)
+    if config.snapshot_format == "binary":
+        # Stream the slices and their slivers into the file
+        def write_data(file):
+            binary_encoder = \
+                snapshot_format.BinarySnapshotEncoder(file, encoder.default)
+            for slice in slices.values():
+                binary_encoder.start_slice()
+                binary_encoder.write_object(encoder.default(slice))
+                for sliver in slice.getAllSlivers().values():
+                    binary_encoder.write_object(encoder.default(sliver))
+            for state_object in state:
+                binary_encoder.write_object(state_object)
+            binary_encoder.close()
+        write_file_atomically(filename, write_data)
+        return
+
     objects = []
     for slice in slices.values(): 
         objects.append(slice)
@@ -212,17 +239,73 @@ def write_state(filename, gram_manager, slices, stitching_handler):
         for sliver in slice.getAllSlivers().values():
             #print " ++ appending : " + str(sliver)
             objects.append(sliver)
-
-    if gram_manager:
-        manager_persistent_state = gram_manager.getPersistentState()
-        objects.append({"GRAM_MANAGER_STATE" : manager_persistent_state})
-
-    # Save the SSH address/proxy table
-    objects.append({"SSH_PROXY": SSHProxyTable._get()})
-
-    data = GramJSONEncoder(stitching_handler).encode(objects)
-    file.write(data)
-    file.close();
+    objects.extend(state)
+
+    data = encoder.encode(objects)
+    write_file_atomically(filename, lambda file: file.write(data))
+
+# Return {urn => JSON encoding} of a slice and of each of its slivers
+def encode_slice(encoder, slice):
+    encoded = {slice.getSliceURN() : encoder.encode(slice)}
+    for sliver_urn, sliver in slice.getAllSlivers().items():
+        encoded[sliver_urn] = encoder.encode(sliver)
+    return encoded
+
+# Write a snapshot in config.snapshot_format from JSON encodings: 
+# encoded_slices is {slice URN => {URN => JSON encoding}} of slices and 
+# their slivers (see encode_slice) and encoded_state a list of JSON
+# encodings of other state
+def write_encoded_state(filename, encoded_slices, encoded_state):
+    if config.snapshot_format == "binary":
+        def write_data(file):
+            binary_encoder = snapshot_format.BinarySnapshotEncoder(file)
+            for slice_urn, encoded in encoded_slices.items():
+                binary_encoder.start_slice()
+                binary_encoder.write_object(json.loads(encoded[slice_urn]))
+                for urn, data in encoded.items():
+                    if urn != slice_urn:
+                        binary_encoder.write_object(json.loads(data))
+            for data in encoded_state:
+                binary_encoder.write_object(json.loads(data))
+            binary_encoder.close()
+        write_file_atomically(filename, write_data)
+        return
+
+    # JSON: slices, then slivers, then other state
+    def write_data(file):
+        file.write("[")
+        separator = ""
+        for slice_urn, encoded in encoded_slices.items():
+            file.write(separator + encoded[slice_urn])
+            separator = ", "
+        for slice_urn, encoded in encoded_slices.items():
+            for urn, data in encoded.items():
+                if urn != slice_urn:
+                    file.write(separator + data)
+        for data in encoded_state:
+            file.write(separator + data)
+            separator = ", "
+        file.write("]")
+    write_file_atomically(filename, write_data)
+
+# Write a file through a temporary file (in a subdirectory of the file's
+# directory) that is renamed into place once it is complete, so a crash
+# never leaves a partly written snapshot.  write_data(file) writes the
+# contents of the file.
+TEMPORARY_SUBDIRECTORY = "tmp"
+def write_file_atomically(filename, write_data):
+    directory = os.path.join(os.path.dirname(filename), TEMPORARY_SUBDIRECTORY)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    temp_filename = os.path.join(directory, os.path.basename(filename))
+    file = open(temp_filename, "wb")
+    try:
+        write_data(file)
+        file.flush()
+        os.fsync(file.fileno())
+    finally:
+        file.close()
+    os.rename(temp_filename, filename)
 
 # Decode JSON representation of list of slices and associated slivers
 # Comes as a list of slices and slivers
@@ -247,6 +330,17 @@ class GramJSONDecoder:
 
         self._network_links_by_urn = {}
 
+        # Rspecs stored on each slice, by rspec ID
+        self._rspecs_by_tenant_uuid = {}
+
+    # Get the request or manifest rspec of a slice or sliver
+    # Older snapshots hold a copy of the rspec in each object, newer
+    # ones the ID of the rspec in the slice's rspecs
+    def _get_rspec(self, json_object, attribute, tenant_uuid):
+        if attribute + "_id" in json_object:
+            rspec_id = json_object[attribute + "_id"]
+            return self._rspecs_by_tenant_uuid[tenant_uuid].get(rspec_id)
+        return json_object.get(attribute)
 
     def decode(self, json_object):
         #print "DECODE : " + str(type(json_object)) + " " + str(json_object) 
@@ -271,8 +365,14 @@ class GramJSONDecoder:
                     expiration_time = \
                         datetime.datetime.fromtimestamp(expiration_timestamp)
                 slice.setExpiration(expiration_time)
-                slice.setManifestRspec(json_object["manifest_rspec"])
-                slice.setRequestRspec(json_object["request_rspec"])
+                self._rspecs_by_tenant_uuid[tenant_uuid] = \
+                    json_object.get("rspecs", {})
+                slice.setManifestRspec(self._get_rspec(json_object,
+                                                       "manifest_rspec",
+                                                       tenant_uuid))
+                slice.setRequestRspec(self._get_rspec(json_object,
+                                                      "request_rspec",
+                                                      tenant_uuid))
                 slice._last_subnet_assigned = json_object['last_subnet_assigned']
                 slice._next_vm_num = json_object['next_vm_num']
                 
@@ -320,8 +420,12 @@ class GramJSONDecoder:
                 vm._os_type = json_object["os_type"]
                 vm._os_version = json_object["os_version"]
                 vm._flavor = json_object["vm_flavor"]
-                vm.setRequestRspec(json_object["request_rspec"])
-                vm.setManifestRspec(json_object["manifest_rspec"])
+                vm.setRequestRspec(self._get_rspec(json_object,
+                                                    "request_rspec",
+                                                    slice_tenant_uuid))
+                vm.setManifestRspec(self._get_rspec(json_object,
+                                                     "manifest_rspec",
+                                                     slice_tenant_uuid))
                 vm.setHost(json_object['host'])
                 last_status_update = None
                 if 'last_status_update' in json_object:
@@ -369,8 +473,12 @@ class GramJSONDecoder:
                 if 'netmask' in json_object: 
                     nic.setNetmask(json_object['netmask'])
                 nic.setVLANTag(json_object["vlan_tag"])
-                nic.setRequestRspec(json_object["request_rspec"])
-                nic.setManifestRspec(json_object["manifest_rspec"])
+                nic.setRequestRspec(self._get_rspec(json_object,
+                                                    "request_rspec",
+                                                    slice_tenant_uuid))
+                nic.setManifestRspec(self._get_rspec(json_object,
+                                                     "manifest_rspec",
+                                                     slice_tenant_uuid))
 
                 # vm
                 self._virtual_machine_by_network_interface_urn[sliver_urn] = virtual_machine_urn
@@ -411,8 +519,12 @@ class GramJSONDecoder:
                 link.setNetworkUUID(json_object["network_uuid"])
                 link.setSubnetUUID(json_object["subnet_uuid"])
                 link.setVLANTag(json_object['vlan_tag'])
-                link.setRequestRspec(json_object["request_rspec"])
-                link.setManifestRspec(json_object["manifest_rspec"]) 
+                link.setRequestRspec(self._get_rspec(json_object,
+                                                    "request_rspec",
+                                                    slice_tenant_uuid))
+                link.setManifestRspec(self._get_rspec(json_object,
+                                                     "manifest_rspec",
+                                                     slice_tenant_uuid)) 
                 link.setControllerURL(json_object['controller_url'])
                
                 self._network_links_by_urn[sliver_urn] = link
@@ -455,30 +567,30 @@ class GramJSONDecoder:
                 network_interface.setLink(link)
                 link.addEndpoint(network_interface)
 
+# Read a snapshot file in any format (see snapshot_format.py)
 def read_state(filename, gram_manager, stitching_handler):
-    file = open(filename, "r")
-    data = file.read()
-    file.close()
-    json_data = json.loads(data)
+    json_data = snapshot_format.iterate_snapshot(filename)
+    return restore_objects(json_data, gram_manager, stitching_handler)
 
-    # This should be a list of JSON-enocded objects
+# Restore slices and slivers (and the gram_manager and SSH proxy state)
+# from the JSON-encoded objects read from a snapshot
+def restore_objects(json_data, gram_manager, stitching_handler):
+    # This should be a list (or iterator) of JSON-enocded objects
     # Need to turn this into a list of objects
     # Resolve links among them
 
-    # Pull the persistent gram_manager state from the json_data
-    if gram_manager:
-        for json_obj in json_data:
-            if "GRAM_MANAGER_STATE" in json_obj:
-                manager_persistent_state = json_obj['GRAM_MANAGER_STATE']
-                gram_manager.setPersistentState(manager_persistent_state)
-#                print "GMPS = %s " % gram_manager.getPersistentState()
-            elif "SSH_PROXY" in json_obj:
-                # Restore SSH Proxy table (IP address to port)
-                SSHProxyTable._restore(json_obj['SSH_PROXY'])
-
     slices = dict()
     decoder = GramJSONDecoder(stitching_handler)
     for json_object in json_data: 
+        # Pull the persistent gram_manager state from the json_data
+        if gram_manager:
+            if "GRAM_MANAGER_STATE" in json_object:
+                manager_persistent_state = json_object['GRAM_MANAGER_STATE']
+                gram_manager.setPersistentState(manager_persistent_state)
+#                print "GMPS = %s " % gram_manager.getPersistentState()
+            elif "SSH_PROXY" in json_object:
+                # Restore SSH Proxy table (IP address to port)
+                SSHProxyTable._restore(json_object['SSH_PROXY'])
         decoder.decode(json_object)
     decoder.resolve()
 
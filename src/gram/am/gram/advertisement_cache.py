@@ -0,0 +1,120 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Cache of the advertisement RSpec returned by ListResources.
+#
+# Building the advertisement (rspec_handler.generateAdvertisement) lists
+# every flavor and disk image for every compute node and renders the
+# stitching advertisement, and monitoring probes ask for it every few
+# seconds.  The advertisement is kept with its compressed (zlib, base64)
+# form and built again only when what it is built from changes: the
+# flavors, the compute hosts or the VLAN tags available at the stitching
+# edge points.  The flavors and compute hosts come from the inventory
+# cache, so comparing them costs no OpenStack calls.  The disk images
+# advertised are those of config.disk_image_metadata.
+
+import base64
+import threading
+import zlib
+
+import config
+import open_stack_interface
+import rspec_handler
+from resources import GramImageInfo
+
+
+class AdvertisementCache:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None # What the cached advertisement was built from
+        self._advertisement = None
+        self._compressed_advertisement = None
+        self._hits = 0
+        self._builds = 0
+
+    def _getSignature(self, am_urn, stitching_handler):
+        flavors = open_stack_interface._listFlavors().items()
+        flavors.sort()
+        compute_hosts = GramImageInfo.get_compute_hosts().keys()
+        compute_hosts.sort()
+        vlans_version = None
+        if stitching_handler:
+            vlans_version = stitching_handler.getAvailabilityVersion()
+        return (am_urn, tuple(flavors), tuple(compute_hosts), vlans_version)
+
+    def get(self, am_urn, stitching_handler = None, compressed = False):
+        """
+            Return the advertisement RSpec for the aggregate, or its zlib
+            compressed base64 encoding if compressed is set (the
+            uncompressed RSpec if compressing it failed)
+        """
+        self._lock.acquire()
+        try:
+            signature = self._getSignature(am_urn, stitching_handler)
+            if signature == self._signature:
+                self._hits += 1
+            else:
+                # Compute the signature before building: if anything
+                # changes while building, the next call builds again
+                self._advertisement = \
+                    rspec_handler.generateAdvertisement(am_urn,
+                                                        stitching_handler)
+                try:
+                    self._compressed_advertisement = \
+                        base64.b64encode(zlib.compress(self._advertisement))
+                except Exception, e:
+                    config.logger.error("Error compressing and encoding resource list: %s" % e)
+                    self._compressed_advertisement = None
+                self._signature = signature
+                self._builds += 1
+            if compressed and self._compressed_advertisement is not None:
+                return self._compressed_advertisement
+            return self._advertisement
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        """
+            Discard the cached advertisement (e.g. because the 
+            configuration it is built from changed)
+        """
+        self._lock.acquire()
+        try:
+            self._signature = None
+        finally:
+            self._lock.release()
+
+    def getStatistics(self):
+        """
+            Returns {'hits', 'builds'}
+        """
+        self._lock.acquire()
+        try:
+            return {'hits' : self._hits, 'builds' : self._builds}
+        finally:
+            self._lock.release()
+
+
+# The cache shared by the aggregate manager
+advertisement = AdvertisementCache()
@@ -28,17 +28,72 @@
 #   (to be called by GRAM on the control node)
 # And a server interface
 #   (to be invoked in 'sudo' mode on each compute node
+#
+# Messages in both directions are JSON, each preceded by its length as a
+# 4 byte (network order) integer.  A request is either
+#    {'command' : command, 'args' : args}
+# answered by {'output' : command output} or {'error' : message}, or
+#    {'batch' : [{'command' : command, 'args' : args}, ...]}
+# answered by {'results' : [{'output' : ...} or {'error' : ...}, ...]}.
+# The client keeps connections open and reuses them for later requests
+# to the same compute node.  The server also still accepts the unframed
+# single-request protocol of earlier GRAM releases, and the client falls
+# back to it for compute nodes that still run an earlier server.
 
 
 import SocketServer
 import json
 import socket
+import struct
 import subprocess
 import tempfile
+import threading
+import time
 
 import config
 
-MAX_SIZE = 8192
+MAX_SIZE = 8192 # Request size for the old unframed protocol
+
+_LENGTH_FORMAT = '!I'
+_LENGTH_SIZE = struct.calcsize(_LENGTH_FORMAT)
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+# How long to use the unframed protocol for a compute node whose server
+# didn't answer a framed request before trying a framed request again
+LEGACY_RECHECK_INTERVAL = 600
+
+
+class ComputeNodeInterfaceError(Exception):
+    pass
+
+
+def _send_message(sock, message):
+    data = json.dumps(message)
+    sock.sendall(struct.pack(_LENGTH_FORMAT, len(data)) + data)
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None # Connection closed
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+# Returns the next message, or None if the connection was closed
+def _recv_message(sock):
+    header = _recv_exactly(sock, _LENGTH_SIZE)
+    if header is None:
+        return None
+    size = struct.unpack(_LENGTH_FORMAT, header)[0]
+    if size > MAX_MESSAGE_SIZE:
+        raise ComputeNodeInterfaceError("Message too large: %d bytes" % size)
+    data = _recv_exactly(sock, size)
+    if data is None:
+        raise ComputeNodeInterfaceError("Connection closed mid-message")
+    return json.loads(data)
+
 
 # Server interface
 class ComputeNodeInterfaceHandler(SocketServer.BaseRequestHandler):
@@ -56,46 +111,246 @@ class ComputeNodeInterfaceHandler(SocketServer.BaseRequestHandler):
         command = []
         for i in range(len(command_template)):
             value = command_template[i]
+            # JSON turns the integer keys of args into strings
             if args.has_key(i):
                 value = command_template[i] % args[i]
+            elif args.has_key(str(i)):
+                value = command_template[i] % args[str(i)]
             command.append(value)
         return command
 
+    def run_command(self, command_and_args):
+        command = command_and_args.get('command')
+        args = command_and_args.get('args', {})
+        if not ComputeNodeInterfaceHandler._PERMITTED_COMMANDS.has_key(command):
+            return {'error' : 'Illegal command: %s' % command}
+        command_template = ComputeNodeInterfaceHandler._PERMITTED_COMMANDS[command]
+        command_array = self.apply_arguments_to_template(command_template, args)
+        try:
+            return {'output' : subprocess.check_output(command_array)}
+        except Exception, e:
+            return {'error' : str(e)}
+
     def handle(self):
+        first = self.request.recv(1, socket.MSG_PEEK)
+        if first == '{':
+            self.handle_unframed()
+            return
+        while True:
+            try:
+                request = _recv_message(self.request)
+            except socket.error:
+                return # Client reset the connection
+            if request is None:
+                return # Client closed the connection
+            if request.has_key('batch'):
+                response = {'results' : [self.run_command(command_and_args) \
+                                             for command_and_args \
+                                             in request['batch']]}
+            else:
+                response = self.run_command(request)
+            _send_message(self.request, response)
+
+    # Single unframed request from an older client
+    def handle_unframed(self):
         command_and_args_json = self.request.recv(MAX_SIZE).strip()
-#        print "Got " + command_and_args_json
         command_and_args = json.loads(command_and_args_json)
-#        print "CAA = " + str(command_and_args)
-        command = command_and_args['command']
-        args = command_and_args['args']
-        if ComputeNodeInterfaceHandler._PERMITTED_COMMANDS.has_key(command):
-            command_template = ComputeNodeInterfaceHandler._PERMITTED_COMMANDS[command]
-            command_array = self.apply_arguments_to_template(command_template, args)
-#           print "CL = " + str(command_array)
-            response = subprocess.check_output(command_array)
-#           print "Sending " + response
-            self.request.sendall(response)
+        response = self.run_command(command_and_args)
+        if response.has_key('output'):
+            self.request.sendall(response['output'])
+
+
+class ComputeNodeInterfaceServer(SocketServer.ThreadingMixIn,
+                                 SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+# Idle client connections to compute nodes, for reuse
+class ComputeNodeConnectionPool:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {} # compute host => list of sockets
+
+    def get(self, compute_host):
+        """
+            Returns (socket, True) for an idle connection to the host or
+            (socket, False) for a new connection
+        """
+        self._lock.acquire()
+        try:
+            sockets = self._idle.get(compute_host)
+            if sockets:
+                return sockets.pop(), True
+        finally:
+            self._lock.release()
+        sock = socket.create_connection((compute_host,
+                                         config.compute_node_interface_port),
+                                        config.compute_node_interface_timeout)
+        return sock, False
+
+    def put(self, compute_host, sock):
+        self._lock.acquire()
+        try:
+            sockets = self._idle.setdefault(compute_host, [])
+            if len(sockets) < config.compute_node_interface_pool_size:
+                sockets.append(sock)
+                return
+        finally:
+            self._lock.release()
+        sock.close()
+
+    def close_all(self):
+        self._lock.acquire()
+        try:
+            for sockets in self._idle.values():
+                for sock in sockets:
+                    sock.close()
+            self._idle = {}
+        finally:
+            self._lock.release()
+
+_pool = ComputeNodeConnectionPool()
+
+
+# Compute nodes that run the unframed server of an earlier GRAM release
+# (compute host => time we found out).  That server fails on the length
+# prefix of a framed request and closes the connection without answering.
+_legacy_hosts = {}
+_legacy_hosts_lock = threading.Lock()
+
+def _is_legacy_host(compute_host):
+    _legacy_hosts_lock.acquire()
+    try:
+        found_time = _legacy_hosts.get(compute_host)
+        if found_time is None:
+            return False
+        if time.time() - found_time > LEGACY_RECHECK_INTERVAL:
+            # The compute node may have been upgraded since
+            del _legacy_hosts[compute_host]
+            return False
+        return True
+    finally:
+        _legacy_hosts_lock.release()
+
+def _set_legacy_host(compute_host):
+    _legacy_hosts_lock.acquire()
+    try:
+        _legacy_hosts[compute_host] = time.time()
+    finally:
+        _legacy_hosts_lock.release()
+
+# Send a single command to a compute node with the unframed protocol: the
+# JSON command on a new connection, answered by the command's output
+# until the server closes the connection (nothing if the command failed)
+def _unframed_request(compute_host, command_and_args):
+    sock = socket.create_connection((compute_host,
+                                     config.compute_node_interface_port),
+                                    config.compute_node_interface_timeout)
+    chunks = []
+    try:
+        sock.sendall(json.dumps(command_and_args))
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+    output = ''.join(chunks)
+    if not output:
+        return {'error' : 'No output from compute node'}
+    return {'output' : output}
+
+# Answer a (framed protocol) request with unframed requests, one per command
+def _legacy_request(compute_host, request):
+    if request.has_key('batch'):
+        return {'results' : [_unframed_request(compute_host, command_and_args) \
+                                 for command_and_args in request['batch']]}
+    return _unframed_request(compute_host, request)
+
+# Send a request to the compute node over a pooled connection and return
+# the response.  A reused connection may have been closed by the server
+# while idle: if so, retry on a new connection.  (The permitted commands
+# only report state, so running one twice is harmless.)  If a new
+# connection is closed without an answer, the compute node runs an
+# earlier server: use the unframed protocol.
+def _request(compute_host, request):
+    if _is_legacy_host(compute_host):
+        return _legacy_request(compute_host, request)
+    while True:
+        sock, reused = _pool.get(compute_host)
+        try:
+            _send_message(sock, request)
+            response = _recv_message(sock)
+        except socket.timeout:
+            sock.close()
+            if reused:
+                continue
+            raise
+        except socket.error:
+            sock.close()
+            if reused:
+                continue
+            response = None # Reset by the server
+        except Exception:
+            sock.close()
+            if reused:
+                continue
+            raise
+        if response is None:
+            sock.close()
+            if reused:
+                continue
+            config.logger.info("Compute node %s didn't answer a framed request: using the unframed protocol" % \
+                                   compute_host)
+            _set_legacy_host(compute_host)
+            return _legacy_request(compute_host, request)
+        _pool.put(compute_host, sock)
+        return response
 
 # Client interface the way it should be once the port is open
-# Open a client connection, send command and receive response
+# Send command and receive response
 # The command is a number, only among the set defined in ComputeNodeInterfaceHandler above
 # The arguments are a dictionary that maps command value indices (0 for the first, 1 for the second)
 # To values that should be template substituted
+# Returns the output of the command, or None if the command failed
 def compute_node_command(compute_host, command, args = {}):
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     results = None
     if not ComputeNodeInterfaceHandler._PERMITTED_COMMANDS.has_key(command):
         config.logger.error("Illegal command for compute node interface : " + str(command))
         return results
 
-    command_and_args = {'command':command, 'args':args}
-    try:
-        sock.connect((compute_host, config.compute_node_interface_port))
-        sock.send(json.dumps(command_and_args))
-        results = sock.recv(MAX_SIZE)
-    finally:
-        sock.close()
-    return results
+    response = _request(compute_host, {'command':command, 'args':args})
+    if response.has_key('error'):
+        config.logger.error("Command %s failed on %s : %s" % \
+                                (command, compute_host, response['error']))
+        return results
+    return response['output']
+
+# Run several commands on a compute node in one round trip
+# commands is a list of (command, args) pairs
+# Returns a list of the commands' outputs (None for a command that failed)
+def compute_node_batch(compute_host, commands):
+    batch = []
+    for command, args in commands:
+        if not ComputeNodeInterfaceHandler._PERMITTED_COMMANDS.has_key(command):
+            config.logger.error("Illegal command for compute node interface : " + str(command))
+            return [None for command in commands]
+        batch.append({'command':command, 'args':args})
+
+    response = _request(compute_host, {'batch' : batch})
+    outputs = []
+    for command_and_args, result in zip(batch, response['results']):
+        if result.has_key('error'):
+            config.logger.error("Command %s failed on %s : %s" % \
+                                    (command_and_args['command'],
+                                     compute_host, result['error']))
+            outputs.append(None)
+        else:
+            outputs.append(result['output'])
+    return outputs
 
 if __name__ == "__main__":
     import sys
@@ -104,11 +359,18 @@ if __name__ == "__main__":
         host_port = (socket.gethostname(), config.compute_node_interface_port)
         print "Starting command_node_interface server on port " + \
             str(config.compute_node_interface_port)
-        server = SocketServer.TCPServer(host_port, ComputeNodeInterfaceHandler)
+        server = ComputeNodeInterfaceServer(host_port,
+                                            ComputeNodeInterfaceHandler)
         server.serve_forever()
     else:
-        # Client case : compute_node_interface host command
+        # Client case : compute_node_interface host command [command...]
         compute_host = sys.argv[1]
-        command = int(sys.argv[2])
-        result = compute_node_command(compute_host, command)
-        print "RESULT = " + str(result)
+        commands = [int(command) for command in sys.argv[2:]]
+        if len(commands) == 1:
+            result = compute_node_command(compute_host, commands[0])
+            print "RESULT = " + str(result)
+        else:
+            results = compute_node_batch(compute_host, 
+                                         [(command, {}) for command in commands])
+            for command, result in zip(commands, results):
+                print "RESULT %d = %s" % (command, result)
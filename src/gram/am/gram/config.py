@@ -77,6 +77,48 @@ gram_snapshot_directory = '/etc/gram/snapshots' # Directory of snapshots
 recover_from_snapshot = "" # Specific file from which to recover 
 recover_from_most_recent_snapshot = True # Should we restore from most recent
 snapshot_maintain_limit = 10 # Remove all snapshots earlier than this #
+# Also remove snapshots older than this many days (0: no age limit)
+snapshot_maintain_days = 0
+# Seconds between background removals of old snapshots (they are also
+# removed as soon as there are more than snapshot_maintain_limit)
+snapshot_prune_interval = 300
+# Format of new snapshots: 'json' or 'binary' (see snapshot_format.py).
+# Snapshots of either format can be restored.
+snapshot_format = 'json'
+# Persist state changes to an append-only journal (see state_journal.py)
+# rather than writing a full snapshot after every change
+state_journal = False
+# Write a checkpoint snapshot and start a new journal segment after
+# this many journal records
+state_journal_compact_records = 5000
+# When not journaling, write snapshots in a background thread, merging
+# requests made while a snapshot is being written.  Deletes still wait
+# for their snapshot to be written.
+async_snapshots = True
+
+# Slivers are deleted when they expire, at most this many at a time
+expiry_batch_size = 50
+# Seconds to wait before trying again to delete expired slivers that
+# failed to be deleted
+expiry_retry_seconds = 300
+
+# Housekeeping of the OpenStack databases (see housekeeping.py): run every
+# this many seconds, deleting at most housekeeping_batch_size rows per
+# transaction, removing Keystone tokens expired for token_retention_days
+housekeeping_interval = 3000
+housekeeping_batch_size = 1000
+token_retention_days = 1
+
+# At startup, check the restored slices against OpenStack in the
+# background, serving requests meanwhile (slices not yet checked wait).
+# The OpenStack listings are made up to reconcile_concurrency at a time.
+reconcile_in_background = True
+reconcile_concurrency = 8
+# The most VMs Nova returns for one list request (its osapi_max_limit).  A
+# 'nova list' that returns this many VMs may have been cut short, so a
+# slice whose tenant has this many VMs listed isn't deleted.  (The REST
+# backend pages through the listing instead.)
+nova_max_limit = 1000
 
 # File where GRAM stores the subnet number for the last allocated sub-net
 # This is used in resources.py.  This file is temporary.  It should not be
@@ -169,6 +211,7 @@ network_user = "quantum"
 network_password = None
 service_password = "service"
 network_database = "quantum"
+keystone_database = "keystone"
 gmoc_user = "gram"
 gmoc_password = ' '
 
@@ -189,6 +232,61 @@ os_no_cache = 1
 service_token = None
 service_endpoint = "http://localhost:35357/v2.0"
 
+# How GRAM talks to OpenStack: 'cli' runs the nova/neutron/keystone
+# command line clients, 'rest' calls the OpenStack APIs directly
+# (open_stack_rest.py) and falls back to the CLIs if it can't authenticate
+openstack_api = 'cli'
+openstack_api_timeout = 60 # Seconds before an API request times out
+openstack_api_pool_size = 8 # Idle keep-alive connections kept per endpoint
+
+# Ask the quantum/neutron command line client for JSON ('-f json') output
+# rather than ASCII tables.  Set to False for clients that don't support it.
+network_cli_json_output = True
+
+# Seconds for which OpenStack inventory listings (hosts, hypervisors,
+# routers, users, images, flavors) are cached before being fetched again.
+# GRAM also refetches a listing after it creates or deletes such objects.
+inventory_cache_ttls = {'hosts' : 300, 'hypervisors' : 300,
+                        'routers' : 60, 'users' : 60,
+                        'images' : 6000, 'flavors' : 6000,
+                        'ovs_vlans' : 60}
+inventory_cache_default_ttl = 60 # For listings not in inventory_cache_ttls
+
+# Maximum number of OpenStack calls (network, subnet, port creation and
+# the like) run in parallel while provisioning a slice
+provision_concurrency = 8
+# Maximum number of OpenStack calls (VM, port, network deletion and the
+# like) run in parallel while deleting slivers
+teardown_concurrency = 8
+
+# Limits on the number of VMs being created (booted and waited for) at
+# once, over all slices and for a single slice, and on the number of VM
+# creation requests waiting for a worker.  A provision call waits while
+# its slice is at its limit or the queue is full.
+vm_creation_max_concurrent = 10
+vm_creation_max_per_slice = 5
+vm_creation_queue_size = 50
+# How often nova rate limited VM boot requests are retried, and the base
+# of the (randomized, exponential) delay between retries, in seconds
+vm_creation_max_retries = 5
+vm_creation_retry_backoff = 2
+# Seconds between polls of a booting VM's status
+vm_boot_poll_interval = 5
+
+# In asynchronous provisioning mode, Provision returns as soon as nova has
+# accepted the VM boot requests, and a background watcher tracks the VMs
+# (polling all VM states with one list call every vm_watcher_poll_interval
+# seconds) and finishes setting them up once they are ACTIVE
+async_provisioning = False
+vm_watcher_poll_interval = 5
+
+# The status of a slice's VMs is fetched from OpenStack at most every
+# vm_status_refresh_interval seconds; Status and Describe calls in between
+# share the result.  Up to vm_status_concurrency console logs (for images
+# with a boot_complete_msg) are fetched in parallel.
+vm_status_refresh_interval = 2
+vm_status_concurrency = 8
+
 # Installation configuration
 network_type = "quantum"
 openstack_type = "grizzly"
@@ -197,6 +295,15 @@ switch_type = "dell"
 # TCP port over which metadata is transmitted
 metadata_port = 8775
 
+# TCP port of the compute node interface server (compute_node_interface.py)
+# on each compute node, and the client's timeout (in seconds) and maximum
+# number of idle connections kept open per compute node
+compute_node_interface_port = 7002
+compute_node_interface_timeout = 30
+compute_node_interface_pool_size = 4
+# Maximum number of compute nodes queried in parallel
+compute_node_interface_concurrency = 16
+
 # Hostname of control node
 control_host = None
 control_host_addr = None
@@ -0,0 +1,195 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Expire slivers when their expiration time comes.
+#
+# The aggregate manager schedules slivers when their expiration times are
+# set (allocate, provision, renew and restore) and unschedules them when
+# they are deleted.  Scheduled slivers are kept in a heap ordered by
+# expiration time; rescheduling or unscheduling a sliver leaves its old
+# heap entry in place, to be discarded when it reaches the top of the
+# heap (the heap is rebuilt if too many such entries accumulate).  A
+# thread sleeps until the earliest expiration time, then hands the
+# expired slivers, at most config.expiry_batch_size at a time, to the
+# aggregate manager to be deleted.  Slivers that fail to be deleted are
+# tried again after config.expiry_retry_seconds.
+
+import datetime
+import heapq
+import threading
+
+import config
+from resources import SliverURNtoSliceObject
+
+# Slivers without an expiration time are expired right away
+_NO_EXPIRATION = datetime.datetime.min
+
+
+def _seconds_until(expiration) :
+    delta = expiration - datetime.datetime.utcnow()
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+
+class ExpiryScheduler :
+
+    def __init__(self, expire_slivers) :
+        # Called as expire_slivers(slice_object, sliver_objects) to delete
+        # expired slivers of a slice
+        self._expire_slivers = expire_slivers
+        self._condition = threading.Condition(threading.Lock())
+        self._heap = [] # (expiration, sliver URN)
+        self._expirations = {} # Sliver URN => expiration it's scheduled for
+        self._num_expired = 0
+        self._thread = None
+
+    def schedule(self, slivers) :
+        """
+            Schedule the given slivers to be expired at their expiration
+            times (replacing any times they were scheduled for before)
+        """
+        self._condition.acquire()
+        try :
+            for sliver in slivers :
+                sliver_urn = sliver.getSliverURN()
+                expiration = sliver.getExpiration()
+                if expiration is None : expiration = _NO_EXPIRATION
+                if self._expirations.get(sliver_urn) == expiration : continue
+                self._expirations[sliver_urn] = expiration
+                heapq.heappush(self._heap, (expiration, sliver_urn))
+            self._compact()
+            # The earliest expiration may have changed
+            self._condition.notifyAll()
+        finally :
+            self._condition.release()
+
+    def unschedule(self, slivers) :
+        """
+            Stop tracking the expiration of the given (deleted) slivers
+        """
+        self._condition.acquire()
+        try :
+            for sliver in slivers :
+                self._expirations.pop(sliver.getSliverURN(), None)
+            self._compact()
+        finally :
+            self._condition.release()
+
+    def getStatistics(self) :
+        self._condition.acquire()
+        try :
+            next_expiration = None
+            if len(self._heap) > 0 : next_expiration = str(self._heap[0][0])
+            return {'scheduled' : len(self._expirations),
+                    'heap_entries' : len(self._heap),
+                    'next_expiration' : next_expiration,
+                    'expired' : self._num_expired}
+        finally :
+            self._condition.release()
+
+    # Called with self._condition held: rebuild the heap if most of its
+    # entries are for slivers that have been rescheduled or unscheduled
+    def _compact(self) :
+        if len(self._heap) > 2 * len(self._expirations) + 100 :
+            self._heap = [(expiration, sliver_urn) for sliver_urn, expiration \
+                              in self._expirations.items()]
+            heapq.heapify(self._heap)
+
+    # Called with self._condition held: is the top of the heap current?
+    def _top_is_current(self) :
+        expiration, sliver_urn = self._heap[0]
+        return self._expirations.get(sliver_urn) == expiration
+
+    def start(self) :
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _run(self) :
+        while True :
+            self._expire(self._wait_for_expired_slivers())
+
+    def _wait_for_expired_slivers(self) :
+        """
+            Wait until slivers have expired; return the URNs of up to 
+            config.expiry_batch_size of them
+        """
+        self._condition.acquire()
+        try :
+            while True :
+                while len(self._heap) > 0 and not self._top_is_current() :
+                    heapq.heappop(self._heap)
+                if len(self._heap) == 0 :
+                    self._condition.wait()
+                    continue
+                delay = _seconds_until(self._heap[0][0])
+                if delay > 0 :
+                    self._condition.wait(delay)
+                    continue
+                sliver_urns = []
+                now = datetime.datetime.utcnow()
+                while len(self._heap) > 0 and \
+                        len(sliver_urns) < config.expiry_batch_size and \
+                        self._heap[0][0] <= now :
+                    if self._top_is_current() :
+                        del self._expirations[self._heap[0][1]]
+                        sliver_urns.append(self._heap[0][1])
+                    heapq.heappop(self._heap)
+                if len(sliver_urns) > 0 :
+                    return sliver_urns
+        finally :
+            self._condition.release()
+
+    def _expire(self, sliver_urns) :
+        # Group the slivers by slice
+        slivers_by_slice = {}
+        slice_objects = {}
+        for sliver_urn in sliver_urns :
+            slice_object, sliver = \
+                SliverURNtoSliceObject.get_sliver_object(sliver_urn)
+            if slice_object is None : continue # Already deleted
+            slice_urn = slice_object.getSliceURN()
+            slice_objects[slice_urn] = slice_object
+            slivers_by_slice.setdefault(slice_urn, []).append(sliver)
+        for slice_urn, slivers in slivers_by_slice.items() :
+            config.logger.info("Expiring %d slivers of slice %s" % \
+                                   (len(slivers), slice_urn))
+            try :
+                self._expire_slivers(slice_objects[slice_urn], slivers)
+                self._num_expired += len(slivers)
+            except Exception, e :
+                config.logger.error("Failed to expire slivers of %s: %s" % \
+                                        (slice_urn, e))
+                self._retry(slivers)
+
+    def _retry(self, slivers) :
+        retry_time = datetime.datetime.utcnow() + \
+            datetime.timedelta(seconds=config.expiry_retry_seconds)
+        self._condition.acquire()
+        try :
+            for sliver in slivers :
+                sliver_urn = sliver.getSliverURN()
+                if sliver_urn in self._expirations : continue # Rescheduled
+                self._expirations[sliver_urn] = retry_time
+                heapq.heappush(self._heap, (retry_time, sliver_urn))
+        finally :
+            self._condition.release()
@@ -32,13 +32,25 @@ import time
 import config
 import constants
 from gcf.sfa.trust.certificate import Certificate
+from gcf.geni.am.am3 import ApiErrorException, AM_API
 from resources import GramImageInfo, Slice, VirtualMachine, NetworkLink
+from resources import NetworkInterface
+from resources import SliverURNtoSliceObject
 import rspec_handler
+import rspec_parser
 import open_stack_interface
 import stitching
 import utils
 import vlan_pool
 import Archiving
+import inventory_cache
+import advertisement_cache
+import expiry_scheduler
+import housekeeping
+import reconcile
+import snapshot_catalog
+import snapshot_writer
+import state_journal
 import threading
 import thread
 
@@ -87,6 +99,9 @@ class GramManager :
         Only one instances of this class is created.
     """
     def __init__(self, certfile) :
+        startup_time = time.time()
+        self._startup_phases = [] # (phase name, seconds) in order
+        self._reconciler = None
 
         # Grab the certfile and extract the aggregate URN
         self._certfile = certfile
@@ -101,15 +116,22 @@ class GramManager :
         self._internal_vlans = \
             vlan_pool.VLANPool(config.internal_vlans, "INTERNAL")
 
-        open_stack_interface.init() # OpenStack related initialization
+        # OpenStack related initialization
+        self._run_startup_phase('OpenStack initialization', 
+                                open_stack_interface.init)
 
         # Set up a signal handler to clean up on a control-c
         # signal.signal(signal.SIGINT, open_stack_interface.cleanup)
 
         self._snapshot_directory = None
+        self._journal = None # state_journal.StateJournal, if journaling
+        self._snapshot_writer = None # snapshot_writer.SnapshotWriter, if any
+        self._snapshot_catalog = None # snapshot_catalog.SnapshotCatalog
         if config.gram_snapshot_directory:
             self._snapshot_directory = \
                 config.gram_snapshot_directory + "/" + getpass.getuser()
+            self._snapshot_catalog = \
+                snapshot_catalog.SnapshotCatalog(self._snapshot_directory)
 
         # Set max allocation and lease times
         self._max_alloc_time = \
@@ -128,24 +150,68 @@ class GramManager :
             VMOCClientInterface.startup()
             config.logger.info("Started VMOC Client Interface from gram manager")
 
+        # Slivers are deleted when they expire
+        self._expiry_scheduler = \
+            expiry_scheduler.ExpiryScheduler(self.expire_slivers)
+
         # Recover state from snapshot, if configured to do so
-        self.restore_state()
+        self._run_startup_phase('restore state', self.restore_state)
 
         # Reconcile restored state with state of OpenStack
         # Are any resources no longer there? If so delete slices
-        self.reconcile_state()
+        # (in the background if so configured)
+        self._run_startup_phase('reconcile', self.reconcile_state)
 
         # If any slices restored from snapshot, report to VMOC
-        with SliceURNtoSliceObject._lock:
-            for slice_name in SliceURNtoSliceObject._slices:
-                the_slice = SliceURNtoSliceObject._slices[slice_name]
-                self.registerSliceToVMOC(the_slice)
+        self._run_startup_phase('VMOC registration', self.register_slices)
         
-        # Remove extraneous snapshots
-        self.prune_snapshots()
+        # Remove extraneous snapshots, now and in the background
+        self._run_startup_phase('prune snapshots', self.prune_snapshots)
+        if self._snapshot_catalog:
+            self._snapshot_catalog.start()
+
+        self._expiry_scheduler.start()
+
+        # Clean up the OpenStack databases periodically
+        self._housekeeper = housekeeping.Housekeeper( \
+            housekeeping.mysql_database(config.keystone_database,
+                                        config.keystone_user),
+            housekeeping.mysql_database(config.network_database,
+                                        config.network_user),
+            open_stack_interface._listTenantUUIDs)
+        self._housekeeper.start()
 
         thread.start_new_thread(self.periodic_cleanup,())
 
+        startup_message = "GRAM manager started in %.2f sec" % \
+            (time.time() - startup_time)
+        if config.reconcile_in_background:
+            startup_message += " (reconciling in the background)"
+        config.logger.info(startup_message)
+
+    # Run one phase of startup, logging and recording how long it took
+    def _run_startup_phase(self, name, function):
+        start_time = time.time()
+        function()
+        duration = time.time() - start_time
+        self._startup_phases.append((name, duration))
+        config.logger.info("Startup phase %s took %.2f sec" % (name, duration))
+
+    # Return the startup phases and their durations, and the progress of
+    # reconciliation
+    def getStartupStatistics(self):
+        statistics = {'phases' : list(self._startup_phases)}
+        if self._reconciler:
+            statistics['reconcile'] = self._reconciler.getStatistics()
+        return statistics
+
+    # Report all slices to VMOC
+    def register_slices(self):
+        with SliceURNtoSliceObject._lock:
+            slice_objects = SliceURNtoSliceObject._slices.values()
+        for the_slice in slice_objects:
+            self.registerSliceToVMOC(the_slice)
+
     def getStitchingState(self) : return self._stitching
 
     # Maintain some persistent state on the gram manager that 
@@ -187,13 +253,17 @@ class GramManager :
             SliceURNtoSliceObject.set_slice_object(slice_urn, slice_object)
 
         # Lock this slice so nobody else can mess with it during allocation
-        with slice_object.getLock() :
+        # Allocation only changes the in-memory state of the slice, so it
+        # holds the slice's state lock for writing throughout
+        with slice_object.getLock(), slice_object.getWriteLock() :
             # Parse the request rspec.  Get back any error message from parsing
             # the rspec and a list of slivers created while parsing
             # Also OF controller, if any
+            # The parsed rspec is shared with the stitching handler below
+            request = rspec_parser.parse(rspec)
             err_output, err_code, slivers, controller_link_info = \
                 rspec_handler.parseRequestRspec(self._aggregate_urn,
-                                                slice_object, rspec, 
+                                                slice_object, request, 
                                                 self._stitching)
 
             if err_output != None :
@@ -244,6 +314,7 @@ class GramManager :
 
             # Set expiration time on the slice itself
                 slice_object.setExpiration(expiration);
+            self.schedule_expiration(slivers)
 
             # Associate an external VLAN tag with every 
             # stitching link
@@ -253,7 +324,7 @@ class GramManager :
             for link_sliver_object in slice_object.getNetworkLinks():
                 success, error_string, error_code = \
                     self._stitching.allocate_external_vlan_tags(link_sliver_object, \
-                                                                    rspec, is_v2_allocation)
+                                                                    request, is_v2_allocation)
                 if not success:
                     self.cleanup_slivers(slivers, slice_object)
                     return {'code' : {'geni_code' : error_code}, 'value' : "",
@@ -296,7 +367,7 @@ class GramManager :
                     sliver.setUserURN(user_urn)
 
             # Persist aggregate state
-            self.persist_state()
+            self.persist_state(slice_object)
 
             # Create a sliver status list for the slivers allocated by this call
             sliver_status_list = \
@@ -323,15 +394,6 @@ class GramManager :
             err_str = 'No slivers to be provisioned.'
             return {'code': code, 'value': '', 'output': err_str}
 
-        # Make sure slivers have been allocated before we provision them.
-        # Return an error if even one of the slivers has not been allocated
-        for sliver in sliver_objects :
-            if sliver.getAllocationState() != constants.allocated :
-                # Found a sliver that has not been allocated.  Return with error.
-                code = {'geni_code': constants.REQUEST_PARSE_FAILED}
-                err_str = 'Slivers to be provisioned must have allocation state geni_allocated'
-                return {'code': code, 'value': '', 'output': err_str}
-                
         # See if the geni_users option has been set.  This option is used to
         # specify user accounts to be created on virtual machines that are
         # provisioned by this call
@@ -341,7 +403,18 @@ class GramManager :
             users = list()
         
         # Lock this slice so nobody else can mess with it during provisioning
+        # The slice's state lock is not held while OpenStack resources are
+        # created, so Status and Describe calls can proceed
         with slice_object.getLock() :
+            # Make sure slivers have been allocated before we provision them.
+            # Return an error if even one of the slivers has not been allocated
+            for sliver in sliver_objects :
+                if sliver.getAllocationState() != constants.allocated :
+                    # Found a sliver that has not been allocated.  Return with error.
+                    code = {'geni_code': constants.REQUEST_PARSE_FAILED}
+                    err_str = 'Slivers to be provisioned must have allocation state geni_allocated'
+                    return {'code': code, 'value': '', 'output': err_str}
+
             err_str = open_stack_interface.provisionResources(slice_object,
                                                               sliver_objects,
                                                               users, self)
@@ -356,29 +429,31 @@ class GramManager :
             # Set expiration times on the allocated resources
             expiration = utils.min_expire(creds, self._max_lease_time,
                          'geni_end_time' in options and options['geni_end_time'])
-            for sliver in sliver_objects :
-                sliver.setExpiration(expiration)
-
-            # Generate a manifest rpsec 
-            req_rspec = slice_object.getRequestRspec()
-            manifest, error_string, error_code =  \
-                rspec_handler.generateManifestForSlivers(slice_object,
-                                                         sliver_objects,
-                                                         True,
-                                                         False,
-                                                         self._aggregate_urn,
-                                                         self._stitching)
+            with slice_object.getWriteLock() :
+                for sliver in sliver_objects :
+                    sliver.setExpiration(expiration)
+            self.schedule_expiration(sliver_objects)
+
+            with slice_object.getReadLock() :
+                # Generate a manifest rpsec 
+                manifest, error_string, error_code =  \
+                    rspec_handler.generateManifestForSlivers(slice_object,
+                                                             sliver_objects,
+                                                             True,
+                                                             False,
+                                                             self._aggregate_urn,
+                                                             self._stitching)
 
-            if error_code != constants.SUCCESS:
-                return {'code' : {'geni_code' : error_code}, 'value' : "", 
-                        'output' : error_string}
+                if error_code != constants.SUCCESS:
+                    return {'code' : {'geni_code' : error_code}, 'value' : "", 
+                            'output' : error_string}
     
-            # Create a sliver status list for the slivers that were provisioned
-            sliver_status_list = \
-                utils.SliverList().getStatusOfSlivers(sliver_objects)
+                # Create a sliver status list for the slivers that were provisioned
+                sliver_status_list = \
+                    utils.SliverList().getStatusOfSlivers(sliver_objects)
 
-            # Persist new GramManager state
-            self.persist_state()
+                # Persist new GramManager state
+                self.persist_state(slice_object)
 
             # Report the new slice to VMOC
             self.registerSliceToVMOC(slice_object)
@@ -396,10 +471,14 @@ class GramManager :
 
             Return the status of the specified slivers
         """
-        # Lock this slice so nobody else can mess with it while we get status
-        with slice_object.getLock() :
-            open_stack_interface.updateOperationalStatus(slice_object)
-
+        # Get the state of the VMs from OpenStack.  This only sets the
+        # operational state of the slivers (holding the slice's state lock
+        # for writing), so doesn't need the slice's lock
+        open_stack_interface.updateOperationalStatus(slice_object)
+
+        # Read the slice's state: this doesn't wait for other calls' OpenStack
+        # operations (e.g. a Provision in progress)
+        with slice_object.getReadLock() :
             # Create a list with the status of the specified slivers
             sliver_status_list = \
                 utils.SliverList().getStatusOfSlivers(slivers)
@@ -419,10 +498,10 @@ class GramManager :
 
             Describe the status of the resources allocated to this slice.
         """
-        # Lock this slice so nobody else can mess with it while we get status
-        with slice_object.getLock() :
-            open_stack_interface.updateOperationalStatus(slice_object)
+        # Get the state of the VMs from OpenStack (see status)
+        open_stack_interface.updateOperationalStatus(slice_object)
 
+        with slice_object.getReadLock() :
             # Get the status of the slivers
             sliver_status_list = \
                 utils.SliverList().getStatusOfSlivers(slivers)
@@ -523,31 +602,35 @@ class GramManager :
             # Other slivers just need their allocation and operational states
             # changed.
             provisioned_slivers = []
-            for sliver in sliver_objects :
-                if sliver.getAllocationState() == constants.provisioned :
-                    provisioned_slivers.append(sliver)
-                else :
-                    # Sliver has not been provisioned.  Just change its
-                    # allocation and operational states
-                    sliver.setAllocationState(constants.unallocated)
-                    sliver.setOperationalState(constants.stopping)
-
-            # Delete provisioned slivers
+            with slice_object.getWriteLock() :
+                for sliver in sliver_objects :
+                    if sliver.getAllocationState() == constants.provisioned :
+                        provisioned_slivers.append(sliver)
+                    else :
+                        # Sliver has not been provisioned.  Just change its
+                        # allocation and operational states
+                        sliver.setAllocationState(constants.unallocated)
+                        sliver.setOperationalState(constants.stopping)
+
+            # Delete provisioned slivers (without the slice's state lock)
             success =  open_stack_interface.deleteSlivers(slice_object, 
                                                           provisioned_slivers)
 
-            sliver_status_list = \
-                utils.SliverList().getStatusOfSlivers(sliver_objects)
+            with slice_object.getWriteLock() :
+                sliver_status_list = \
+                    utils.SliverList().getStatusOfSlivers(sliver_objects)
 
-            # Remove deleted slivers from the slice
-            for sliver in sliver_objects :
-                slice_object.removeSliver(sliver)
+                # Remove deleted slivers from the slice
+                for sliver in sliver_objects :
+                    slice_object.removeSliver(sliver)
+                self._expiry_scheduler.unschedule(sliver_objects)
+                slice_is_empty = len(slice_object.getSlivers()) == 0
 
             ### THIS CODE SHOULD BE MOVED TO EXPIRE WHEN WE ACTUALLY EXPIRE
             ### SLIVERS AND SLICES.  SLICES SHOULD BE DELETED ONLY WHEN THEY
             ### EXPIRE.  FOR NOW WE DELETE THEM WHEN ALL THEIR SLIVERS ARE 
             ### DELETED.
-            if len(slice_object.getSlivers()) == 0 :
+            if slice_is_empty :
                 open_stack_interface.expireSlice(slice_object)
                 # Update VMOC
                 self.registerSliceToVMOC(slice_object, False)
@@ -566,7 +649,8 @@ class GramManager :
                         self._internal_vlans.free(tag)
 
             # Persist new GramManager state
-            self.persist_state()
+            with slice_object.getReadLock() :
+                self.persist_state(slice_object, sync=True)
 
             # Generate the return struct
             code = {'geni_code': constants.SUCCESS}
@@ -591,9 +675,10 @@ class GramManager :
                                       expiration_time)
 
         # Lock this slice so nobody else can mess with it while we renew
-        with slice_object.getLock() :
+        with slice_object.getLock(), slice_object.getWriteLock() :
             for sliver in sliver_objects :
                 sliver.setExpiration(expiration)
+            self.schedule_expiration(sliver_objects)
 
             # Create a sliver status list for the slivers that were renewed
             sliver_status_list = \
@@ -638,11 +723,42 @@ class GramManager :
 
 
     # Persist state to file based on current timestamp
+    # If journaling (config.state_journal), append the changes to the
+    # given slice (all slices if None) to the journal instead
+    # With config.async_snapshots, the file is written in the background
+    # unless sync is set
+    def persist_state(self, slice_object=None, sync=False):
+        if not self._snapshot_directory: return
+        start_time = time.time()
+        if self._journal:
+            with SliceURNtoSliceObject._lock:
+                slices = dict(SliceURNtoSliceObject._slices)
+            num_records = self._journal.record(slices, slice_object, self)
+            end_time = time.time()
+            config.logger.info("Journaled %d records in %.3f sec" % \
+                                   (num_records, (end_time - start_time)))
+            return
+        if self._snapshot_writer:
+            with SliceURNtoSliceObject._lock:
+                slices = dict(SliceURNtoSliceObject._slices)
+            self._snapshot_writer.persist(slices, slice_object, self, sync)
+            end_time = time.time()
+            config.logger.info("Persisted state (sync=%s) in %.3f sec" % \
+                                   (sync, (end_time - start_time)))
+            return
+        filename = self.get_snapshot_filename()
+        Archiving.write_state(filename, self, SliceURNtoSliceObject._slices,
+                               self._stitching)
+        self._snapshot_catalog.add(filename)
+        end_time = time.time()
+        config.logger.info("Persisting state to %s in %.2f sec" % \
+                               (filename, (end_time - start_time)))
+
+    # Return name for a new snapshot file based on current timestamp
     __persist_filename_format="%Y_%m_%d_%H_%M_%S"
     __recent_base_filename=None
     __base_filename_counter=0
-    def persist_state(self):
-        if not self._snapshot_directory: return
+    def get_snapshot_filename(self):
         start_time = time.time()
         base_filename = \
             time.strftime(GramManager.__persist_filename_format, time.localtime(start_time))
@@ -654,14 +770,12 @@ class GramManager :
             GramManager.__base_filename_counter=0
 #        print "BFN %s RBFN %s COUNTER %d GMBFNC %d" % (base_filename, GramManager.__recent_base_filename, GramManager.__base_filename_counter, counter)
         GramManager.__recent_base_filename = base_filename
-        filename = "%s/%s_%d.json" % (self._snapshot_directory, \
-                                         base_filename, counter)
+        extension = "json"
+        if config.snapshot_format == "binary": extension = "snap"
+        filename = "%s/%s_%d.%s" % (self._snapshot_directory, \
+                                       base_filename, counter, extension)
         GramManager.__recent_base_filename = base_filename
-        Archiving.write_state(filename, self, SliceURNtoSliceObject._slices,
-                               self._stitching)
-        end_time = time.time()
-        config.logger.info("Persisting state to %s in %.2f sec" % \
-                               (filename, (end_time - start_time)))
+        return filename
 
     # Update VMOC about state of given slice (register or unregister)
     # Register both the control network and all data networks
@@ -719,49 +833,53 @@ class GramManager :
             # Return slice and the urn's of the slivers
             slice_urn = urns[0]
             slice = SliceURNtoSliceObject.get_slice_object(slice_urn)
-            slivers = slice.getSlivers().values()
+            with slice.getReadLock() :
+                slivers = slice.getSlivers().values()
         elif len(urns) > 0:
             # Case 2: This is a sliver URN.
             # Make sure they all belong to the same slice
             # And if so, return the slice and the sliver objects for these 
             # sliver urns
-            sliver_urn = urns[0]
-            slice = None
-            for test_slice in SliceURNtoSliceObject.get_slice_objects() :
-                if test_slice.getSlivers().has_key(sliver_urn):
-                    slice = test_slice
-                    break
+            # Slivers are looked up in the index of all slivers (only 
+            # VM and link slivers can be named)
+            slice = SliverURNtoSliceObject.get_slice_object(urns[0])
             if slice:
                 for sliver_urn  in urns:
-                    if not slice.getSlivers().has_key(sliver_urn):
+                    sliver_slice, sliver = \
+                        SliverURNtoSliceObject.get_sliver_object(sliver_urn)
+                    if sliver_slice is not slice or \
+                            isinstance(sliver, NetworkInterface):
                         raise ApiErrorException(AM_API.BAD_ARGS, 
                                                 "Decode_URNs: All sliver " + 
                                                 "URN's must be part of same slice")
                     else:
-                        sliver = slice.getSlivers()[sliver_urn]
                         slivers.append(sliver)
         return slice, slivers
 
 
-    def expire_slivers(self):
+    # Schedule the VM and link slivers among the given slivers to be
+    # expired at their expiration times
+    def schedule_expiration(self, slivers):
+        self._expiry_scheduler.schedule([sliver for sliver in slivers \
+                           if not isinstance(sliver, NetworkInterface)])
+
+    def expire_slivers(self, slice_object, slivers):
         """
-            Find and delete slivers that have expired.
+            Delete the given slivers of a slice that have expired.
+            Called by the expiry scheduler.
         """
-        # We walk through the list of slices.  For each slice we make a 
-        # list of slivers that have expired.  If the slice has slivers that
-        # have expired, we use the self.delete method to delete these slivers
+        # The slivers may have been renewed or deleted since the scheduler
+        # picked them: check them again with the slice locked
         now = datetime.datetime.utcnow()
-        for slice_object in SliceURNtoSliceObject.get_slice_objects():
-            # Lock this slice so nobody else can mess with it while we expire
-            # its slivers
-            with slice_object.getLock() :
-                slivers = slice_object.getSlivers()
-                expired_slivers = list()
-                for sliver in slivers.values():
-                    if not sliver.getExpiration() or sliver.getExpiration() < now:
-                        expired_slivers.append(sliver)
-                if len(expired_slivers) != 0 :
-                    self.delete(slice_object, expired_slivers, None)
+        with slice_object.getLock() :
+            current_slivers = slice_object.getSlivers()
+            expired_slivers = list()
+            for sliver in slivers:
+                if sliver.getSliverURN() not in current_slivers: continue
+                if not sliver.getExpiration() or sliver.getExpiration() < now:
+                    expired_slivers.append(sliver)
+            if len(expired_slivers) != 0 :
+                self.delete(slice_object, expired_slivers, None)
 
 
     def list_flavors(self):
@@ -790,9 +908,7 @@ class GramManager :
                     config.recover_from_snapshot != "": 
                 snapshot_file = config.recover_from_snapshot
             if not snapshot_file and config.recover_from_most_recent_snapshot:
-                files = self.get_snapshots()
-                if files and len(files) > 0:
-                    snapshot_file = files[len(files)-1]
+                snapshot_file = self._snapshot_catalog.getLatest()
                 config.logger.info("SNAPSHOT FILE : %s" % snapshot_file)
 #                print 'snapshot file: '
 #                print snapshot_file
@@ -800,7 +916,12 @@ class GramManager :
                 config.logger.info("Restoring state from snapshot : %s" \
                                        % snapshot_file)
                 SliceURNtoSliceObject._slices = \
-                    Archiving.read_state(snapshot_file, self, self._stitching)
+                    state_journal.read_state(snapshot_file, self,
+                                             self._stitching)
+                SliverURNtoSliceObject.set_slice_objects( \
+                    SliceURNtoSliceObject._slices.values())
+                for slice_obj in SliceURNtoSliceObject._slices.values():
+                    self.schedule_expiration(slice_obj.getSlivers().values())
                 # Restore the state of the VLAN pools
                 # Go through all the network links and 
                 # if the vlan tag is in the internal pool, allocate it
@@ -815,45 +936,44 @@ class GramManager :
                 config.logger.info("Restored %d slices" % \
                                        len(SliceURNtoSliceObject._slices))
 
-    # Clean up expired slices periodically
+            # Start journaling from the restored state
+            if config.state_journal:
+                self._journal = \
+                    state_journal.StateJournal(self._snapshot_directory,
+                                               self._stitching,
+                                               self.get_snapshot_filename,
+                                               self._snapshot_catalog.add)
+                self._journal.start(SliceURNtoSliceObject._slices, self)
+            elif config.async_snapshots:
+                self._snapshot_writer = \
+                    snapshot_writer.SnapshotWriter(self._stitching,
+                                                   self.get_snapshot_filename,
+                                                   self._snapshot_catalog.add)
+                self._snapshot_writer.start(SliceURNtoSliceObject._slices)
+
+        # Finish setting up the VMs that were still booting when the state
+        # was saved
+        for slice_obj in SliceURNtoSliceObject.get_slice_objects():
+            booting_vms = [vm for vm in slice_obj.getVMs() \
+                               if vm.getUUID() != None and \
+                               vm.getOperationalState() == constants.configuring]
+            if len(booting_vms) > 0:
+                config.logger.info("Watching %d booting VMs of slice %s" % \
+                                       (len(booting_vms),
+                                        slice_obj.getSliceURN()))
+                open_stack_interface.watchVMs(slice_obj, booting_vms, self)
+
+    # Log statistics periodically
     def periodic_cleanup(self):
-        token_table_user = 'keystone'
-        token_table_database = 'keystone'
-        token_retention_window_days = 1
         while True:
-            cmd = None
-            try:
-                config.logger.info("Cleaning up expired slivers")
-                cmd = "mysql -u%s -p%s -h%s %s -e 'DELETE FROM token WHERE NOT DATE_SUB(CURDATE(),INTERVAL %d DAY) <= expires'" % \
-                    (token_table_user, config.mysql_password, 
-                     config.control_host_addr, token_table_database, 
-                     token_retention_window_days)
-            except Exception, e:
-                print e
-#            print cmd
-            os.system(cmd)
-
-            cmd = "keystone tenant-list"
-            output = open_stack_interface._execCommand(cmd)
-            output_fields = open_stack_interface._parseTableOutput(output)
-            tenant_uuids =  output_fields['id']
-#            print "TENANT_UUIDS = %s" % tenant_uuids
-            try:
-                config.logger.info("Cleaning up danglihg secgrps")
-                uuids_expr =  ",".join("'" + tenant_uuid + "'" \
-                                           for tenant_uuid in tenant_uuids)
-
-                for table_name in ['securitygrouprules', 'securitygroups']:
-                    cmd = "mysql -u%s -p%s -h%s %s -e %sDELETE from %s where tenant_id not in (%s)%s" % \
-                        (config.network_user, config.mysql_password,
-                         config.control_host_addr, config.network_database,
-                         '"', table_name, uuids_expr, '"')
-#                    print cmd
-                    os.system(cmd)
-            except Exception, e:
-                print e
-                
-            self.expire_slivers()
+            config.logger.info("Inventory cache statistics: %s" % \
+                                   inventory_cache.inventory.getStatistics())
+            config.logger.info("Advertisement cache statistics: %s" % \
+                                   advertisement_cache.advertisement.getStatistics())
+            config.logger.info("Expiry scheduler statistics: %s" % \
+                                   self._expiry_scheduler.getStatistics())
+            config.logger.info("Housekeeping statistics: %s" % \
+                                   self._housekeeper.getStatistics())
             time.sleep(3000)
 
     # Allocate internal VLAN tags to all links for which the tag is not
@@ -869,107 +989,41 @@ class GramManager :
 
 
     # Remove old snapshots, keeping only last config.snapshot_maintain_limit
+    # (and, if config.snapshot_maintain_days is set, none older than that)
     def prune_snapshots(self):
-        files = self.get_snapshots()
-        if files and len(files) > config.snapshot_maintain_limit:
-            files_to_remove = files[0:len(files)-config.snapshot_maintain_limit-1]
-            for file in files_to_remove:
-                os.unlink(file)
+        if self._snapshot_catalog:
+            self._snapshot_catalog.prune()
 
     # Return list of files in config.gam_snapshot_directory  in time
-    # ascending order
+    # ascending order, from the snapshot catalog
     def get_snapshots(self):
         files = None
-        if self._snapshot_directory:
-            dir = self._snapshot_directory
-            files = [os.path.join(dir, s) for s in os.listdir(dir)
-                     if os.path.isfile(os.path.join(dir, s))]
-            files.sort(key = lambda s: os.path.getmtime(s))
+        if self._snapshot_catalog:
+            files = self._snapshot_catalog.getSnapshots()
         return files
 
-    # Compute the UUIDs of OpenStack objects for all slices
-    # Return dictionary of 'vm_uuids', 'net_uuids', 'router_uuids', 
-    #    'subnet_uuids' indexed by tenant_uuid
-    def get_all_slice_info(self):
-        result = {}
-
-        for slice_urn, slice_object in SliceURNtoSliceObject._slices.items():
-            tenant_uuid = slice_object.getTenantUUID()
-            result[tenant_uuid] = {}
-
-            tenant_router_uuid = slice_object.getTenantRouterUUID()
-            result[tenant_uuid]['router_uuids'] = [tenant_router_uuid]
-
-            tenant_admin_name, tenant_admin_pwd, tenant_admin_uuid = \
-                slice_object.getTenantAdminInfo()
-            result[tenant_uuid]['user_uuids'] = [tenant_admin_uuid]
-
-            result[tenant_uuid]['net_uuids'] = []
-            result[tenant_uuid]['subnet_uuids'] = []
-            result[tenant_uuid]['vm_uuids'] = []
-            
-            for network_link in slice_object.getNetworkLinks():
-                net_uuid = network_link.getNetworkUUID()
-                if net_uuid not in result[tenant_uuid]['net_uuids']:
-                    result[tenant_uuid]['net_uuids'].append(net_uuid)
-                subnet_uuid = network_link.getSubnetUUID()
-                if subnet_uuid not in result[tenant_uuid]['subnet_uuids']:
-                    result[tenant_uuid]['subnet_uuids'].append(subnet_uuid)
-
-            for vm in slice_object.getVMs():
-                vm_uuid = vm.getUUID()
-                result[tenant_uuid]['vm_uuids'].append(vm_uuid)
-
-        return result
-
-
     # Reconcile state of gram manager slices/slivers with the resources
     # Currently defined in OpenStack
     # If any resources in GRAM of a given slice no longer exist in OpenStack
-    # Delete the slice
+    # Delete the slice (see reconcile.py)
+    # With config.reconcile_in_background, this returns once the slices
+    # to be checked are fenced off and they are checked in the background
     def reconcile_state(self):
-#        print "RECONCILING...."
-        os_info = open_stack_interface.get_all_tenant_info()
-#        print "OS_INFO   = %s" % os_info
-        gram_info = self.get_all_slice_info()
-#        print "GRAM_INFO = %s" % gram_info
-
-        # Compare the two sets of tagged UUIDS
-        # If gram has some slice that OS doesn't or the 
-        # gram slice has some UUIDs that OS doesn't have or
-        # OS slice has some UUIDS that GRAM doesn't have, delete slice
-        # from GRAM and OS
-        tenants_to_delete = []
-        for tenant_id, tenant_data in gram_info.items():
-            # Is this a slice in GRAM but not in OpenStack
-            if not tenant_id in os_info:
-                tenants_to_delete.append(tenant_id)
-            else:
-                for key, gram_data in tenant_data.items():
-                    # Is this a slice with the same uuid type but not same
-                    # entries
-                    if key in os_info[tenant_id]:
-                        os_data = os_info[tenant_id][key]
-                        gram_data.sort()
-                        os_data.sort()
-                        if cmp(gram_data, os_data) != 0:
-                            tenants_to_delete.append(tenant_id)
-                            break
-                    else:
-                        # This is a slice with some key in GRAM not in OS
-                        tenants_to_delete.append(tenant_id)
-                        break
-
-        if len(tenants_to_delete) > 0:
-            config.logger.info("OpenStack and GRAM-internal representations of these tenants are inconsistent: deleting from OpenStack and GRAM %s " % tenants_to_delete)
-            for slice_urn, slice_object in SliceURNtoSliceObject._slices.items():
-                tenant_uuid = slice_object.getTenantUUID()
-                if tenant_uuid in tenants_to_delete:
-                    slice_slivers = slice_object.getSlivers().values()
-                    config.logger.info("Deleting Slice URN = %s" % slice_urn)
-                    self.delete(slice_object, slice_slivers, {})
-
+        with SliceURNtoSliceObject._lock:
+            slice_objects = SliceURNtoSliceObject._slices.values()
+        self._reconciler = reconcile.Reconciler(slice_objects, 
+                                                self.delete_slice)
+        if config.reconcile_in_background:
+            self._reconciler.start()
+        else:
+            self._reconciler.run()
 
+    # Delete all the slivers of a slice (and so the slice)
+    def delete_slice(self, slice_object):
+        slice_slivers = slice_object.getSlivers().values()
+        config.logger.info("Deleting Slice URN = %s" % \
+                               slice_object.getSliceURN())
+        self.delete(slice_object, slice_slivers, {})
 
     def __del__(self) :
         config.logger.info('In destructor')
@@ -32,9 +32,9 @@ from gcf.geni.util.tz_util import tzd
 from .gram_manager import *
 from .resources import *
 from .stitching import *
+from . import rspec_parser
 import datetime
 import dateutil.parser
-import xml.dom.minidom
 
 class GRAM_Resource_Manager(Base_Resource_Manager):
     def __init__(self):
@@ -49,29 +49,32 @@ class GRAM_Resource_Manager(Base_Resource_Manager):
 
             creds = [credential.Credential(string=c) for c in credentials]
             
-            # Grab info about  current slivers
-            slices = SliceURNtoSliceObject._slices
-            for slice_urn in slices:
-                slice_obj = slices[slice_urn]
-                slivers = slice_obj.getSlivers()
-                for sliver_urn, sliver_obj in slivers.items():
-                    user_urn = sliver_obj.getUserURN() 
-                    start_time = str(datetime.datetime.utcnow())
-                    end_time = str(sliver_obj.getExpiration())
-                    if isinstance(sliver_obj, VirtualMachine):
-                        sliver_info = {'sliver_urn' : sliver_urn,
-                                       'slice_urn' : slice_urn, 
-                                       'user_urn' : user_urn,
-                                       'start_time' : start_time,
-                                       'end_time' : end_time,
-                                       'measurements' : {"NODE" : 1}
-                                       }
-                        resource_info.append(sliver_info)
-                    elif isinstance(sliver_obj, NetworkLink):
-                        self.processCapacity(resource_info, 
-                                             slice_obj.getRequestRspec(),
-                                             sliver_urn, slice_urn, user_urn, 
-                                             start_time, end_time)
+            # Grab info about  current slivers (from the index of the
+            # slivers of all slices)
+            start_time = str(datetime.datetime.utcnow())
+            for slice_obj, sliver_obj in \
+                    SliverURNtoSliceObject.get_sliver_objects():
+                if not isinstance(sliver_obj, VirtualMachine) and \
+                        not isinstance(sliver_obj, NetworkLink):
+                    continue
+                sliver_urn = sliver_obj.getSliverURN()
+                slice_urn = slice_obj.getSliceURN()
+                user_urn = sliver_obj.getUserURN() 
+                end_time = str(sliver_obj.getExpiration())
+                if isinstance(sliver_obj, VirtualMachine):
+                    sliver_info = {'sliver_urn' : sliver_urn,
+                                   'slice_urn' : slice_urn, 
+                                   'user_urn' : user_urn,
+                                   'start_time' : start_time,
+                                   'end_time' : end_time,
+                                   'measurements' : {"NODE" : 1}
+                                   }
+                    resource_info.append(sliver_info)
+                else:
+                    self.processCapacity(resource_info, 
+                                         slice_obj.getRequestRspec(),
+                                         sliver_urn, slice_urn, user_urn, 
+                                         start_time, end_time)
 
 
             # Grab all nodes from request rspec
@@ -91,8 +94,9 @@ class GRAM_Resource_Manager(Base_Resource_Manager):
                 else:
                     end_time = amd.min_expire(creds)
 
-                rspec = xml.dom.minidom.parseString(rspec_raw)
-                nodes = rspec.getElementsByTagName('node')
+                # Parsed once for this request and shared with allocate
+                rspec = rspec_parser.parse(rspec_raw)
+                nodes = rspec.getNodes()
                 for node in nodes:
                     entry = {'sliver_urn' : 'not_set_yet',
                              'slice_urn' : slice_urn,
@@ -124,12 +128,14 @@ class GRAM_Resource_Manager(Base_Resource_Manager):
 
             if method_name == AM_Methods.RENEW_SLIVER_V2:
                 the_slice_urn = arguments['slice_urn']
-                the_slice = SliceURNtoSliceObject._slices[the_slice_urn]
+                the_slice = \
+                    SliceURNtoSliceObject.get_slice_object(the_slice_urn)
                 slivers = the_slice.getSlivers().values()
             else:
                 urns = arguments['urns']
                 the_slice, slivers = amd.decode_urns(urns)
-            sliver_urns = [the_sliver.getSliverURN() for the_sliver in slivers]
+            sliver_urns = set([the_sliver.getSliverURN() \
+                                   for the_sliver in slivers])
             for entry in resource_info:
                 if entry['sliver_urn'] in sliver_urns:
                     entry['end_time'] = requested
@@ -146,8 +152,8 @@ class GRAM_Resource_Manager(Base_Resource_Manager):
 #        print "S = %s C = %s D = %s" % (error_string, error_code, details)
         if error_code == 0 and details is not None:
             for link_id, hop in details['my_hops_by_path_id'].items():
-                for capacity in hop.getElementsByTagName('capacity'):
-                    capacity_value = int(capacity.childNodes[0].nodeValue)
+                for capacity in rspec_parser.findAll(hop, 'capacity'):
+                    capacity_value = int(capacity.text)
                     entry = { 'sliver_urn' : sliver_urn,
                               'slice_urn' : slice_urn,
                               'user_urn' : user_urn,
@@ -0,0 +1,330 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Periodic housekeeping of the OpenStack databases:
+#    - Remove Keystone tokens that expired more than 
+#      config.token_retention_days ago
+#    - Remove the security groups (and their rules) of tenants that no
+#      longer exist
+#
+# The databases are reached through DB-API connections kept in a small
+# pool (MySQLdb for the OpenStack databases; any DB-API module will do,
+# e.g. sqlite3 in the demonstration below).  Rows are deleted in batches
+# of at most config.housekeeping_batch_size, each its own transaction, so
+# that no table is locked for long.  The Housekeeper runs the tasks every
+# config.housekeeping_interval seconds in its own thread and records the
+# rows deleted and time taken by each.
+
+import datetime
+import threading
+import time
+
+import config
+
+
+class ConnectionPool :
+    """
+        Pool of DB-API connections made by calling connect()
+    """
+
+    def __init__(self, connect, max_idle=2) :
+        self._connect = connect
+        self._max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self) :
+        self._lock.acquire()
+        try :
+            if len(self._idle) > 0 :
+                return self._idle.pop()
+        finally :
+            self._lock.release()
+        return self._connect()
+
+    def release(self, connection, broken=False) :
+        """
+            Return a connection to the pool.  Broken connections (e.g. 
+            ones on which a statement failed) are closed.
+        """
+        if not broken :
+            self._lock.acquire()
+            try :
+                if len(self._idle) < self._max_idle :
+                    self._idle.append(connection)
+                    return
+            finally :
+                self._lock.release()
+        try :
+            connection.close()
+        except Exception :
+            pass
+
+
+class Database :
+    """
+        A database reached through a ConnectionPool.  paramstyle is that
+        of the DB-API module ('format' for MySQLdb, 'qmark' for sqlite3).
+    """
+
+    def __init__(self, name, connect, paramstyle) :
+        self.name = name
+        self._pool = ConnectionPool(connect)
+        if paramstyle == 'qmark' :
+            self.placeholder = '?'
+        else :
+            self.placeholder = '%s'
+
+    def query(self, sql, params=()) :
+        connection = self._pool.acquire()
+        broken = True
+        try :
+            cursor = connection.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            connection.commit()
+            broken = False
+            return rows
+        finally :
+            self._pool.release(connection, broken)
+
+    def delete_in_batches(self, table, key_column, where, params, 
+                          batch_size) :
+        """
+            Delete the rows of a table that match a where clause, at most
+            batch_size at a time (selecting their keys, then deleting by
+            key, which works the same with MySQL and SQLite).  Returns the
+            number of rows deleted.
+        """
+        select = "SELECT %s FROM %s WHERE %s LIMIT %d" % \
+            (key_column, table, where, batch_size)
+        num_deleted = 0
+        while True :
+            connection = self._pool.acquire()
+            broken = True
+            try :
+                cursor = connection.cursor()
+                cursor.execute(select, params)
+                keys = [row[0] for row in cursor.fetchall()]
+                if len(keys) > 0 :
+                    placeholders = ", ".join([self.placeholder] * len(keys))
+                    cursor.execute("DELETE FROM %s WHERE %s IN (%s)" % \
+                                       (table, key_column, placeholders), 
+                                   keys)
+                connection.commit()
+                broken = False
+            finally :
+                self._pool.release(connection, broken)
+            num_deleted += len(keys)
+            if len(keys) < batch_size :
+                return num_deleted
+
+
+def mysql_database(database, user) :
+    """
+        Return a Database for one of the OpenStack MySQL databases on the
+        control host.  The password is passed to MySQLdb directly, never
+        on a command line.
+    """
+    def connect() :
+        import MySQLdb
+        return MySQLdb.connect(host=config.control_host_addr, user=user,
+                               passwd=config.mysql_password, db=database)
+    return Database(database, connect, 'format')
+
+
+def purge_expired_tokens(keystone_database) :
+    """
+        Delete the Keystone tokens that expired more than 
+        config.token_retention_days ago
+    """
+    cutoff = datetime.datetime.utcnow() - \
+        datetime.timedelta(days=config.token_retention_days)
+    return keystone_database.delete_in_batches('token', 'id', 
+                                               'expires < ' + \
+                                                   keystone_database.placeholder,
+                                               [cutoff],
+                                               config.housekeeping_batch_size)
+
+
+def purge_orphaned_security_groups(network_database, tenant_uuids) :
+    """
+        Delete the security group rules and security groups of tenants 
+        that aren't in tenant_uuids
+    """
+    tenant_uuids = set(tenant_uuids)
+    if len(tenant_uuids) == 0 :
+        # Most likely we failed to list the tenants: don't remove everything
+        config.logger.error("No tenants: not removing security groups")
+        return 0
+    num_deleted = 0
+    for table in ['securitygrouprules', 'securitygroups'] :
+        rows = network_database.query("SELECT DISTINCT tenant_id FROM %s" % \
+                                          table)
+        for (tenant_id,) in rows :
+            if tenant_id is None or tenant_id in tenant_uuids : continue
+            num_deleted += \
+                network_database.delete_in_batches(table, 'id', 
+                                                   'tenant_id = ' + \
+                                                       network_database.placeholder,
+                                                   [tenant_id],
+                                                   config.housekeeping_batch_size)
+    return num_deleted
+
+
+class Housekeeper :
+
+    def __init__(self, keystone_database, network_database, list_tenants) :
+        self._keystone_database = keystone_database
+        self._network_database = network_database
+        self._list_tenants = list_tenants # Returns UUIDs of all tenants
+        self._tasks = [('expired_tokens', self._purge_tokens),
+                       ('orphaned_security_groups', 
+                        self._purge_security_groups)]
+        self._statistics = {} # Task name => statistics
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _purge_tokens(self) :
+        return purge_expired_tokens(self._keystone_database)
+
+    def _purge_security_groups(self) :
+        return purge_orphaned_security_groups(self._network_database,
+                                              self._list_tenants())
+
+    def run(self) :
+        """
+            Run all the housekeeping tasks once
+        """
+        for name, task in self._tasks :
+            start_time = time.time()
+            num_deleted = None
+            try :
+                num_deleted = task()
+            except Exception, e :
+                config.logger.error("Housekeeping task %s failed: %s" % \
+                                        (name, e))
+            duration = time.time() - start_time
+            config.logger.info("Housekeeping task %s deleted %s rows in %.2f sec" % \
+                                   (name, num_deleted, duration))
+            self._lock.acquire()
+            try :
+                statistics = self._statistics.setdefault(name, 
+                                                         {'runs' : 0,
+                                                          'failures' : 0,
+                                                          'rows_deleted' : 0,
+                                                          'seconds' : 0.0})
+                statistics['runs'] += 1
+                statistics['seconds'] += duration
+                statistics['last_run'] = start_time
+                statistics['last_seconds'] = duration
+                if num_deleted is None :
+                    statistics['failures'] += 1
+                else :
+                    statistics['rows_deleted'] += num_deleted
+                statistics['last_rows_deleted'] = num_deleted
+            finally :
+                self._lock.release()
+
+    def getStatistics(self) :
+        self._lock.acquire()
+        try :
+            return dict([(name, dict(statistics)) for name, statistics \
+                             in self._statistics.items()])
+        finally :
+            self._lock.release()
+
+    def start(self) :
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _run(self) :
+        while True :
+            self.run()
+            time.sleep(config.housekeeping_interval)
+
+
+if __name__ == "__main__":
+    # Demonstration with SQLite standing in for the Keystone and network
+    # databases: purge expired tokens and the security groups of deleted
+    # tenants, in batches.
+    # Usage: python housekeeping.py [num_tokens [batch_size]]
+    import logging
+    import os
+    import sqlite3
+    import sys
+    import tempfile
+
+    logging.basicConfig()
+    config.logger = logging.getLogger('housekeeping')
+    config.logger.setLevel(logging.INFO)
+    num_tokens = 100000
+    if len(sys.argv) > 1 : num_tokens = int(sys.argv[1])
+    if len(sys.argv) > 2 : config.housekeeping_batch_size = int(sys.argv[2])
+
+    directory = tempfile.mkdtemp()
+    def sqlite_database(name) :
+        filename = os.path.join(directory, name + '.db')
+        return Database(name, lambda: sqlite3.connect(filename), 
+                        sqlite3.paramstyle)
+
+    keystone = sqlite_database('keystone')
+    network = sqlite_database('network')
+    keystone.query("CREATE TABLE token (id VARCHAR(64) PRIMARY KEY, " + \
+                       "expires DATETIME, extra TEXT)")
+    network.query("CREATE TABLE securitygroups (id VARCHAR(36) PRIMARY KEY, " +\
+                      "tenant_id VARCHAR(255), name VARCHAR(255))")
+    network.query("CREATE TABLE securitygrouprules " + \
+                      "(id VARCHAR(36) PRIMARY KEY, tenant_id VARCHAR(255), " + \
+                      "security_group_id VARCHAR(36))")
+
+    now = datetime.datetime.utcnow()
+    connection = sqlite3.connect(os.path.join(directory, 'keystone.db'))
+    connection.executemany("INSERT INTO token VALUES (?, ?, ?)",
+                           [('token-%d' % i, 
+                             now - datetime.timedelta(hours=i % 72), '{}') \
+                                for i in range(num_tokens)])
+    connection.commit()
+    connection.close()
+    tenants = ['tenant-%d' % i for i in range(200)]
+    connection = sqlite3.connect(os.path.join(directory, 'network.db'))
+    for i, tenant in enumerate(tenants) :
+        connection.execute("INSERT INTO securitygroups VALUES (?, ?, ?)",
+                           ('group-%d' % i, tenant, 'default'))
+        connection.executemany("INSERT INTO securitygrouprules VALUES (?, ?, ?)",
+                               [('rule-%d-%d' % (i, j), tenant, 
+                                 'group-%d' % i) for j in range(4)])
+    connection.commit()
+    connection.close()
+
+    # Half the tenants have been deleted
+    housekeeper = Housekeeper(keystone, network, lambda: tenants[:100])
+    housekeeper.run()
+    for name, statistics in sorted(housekeeper.getStatistics().items()) :
+        print "%s: deleted %d rows in %.2f sec" % \
+            (name, statistics['rows_deleted'], statistics['seconds'])
+    print "Tokens left: %d" % keystone.query("SELECT COUNT(*) FROM token")[0][0]
+    print "Security groups left: %d, rules left: %d" % \
+        (network.query("SELECT COUNT(*) FROM securitygroups")[0][0],
+         network.query("SELECT COUNT(*) FROM securitygrouprules")[0][0])
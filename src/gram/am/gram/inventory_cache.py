@@ -0,0 +1,170 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Cache of OpenStack inventory listings (hosts, hypervisors, routers,
+# users, images, flavors) shared by all the aggregate manager's request
+# threads.
+#
+# Each kind of listing ('resource') is registered with a function that
+# fetches it.  A listing is fetched again once it is older than its time to
+# live (config.inventory_cache_ttls), or after GRAM invalidates it because
+# it created or deleted an object of that kind.  If several threads miss on
+# the same resource at once, only one of them fetches it and the others
+# wait for and share its result.
+
+import threading
+import time
+
+import config
+
+
+class _CacheEntry:
+    def __init__(self, value, fetch_time, generation):
+        self.value = value
+        self.fetch_time = fetch_time
+        self.generation = generation
+
+
+class InventoryCache:
+
+    def __init__(self):
+        self._lock = threading.Condition(threading.Lock())
+        self._fetchers = {} # resource => function returning its listing
+        self._entries = {} # resource => _CacheEntry
+        self._generations = {} # resource => number of invalidations
+        self._in_flight = set() # resources currently being fetched
+        self._hits = {}
+        self._misses = {}
+        self._waits = {} # Misses satisfied by another thread's fetch
+
+    def register(self, resource, fetcher):
+        self._lock.acquire()
+        try:
+            self._fetchers[resource] = fetcher
+            self._generations.setdefault(resource, 0)
+            self._hits.setdefault(resource, 0)
+            self._misses.setdefault(resource, 0)
+            self._waits.setdefault(resource, 0)
+        finally:
+            self._lock.release()
+
+    def _ttl(self, resource):
+        return config.inventory_cache_ttls.get(resource,
+                                               config.inventory_cache_default_ttl)
+
+    def _is_fresh(self, resource, entry, now):
+        return entry is not None and \
+            entry.generation == self._generations[resource] and \
+            now - entry.fetch_time < self._ttl(resource)
+
+    def get(self, resource):
+        """
+            Return the listing for the given resource, fetching it if it
+            isn't cached or is stale.  If the fetch fails, a listing that
+            is only out of date (not invalidated) is returned if there is
+            one; otherwise the exception from the fetch is raised.
+        """
+        self._lock.acquire()
+        try:
+            waited = False
+            while True:
+                entry = self._entries.get(resource)
+                if self._is_fresh(resource, entry, time.time()):
+                    if waited:
+                        self._waits[resource] += 1
+                    else:
+                        self._hits[resource] += 1
+                    return entry.value
+                if resource not in self._in_flight:
+                    break
+                # Another thread is fetching this resource.  Use its result.
+                waited = True
+                self._lock.wait()
+            self._misses[resource] += 1
+            self._in_flight.add(resource)
+            generation = self._generations[resource]
+            fetcher = self._fetchers[resource]
+        finally:
+            self._lock.release()
+
+        try:
+            value = fetcher()
+        except Exception, e:
+            self._lock.acquire()
+            try:
+                self._in_flight.discard(resource)
+                self._lock.notifyAll()
+                # A listing that was invalidated predates GRAM's own
+                # changes: don't use it
+                current = entry is not None and \
+                    entry.generation == self._generations[resource]
+            finally:
+                self._lock.release()
+            if not current:
+                raise
+            config.logger.error('Failed to refresh %s, using cached copy: %s' \
+                                    % (resource, str(e)))
+            return entry.value
+
+        self._lock.acquire()
+        try:
+            # If the resource was invalidated while we were fetching, the
+            # listing is kept but is already stale
+            self._entries[resource] = _CacheEntry(value, time.time(),
+                                                  generation)
+            self._in_flight.discard(resource)
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+        return value
+
+    def invalidate(self, resource):
+        """
+            Discard the cached listing for the given resource, e.g.
+            because GRAM created or deleted an object of that kind
+        """
+        self._lock.acquire()
+        try:
+            if resource in self._generations:
+                self._generations[resource] += 1
+        finally:
+            self._lock.release()
+
+    def getStatistics(self):
+        """
+            Returns {resource : {'hits', 'misses', 'waits'}}
+        """
+        self._lock.acquire()
+        try:
+            stats = {}
+            for resource in self._fetchers.keys():
+                stats[resource] = {'hits' : self._hits[resource],
+                                   'misses' : self._misses[resource],
+                                   'waits' : self._waits[resource]}
+            return stats
+        finally:
+            self._lock.release()
+
+
+# The cache shared by the aggregate manager
+inventory = InventoryCache()
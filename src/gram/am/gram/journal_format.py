@@ -0,0 +1,181 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Reading of the state journal (see state_journal.py).
+#
+# The journal is a sequence of numbered segment files in the 'journal'
+# subdirectory of the snapshot directory.  Each line of a segment is a
+# JSON record: {"put" : object} (the new JSON encoding of a slice, sliver
+# or other state), {"delete" : key} or {"commit" : sequence number}, which
+# applies the records since the previous commit.  A checkpoint is an ordinary snapshot
+# that also holds {CHECKPOINT_MARKER : number of the first segment not
+# included}.  load_state reads a snapshot and replays the journal that
+# follows it.
+#
+# Like snapshot_format, this module doesn't depend on the rest of GRAM so
+# the monitoring tools can use it.
+
+import json
+import logging
+import os
+
+import snapshot_format
+
+_logger = logging.getLogger('gcf.am3.gram') # config.logger
+
+JOURNAL_SUBDIRECTORY = 'journal'
+SEGMENT_SUFFIX = '.log'
+
+# Key of the object in a checkpoint that holds the number of the first
+# journal segment not included in the checkpoint
+CHECKPOINT_MARKER = 'JOURNAL_SEGMENT'
+
+# Keys of the records holding the gram manager and SSH proxy table state
+GRAM_MANAGER_STATE = 'GRAM_MANAGER_STATE'
+SSH_PROXY = 'SSH_PROXY'
+
+
+def segment_filename(journal_directory, segment_number) :
+    return os.path.join(journal_directory,
+                        '%08d%s' % (segment_number, SEGMENT_SUFFIX))
+
+def list_segments(journal_directory) :
+    """
+        Returns the numbers of the journal segments in the journal
+        directory, in ascending order
+    """
+    segment_numbers = []
+    if os.path.isdir(journal_directory) :
+        for name in os.listdir(journal_directory) :
+            if name.endswith(SEGMENT_SUFFIX) :
+                try :
+                    segment_numbers.append(int(name[:-len(SEGMENT_SUFFIX)]))
+                except ValueError :
+                    pass
+    segment_numbers.sort()
+    return segment_numbers
+
+def _record_key(json_object) :
+    """
+        Returns the key of a journaled object: the URN of a slice or
+        sliver, or GRAM_MANAGER_STATE or SSH_PROXY
+    """
+    if '__type__' in json_object :
+        if json_object['__type__'] == 'Slice' :
+            return json_object['slice_urn']
+        return json_object['sliver_urn']
+    return json_object.keys()[0]
+
+def _order_objects(objects) :
+    """
+        Order JSON-encoded objects the way Archiving.write_state does:
+        slices, then slivers, then everything else
+    """
+    slices = []
+    slivers = []
+    others = []
+    for json_object in objects :
+        if '__type__' not in json_object :
+            others.append(json_object)
+        elif json_object['__type__'] == 'Slice' :
+            slices.append(json_object)
+        else :
+            slivers.append(json_object)
+    return slices + slivers + others
+
+
+def replay(json_data, journal_directory) :
+    """
+        Apply the journal segments that follow the checkpoint json_data
+        (a list of JSON-encoded objects read from a snapshot file).
+        Returns the resulting list of objects.  Snapshots that are not
+        checkpoints are returned unchanged.
+    """
+    first_segment = None
+    objects = {}
+    for json_object in json_data :
+        if CHECKPOINT_MARKER in json_object :
+            first_segment = json_object[CHECKPOINT_MARKER]
+        else :
+            objects[_record_key(json_object)] = json_object
+    if first_segment is None :
+        return json_data
+
+    segment_numbers = [n for n in list_segments(journal_directory) \
+                           if n >= first_segment]
+    if len(segment_numbers) > 0 and segment_numbers[0] != first_segment :
+        _logger.error('Journal segment %d is missing: not replaying journal' \
+                                % first_segment)
+        return _order_objects(objects.values())
+
+    num_commits = 0
+    expected_segment = first_segment
+    for segment_number in segment_numbers :
+        if segment_number != expected_segment :
+            _logger.error('Journal segment %d is missing: stopped replaying journal' \
+                                    % expected_segment)
+            break
+        expected_segment += 1
+        pending = []
+        file = open(segment_filename(journal_directory, segment_number), 'r')
+        try :
+            for line in file :
+                try :
+                    record = json.loads(line)
+                except ValueError :
+                    # A record torn by a crash while it was being written
+                    break
+                if 'commit' in record :
+                    for put, key in pending :
+                        if put is not None :
+                            objects[key] = put
+                        elif key in objects :
+                            del objects[key]
+                    pending = []
+                    num_commits += 1
+                elif 'put' in record :
+                    pending.append((record['put'], 
+                                    _record_key(record['put'])))
+                elif 'delete' in record :
+                    pending.append((None, record['delete']))
+        finally :
+            file.close()
+        if len(pending) > 0 :
+            _logger.info('Ignoring %d uncommitted journal records in segment %d' \
+                                   % (len(pending), segment_number))
+    _logger.info('Replayed %d journal commits from segments %s' % \
+                           (num_commits, segment_numbers))
+    return _order_objects(objects.values())
+
+
+def load_state(filename) :
+    """
+        Returns the list of JSON-encoded objects in a snapshot file, with
+        the journal that follows it applied if the snapshot is a
+        checkpoint.  Readers of the saved state (e.g. the monitors) use
+        this rather than snapshot_format.load_snapshot.
+    """
+    json_data = snapshot_format.load_snapshot(filename)
+    journal_directory = os.path.join(os.path.dirname(filename), 
+                                     JOURNAL_SUBDIRECTORY)
+    return replay(json_data, journal_directory)
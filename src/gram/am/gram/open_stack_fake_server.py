@@ -0,0 +1,548 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# A small in-memory imitation of the Keystone, Nova, Neutron and Glance
+# REST APIs, implementing the subset of calls made by open_stack_rest.py.
+# It lets the 'rest' backend of open_stack_interface be exercised without
+# an OpenStack installation:
+#
+#    python open_stack_fake_server.py [port] [num_compute_nodes]
+#
+# and then point os_auth_url at http://localhost:port/identity/v2.0
+# (any username/password/tenant is accepted).
+#
+# Servers are created in the BUILD state and become ACTIVE after
+# BOOT_SECONDS.  Like Nova, server listings are returned in pages of at
+# most MAX_LIMIT servers.
+
+import BaseHTTPServer
+import SocketServer
+import json
+import re
+import sys
+import threading
+import time
+import urllib
+import uuid
+
+# Seconds a newly created server stays in the BUILD state
+BOOT_SECONDS = 2
+
+# Most servers returned by one list request (Nova's osapi_max_limit)
+MAX_LIMIT = 1000
+
+MGMT_NET_NAME = 'GRAM-mgmt-net'
+MGMT_NET_PREFIX = '192.168.10.'
+
+
+class FakeOpenStackState:
+    """
+        All the OpenStack objects known to the fake server.
+    """
+    def __init__(self, num_compute_nodes):
+        self.lock = threading.RLock()
+        self.tenants = {}
+        self.users = {}
+        self.roles = {}
+        self.role_assignments = []
+        self.tokens = {}
+        self.servers = {}
+        self.networks = {}
+        self.subnets = {}
+        self.ports = {}
+        self.routers = {}
+        self.floatingips = {}
+        self.security_groups = {}
+        self.compute_hosts = ['compute%d' % (i + 1) \
+                                  for i in range(num_compute_nodes)]
+        self.flavors = {}
+        self.images = {}
+        self.next_mgmt_ip = 2
+        self.next_vlan = 1000
+
+        for name in ['admin', 'service']:
+            self.add('tenants', {'name' : name, 'enabled' : True})
+        for name in ['admin', '_member_']:
+            self.add('roles', {'name' : name})
+        for i, name in enumerate(['m1.tiny', 'm1.small', 'm1.medium',
+                                  'm1.large', 'm1.xlarge']):
+            self.flavors[str(i + 1)] = {'id' : str(i + 1), 'name' : name,
+                                        'ram' : 512 * (2 ** i),
+                                        'vcpus' : 2 ** i,
+                                        'disk' : 10 * (2 ** i)}
+        for name in ['ubuntu-12.04', 'fedora-19', 'centos-6.5']:
+            self.add('images', {'name' : name, 'status' : 'ACTIVE',
+                                'disk_format' : 'qcow2',
+                                'container_format' : 'bare',
+                                'size' : 251985920})
+        self.add('networks', {'name' : MGMT_NET_NAME, 'tenant_id' : '',
+                              'provider:segmentation_id' : 2500,
+                              'subnets' : [], 'status' : 'ACTIVE'})
+        self.add('networks', {'name' : 'public', 'tenant_id' : '',
+                              'router:external' : True,
+                              'subnets' : [], 'status' : 'ACTIVE'})
+
+    def add(self, collection, record):
+        record = dict(record)
+        record.setdefault('id', str(uuid.uuid4()))
+        getattr(self, collection)[record['id']] = record
+        return record
+
+    def update_server_status(self, server):
+        if server['status'] == 'BUILD' and \
+                time.time() - server['created_at'] >= BOOT_SECONDS:
+            server['status'] = 'ACTIVE'
+
+
+class FakeOpenStackHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+        Dispatches requests to the handler for the matching API call.
+        Keystone lives under /identity/v2.0, Nova under
+        /compute/v2/<tenant_id>, Neutron under /network/v2.0 and
+        Glance under /image/v1.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self): self._dispatch('GET')
+    def do_POST(self): self._dispatch('POST')
+    def do_PUT(self): self._dispatch('PUT')
+    def do_DELETE(self): self._dispatch('DELETE')
+
+    def _reply(self, status, body=None):
+        content = ''
+        if body is not None:
+            content = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _dispatch(self, method):
+        state = self.server.state
+        length = int(self.headers.getheader('content-length', 0))
+        body = None
+        if length:
+            body = json.loads(self.rfile.read(length))
+        path = self.path.split('?')[0]
+        query = {}
+        if '?' in self.path:
+            for param in self.path.split('?', 1)[1].split('&'):
+                if '=' in param:
+                    name, value = param.split('=', 1)
+                    query[name] = urllib.unquote_plus(value)
+
+        if not (method == 'POST' and path.endswith('/tokens')):
+            if self.headers.getheader('x-auth-token') not in state.tokens:
+                return self._reply(401, {'error' : 'Unauthorized'})
+
+        state.lock.acquire()
+        try:
+            for pattern, handler_method, handler_name in _ROUTES:
+                if handler_method != method:
+                    continue
+                match = re.match(pattern + '$', path)
+                if match:
+                    handler = getattr(self, handler_name)
+                    return handler(state, body, query, *match.groups())
+        finally:
+            state.lock.release()
+        self._reply(404, {'error' : 'Not found: %s %s' % (method, path)})
+
+    def _matching(self, records, query):
+        result = []
+        for record in records:
+            matches = True
+            for name, value in query.items():
+                if name == 'all_tenants': continue
+                if name in record and str(record[name]) != value:
+                    matches = False
+            if matches:
+                result.append(record)
+        return result
+
+    def _list(self, records, query, body_key):
+        self._reply(200, {body_key : self._matching(records, query)})
+
+    def _delete(self, collection, object_id):
+        objects = getattr(self.server.state, collection)
+        if object_id not in objects:
+            return self._reply(404, {'error' : 'No such object'})
+        del objects[object_id]
+        self._reply(204)
+
+    ######## Keystone
+
+    def authenticate(self, state, body, query):
+        auth = body['auth']
+        tenant = None
+        for t in state.tenants.values():
+            if t['name'] == auth.get('tenantName'):
+                tenant = t
+        if tenant is None:
+            tenant = state.tenants.values()[0]
+        token = str(uuid.uuid4())
+        state.tokens[token] = tenant['id']
+        base = 'http://%s:%d' % self.server.server_address
+        catalog = [{'type' : 'identity', 'name' : 'keystone',
+                    'endpoints' : [{'region' : 'RegionOne',
+                                    'publicURL' : base + '/identity/v2.0',
+                                    'adminURL' : base + '/identity/v2.0'}]},
+                   {'type' : 'compute', 'name' : 'nova',
+                    'endpoints' : [{'region' : 'RegionOne',
+                                    'publicURL' : base + '/compute/v2/' + \
+                                        tenant['id']}]},
+                   {'type' : 'network', 'name' : 'neutron',
+                    'endpoints' : [{'region' : 'RegionOne',
+                                    'publicURL' : base + '/network'}]},
+                   {'type' : 'image', 'name' : 'glance',
+                    'endpoints' : [{'region' : 'RegionOne',
+                                    'publicURL' : base + '/image'}]}]
+        expires = time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                time.gmtime(time.time() + 3600))
+        self._reply(200, {'access' : {'token' : {'id' : token,
+                                                 'expires' : expires,
+                                                 'tenant' : tenant},
+                                      'serviceCatalog' : catalog}})
+
+    def list_tenants(self, state, body, query):
+        self._list(state.tenants.values(), query, 'tenants')
+
+    def create_tenant(self, state, body, query):
+        self._reply(200, {'tenant' : state.add('tenants', body['tenant'])})
+
+    def delete_tenant(self, state, body, query, tenant_id):
+        self._delete('tenants', tenant_id)
+
+    def list_users(self, state, body, query):
+        self._list(state.users.values(), query, 'users')
+
+    def get_user(self, state, body, query, user_id):
+        if user_id not in state.users:
+            return self._reply(404, {'error' : 'No such user'})
+        self._reply(200, {'user' : state.users[user_id]})
+
+    def create_user(self, state, body, query):
+        user = dict(body['user'])
+        del user['password']
+        self._reply(200, {'user' : state.add('users', user)})
+
+    def delete_user(self, state, body, query, user_id):
+        self._delete('users', user_id)
+
+    def list_roles(self, state, body, query):
+        self._list(state.roles.values(), query, 'roles')
+
+    def add_user_role(self, state, body, query, tenant_id, user_id, role_id):
+        state.role_assignments.append((tenant_id, user_id, role_id))
+        self._reply(200, {'role' : state.roles.get(role_id)})
+
+    ######## Nova
+
+    def list_servers(self, state, body, query, tenant_id):
+        for server in state.servers.values():
+            state.update_server_status(server)
+        if 'all_tenants' not in query and 'tenant_id' not in query:
+            query = dict(query)
+            query['tenant_id'] = state.tokens[
+                self.headers.getheader('x-auth-token')]
+        query = dict(query)
+        limit = min(int(query.pop('limit', MAX_LIMIT)), MAX_LIMIT)
+        marker = query.pop('marker', None)
+        servers = self._matching(state.servers.values(), query)
+        servers.sort(key=lambda server: (server['created_at'], server['id']))
+        start = 0
+        if marker is not None:
+            ids = [server['id'] for server in servers]
+            if marker not in ids:
+                return self._reply(400, {'badRequest' : \
+                    {'message' : 'marker [%s] not found' % marker}})
+            start = ids.index(marker) + 1
+        page = servers[start : start + limit]
+        body = {'servers' : page}
+        if len(page) == limit:
+            body['servers_links'] = \
+                [{'rel' : 'next', 
+                  'href' : '%s?marker=%s' % (self.path.split('?')[0],
+                                             page[-1]['id'])}]
+        self._reply(200, body)
+
+    def show_server(self, state, body, query, tenant_id, server_id):
+        if server_id not in state.servers:
+            return self._reply(404, {'error' : 'No such server'})
+        server = state.servers[server_id]
+        state.update_server_status(server)
+        self._reply(200, {'server' : server})
+
+    def create_server(self, state, body, query, tenant_id):
+        request = body['server']
+        host = state.compute_hosts[len(state.servers) % \
+                                       len(state.compute_hosts)]
+        zone = request.get('availability_zone', '')
+        if zone.startswith('nova:'):
+            host = zone[len('nova:'):]
+        server = state.add('servers', {'name' : request['name'],
+                                       'status' : 'BUILD',
+                                       'tenant_id' : tenant_id,
+                                       'image' : {'id' : request['imageRef']},
+                                       'flavor' : {'id' : \
+                                                       request['flavorRef']},
+                                       'created_at' : time.time(),
+                                       'OS-EXT-SRV-ATTR:host' : host,
+                                       'addresses' : {}})
+        for network in request.get('networks', []):
+            if 'port' in network:
+                port = state.ports[network['port']]
+                port['device_id'] = server['id']
+                net_name = state.networks[port['network_id']]['name']
+                addr = port['fixed_ips'][0]['ip_address']
+            else:
+                net_name = state.networks[network['uuid']]['name']
+                addr = MGMT_NET_PREFIX + str(state.next_mgmt_ip)
+                state.next_mgmt_ip += 1
+                state.add('ports', {'network_id' : network['uuid'],
+                                    'tenant_id' : tenant_id,
+                                    'device_id' : server['id'],
+                                    'device_owner' : 'compute:nova',
+                                    'mac_address' : _mac_address(),
+                                    'fixed_ips' : [{'ip_address' : addr}]})
+            server['addresses'].setdefault(net_name, []).append(
+                {'addr' : addr, 'version' : 4})
+        self._reply(202, {'server' : server})
+
+    def delete_server(self, state, body, query, tenant_id, server_id):
+        # Ports nova created for the server go away with it
+        for port in state.ports.values():
+            if port['device_id'] == server_id and \
+                    port.get('device_owner') == 'compute:nova':
+                del state.ports[port['id']]
+        self._delete('servers', server_id)
+
+    def server_action(self, state, body, query, tenant_id, server_id):
+        if server_id not in state.servers:
+            return self._reply(404, {'error' : 'No such server'})
+        server = state.servers[server_id]
+        if 'os-getConsoleOutput' in body:
+            state.update_server_status(server)
+            output = 'Booting...'
+            if server['status'] == 'ACTIVE':
+                output = 'Cloud-init finished\nlogin:'
+            return self._reply(200, {'output' : output})
+        if 'suspend' in body:
+            server['status'] = 'SUSPENDED'
+        elif 'resume' in body or 'reboot' in body:
+            server['status'] = 'ACTIVE'
+        self._reply(202)
+
+    def list_hypervisors(self, state, body, query, tenant_id):
+        hypervisors = [{'id' : i + 1, 'hypervisor_hostname' : host} \
+                           for i, host in enumerate(state.compute_hosts)]
+        self._reply(200, {'hypervisors' : hypervisors})
+
+    def list_hosts(self, state, body, query, tenant_id):
+        hosts = [{'host_name' : 'controller', 'service' : 'conductor',
+                  'zone' : 'internal'}]
+        for host in state.compute_hosts:
+            hosts.append({'host_name' : host, 'service' : 'compute',
+                          'zone' : 'nova'})
+        self._reply(200, {'hosts' : hosts})
+
+    def list_flavors(self, state, body, query, tenant_id):
+        self._list(state.flavors.values(), query, 'flavors')
+
+    def list_images(self, state, body, query, tenant_id):
+        self._list(state.images.values(), query, 'images')
+
+    def delete_image(self, state, body, query, tenant_id, image_id):
+        self._delete('images', image_id)
+
+    def list_security_groups(self, state, body, query, tenant_id):
+        self._list(state.security_groups.values(), query, 'security_groups')
+
+    def create_security_group(self, state, body, query, tenant_id):
+        group = dict(body['security_group'])
+        group['tenant_id'] = tenant_id
+        group['rules'] = []
+        self._reply(200, {'security_group' : \
+                              state.add('security_groups', group)})
+
+    def add_security_group_rule(self, state, body, query, tenant_id):
+        rule = dict(body['security_group_rule'])
+        rule['id'] = str(uuid.uuid4())
+        group = state.security_groups.get(rule['parent_group_id'])
+        if group is None:
+            return self._reply(404, {'error' : 'No such security group'})
+        group['rules'].append(rule)
+        self._reply(200, {'security_group_rule' : rule})
+
+    def delete_security_group(self, state, body, query, tenant_id, group_id):
+        self._delete('security_groups', group_id)
+
+    ######## Neutron
+
+    def list_collection(self, state, body, query, collection):
+        self._list(getattr(state, collection).values(), query, collection)
+
+    def show_network(self, state, body, query, network_id):
+        if network_id not in state.networks:
+            return self._reply(404, {'error' : 'No such network'})
+        self._reply(200, {'network' : state.networks[network_id]})
+
+    def create_resource(self, state, body, query, resource):
+        record = dict(body[resource])
+        if resource == 'network':
+            record.setdefault('provider:segmentation_id', state.next_vlan)
+            state.next_vlan += 1
+            record['subnets'] = []
+            record['status'] = 'ACTIVE'
+        elif resource == 'subnet':
+            if record['network_id'] not in state.networks:
+                return self._reply(404, {'error' : 'No such network'})
+        elif resource == 'port':
+            record['mac_address'] = _mac_address()
+            record.setdefault('device_id', '')
+        elif resource == 'floatingip':
+            record['floating_ip_address'] = \
+                '128.89.%d.%d' % (len(state.floatingips) / 250,
+                                  len(state.floatingips) % 250 + 2)
+            record['port_id'] = None
+            record['fixed_ip_address'] = None
+        record = state.add(resource + 's', record)
+        if resource == 'subnet':
+            state.networks[record['network_id']]['subnets'].append(
+                record['id'])
+        self._reply(201, {resource : record})
+
+    def update_floatingip(self, state, body, query, floatingip_id):
+        if floatingip_id not in state.floatingips:
+            return self._reply(404, {'error' : 'No such floating IP'})
+        fip = state.floatingips[floatingip_id]
+        fip.update(body['floatingip'])
+        port = state.ports.get(fip.get('port_id'))
+        if port is not None and port.get('fixed_ips'):
+            fip['fixed_ip_address'] = port['fixed_ips'][0]['ip_address']
+        self._reply(200, {'floatingip' : fip})
+
+    def delete_resource(self, state, body, query, resource, resource_id):
+        self._delete(resource + 's', resource_id)
+
+    def router_interface(self, state, body, query, router_id, operation):
+        if router_id not in state.routers:
+            return self._reply(404, {'error' : 'No such router'})
+        self._reply(200, {'id' : router_id,
+                          'subnet_id' : body.get('subnet_id')})
+
+    ######## Glance
+
+    def list_glance_images(self, state, body, query):
+        self._list(state.images.values(), query, 'images')
+
+
+def _mac_address():
+    return 'fa:16:3e:%s:%s:%s' % tuple([uuid.uuid4().hex[:2] \
+                                            for i in range(3)])
+
+
+_ROUTES = [
+    ('/identity/v2.0/tokens', 'POST', 'authenticate'),
+    ('/identity/v2.0/tenants', 'GET', 'list_tenants'),
+    ('/identity/v2.0/tenants', 'POST', 'create_tenant'),
+    ('/identity/v2.0/tenants/([^/]+)', 'DELETE', 'delete_tenant'),
+    ('/identity/v2.0/users', 'GET', 'list_users'),
+    ('/identity/v2.0/users', 'POST', 'create_user'),
+    ('/identity/v2.0/users/([^/]+)', 'GET', 'get_user'),
+    ('/identity/v2.0/users/([^/]+)', 'DELETE', 'delete_user'),
+    ('/identity/v2.0/OS-KSADM/roles', 'GET', 'list_roles'),
+    ('/identity/v2.0/tenants/([^/]+)/users/([^/]+)/roles/OS-KSADM/([^/]+)',
+     'PUT', 'add_user_role'),
+    ('/compute/v2/([^/]+)/servers/detail', 'GET', 'list_servers'),
+    ('/compute/v2/([^/]+)/servers', 'POST', 'create_server'),
+    ('/compute/v2/([^/]+)/servers/([^/]+)', 'GET', 'show_server'),
+    ('/compute/v2/([^/]+)/servers/([^/]+)', 'DELETE', 'delete_server'),
+    ('/compute/v2/([^/]+)/servers/([^/]+)/action', 'POST', 'server_action'),
+    ('/compute/v2/([^/]+)/os-hypervisors', 'GET', 'list_hypervisors'),
+    ('/compute/v2/([^/]+)/os-hosts', 'GET', 'list_hosts'),
+    ('/compute/v2/([^/]+)/flavors/detail', 'GET', 'list_flavors'),
+    ('/compute/v2/([^/]+)/images/detail', 'GET', 'list_images'),
+    ('/compute/v2/([^/]+)/images/([^/]+)', 'DELETE', 'delete_image'),
+    ('/compute/v2/([^/]+)/os-security-groups', 'GET',
+     'list_security_groups'),
+    ('/compute/v2/([^/]+)/os-security-groups', 'POST',
+     'create_security_group'),
+    ('/compute/v2/([^/]+)/os-security-groups/([^/]+)', 'DELETE',
+     'delete_security_group'),
+    ('/compute/v2/([^/]+)/os-security-group-rules', 'POST',
+     'add_security_group_rule'),
+    ('/network/v2.0/(networks|subnets|ports|routers|floatingips)', 'GET',
+     'list_collection'),
+    ('/network/v2.0/networks/([^/]+)', 'GET', 'show_network'),
+    ('/network/v2.0/(network|subnet|port|router|floatingip)s', 'POST',
+     'create_resource'),
+    ('/network/v2.0/floatingips/([^/]+)', 'PUT', 'update_floatingip'),
+    ('/network/v2.0/(network|subnet|port|router|floatingip)s/([^/]+)',
+     'DELETE', 'delete_resource'),
+    ('/network/v2.0/routers/([^/]+)/(add|remove)_router_interface', 'PUT',
+     'router_interface'),
+    ('/image/v1/images/detail', 'GET', 'list_glance_images'),
+    ]
+
+
+class FakeOpenStackServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, num_compute_nodes=4):
+        BaseHTTPServer.HTTPServer.__init__(self, server_address,
+                                           FakeOpenStackHandler)
+        self.state = FakeOpenStackState(num_compute_nodes)
+
+
+def start_fake_server(port=0, num_compute_nodes=4):
+    """
+        Start a fake server on a background thread.  Returns the server
+        (whose auth URL is auth_url(server)).
+    """
+    server = FakeOpenStackServer(('localhost', port), num_compute_nodes)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    return server
+
+
+def auth_url(server):
+    return 'http://%s:%d/identity/v2.0' % server.server_address
+
+
+if __name__ == "__main__":
+    port = 5000
+    num_compute_nodes = 4
+    if len(sys.argv) > 1: port = int(sys.argv[1])
+    if len(sys.argv) > 2: num_compute_nodes = int(sys.argv[2])
+    server = FakeOpenStackServer(('localhost', port), num_compute_nodes)
+    print "Fake OpenStack API listening; auth URL is %s" % auth_url(server)
+    server.serve_forever()
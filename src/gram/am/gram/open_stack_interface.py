@@ -34,13 +34,21 @@ import string
 import netaddr
 import json
 import threading
+import base64
 
 import resources
 import config
 import constants
 import utils
 import gen_metadata
+import inventory_cache
 import manage_ssh_proxy
+import open_stack_output
+import open_stack_rest
+import task_executor
+import vm_creation_pool
+import vm_status
+import vm_watcher
 
 from xml.dom.minidom import *
 
@@ -54,16 +62,38 @@ def init() :
         Perform OpenStack related initialization.  Called once when the
         GRAM AM starts up.
     """
+    global _rest_api_unavailable
+    if config.openstack_api == 'rest' :
+        # Make sure we can get a token.  If not, use the command line
+        # clients instead
+        try :
+            open_stack_rest.get_client().get_token()
+            config.logger.info('Using OpenStack REST APIs at %s' % \
+                                   config.os_auth_url)
+        except Exception, e :
+            config.logger.error('Failed to authenticate with OpenStack REST APIs (%s).  Falling back to command line clients' % str(e))
+            _rest_api_unavailable = True
+
     # Get the UUID of the GRAM management network
     mgmt_net_name = config.management_network_name 
-    cmd_string = '%s net-list' % config.network_type
-    try :
-        output = _execCommand(cmd_string)
-    except :
-        config.logger.error('GRAM AM failed at init.  Failed to do a quantum/neutron net-list')
-        sys.exit(1)
-        
-    mgmt_net_uuid = _getUUIDByName(output, mgmt_net_name)
+    client = _getRESTClient()
+    if client :
+        try :
+            mgmt_net_uuid = None
+            for net in client.list_networks(name=mgmt_net_name) :
+                mgmt_net_uuid = net['id']
+        except :
+            config.logger.error('GRAM AM failed at init.  Failed to list networks')
+            sys.exit(1)
+    else :
+        cmd_string = _networkCommand('net-list')
+        try :
+            output = _execCommand(cmd_string)
+        except :
+            config.logger.error('GRAM AM failed at init.  Failed to do a quantum/neutron net-list')
+            sys.exit(1)
+
+        mgmt_net_uuid = _getUUIDByName(output, mgmt_net_name)
     if mgmt_net_uuid == None :
         config.logger.error('GRAM AM failed at init.  Failed to find the GRAM management network %s' % mgmt_net_name)
         sys.exit(1)
@@ -111,7 +141,8 @@ def provisionResources(geni_slice, slivers, users, gram_manager) :
         # this IDN+ sub-string.
         slice_urn = geni_slice.getSliceURN()
         tenant_name = slice_urn[slice_urn.rfind('IDN+') + 4 : ]
-        geni_slice.setTenantName(tenant_name)
+        with geni_slice.getWriteLock() :
+            geni_slice.setTenantName(tenant_name)
 
         # Create a new tenant and set the tenant UUID in the Slice object
         tenant_uuid = _createTenant(tenant_name)
@@ -121,16 +152,18 @@ def provisionResources(geni_slice, slivers, users, gram_manager) :
             #    - nothing to cleanup
             return 'GRAM internal error: OpenStack failed to create a tenant for slice %s' % geni_slice.getSliceURN()
         else :
-            geni_slice.setTenantUUID(tenant_uuid)
+            with geni_slice.getWriteLock() :
+                geni_slice.setTenantUUID(tenant_uuid)
 
         # Create a admin user account for this tenant
         admin_user_info = _createTenantAdmin(tenant_name, tenant_uuid)
         if ('admin_name' in admin_user_info) and  \
                 ('admin_pwd' in admin_user_info) and \
                 ('admin_uuid' in admin_user_info) :
-            geni_slice.setTenantAdminInfo(admin_user_info['admin_name'], 
-                                          admin_user_info['admin_pwd'],
-                                          admin_user_info['admin_uuid'])
+            with geni_slice.getWriteLock() :
+                geni_slice.setTenantAdminInfo(admin_user_info['admin_name'], 
+                                              admin_user_info['admin_pwd'],
+                                              admin_user_info['admin_uuid'])
         else :
             # Failed to create tenant admin.  Cleanup actions before 
             # we return:
@@ -148,7 +181,8 @@ def provisionResources(geni_slice, slivers, users, gram_manager) :
                                        admin_user_info['admin_pwd'])
             
         if (secgroup_name != None) :
-            geni_slice.setSecurityGroup(secgroup_name)
+            with geni_slice.getWriteLock() :
+                geni_slice.setSecurityGroup(secgroup_name)
         else :
             # Failed to create security group.  Cleanup actions before 
             # we return:
@@ -164,10 +198,12 @@ def provisionResources(geni_slice, slivers, users, gram_manager) :
         # Create a router for this tenant.  The name of this router is 
         # R-tenant_name.
         router_name = 'R-%s' % tenant_name
-        geni_slice.setTenantRouterName(router_name)
+        with geni_slice.getWriteLock() :
+            geni_slice.setTenantRouterName(router_name)
         router_uuid = _createRouter(tenant_uuid, router_name)
         if router_uuid != None :
-            geni_slice.setTenantRouterUUID(router_uuid)
+            with geni_slice.getWriteLock() :
+                geni_slice.setTenantRouterUUID(router_uuid)
             config.logger.info('Created tenant router %s with uuid = %s' %
                             (router_name, router_uuid))
         else:
@@ -206,74 +242,113 @@ def provisionResources(geni_slice, slivers, users, gram_manager) :
                            (len(links_to_be_provisioned), 
                             len(vms_to_be_provisioned))) 
 
-    subnets_used = []
-    for link in links_to_be_provisioned:
-        if link.getSubnet() != None:
-            subnets_used.append(link.getSubnet)
-
-    used_ips = []
-    for vm in vms_to_be_provisioned :
-        for nic in vm.getNetworkInterfaces() :
-            nic.enable()
-            if nic.getIPAddress():
-               used_ips.append(netaddr.IPAddress(nic.getIPAddress())) 
-
-        for nic in vm.getNetworkInterfaces() :
-            if not nic.getIPAddress():
-                link = nic.getLink()
-                if link == None :
-                   # NIC is not connected to a link.  Go to next NIC
-                    break
-
-                subnet = link.getSubnet()
-                if not subnet:
-                    subnet = geni_slice.generateSubnetAddress()
-                    while subnet in subnets_used:
-                        subnet = geni_slice.generateSubnetAddress()
-                    link.setSubnet(subnet)
-                subnet_addr = netaddr.IPNetwork(subnet)
-                for i in range(1,len(subnet_addr)):
-                    if not subnet_addr[i] in used_ips:
-                        nic.setIPAddress(str(subnet_addr[i]))
-                        nic.setNetmask('255.255.255.0')
-                        used_ips.append(subnet_addr[i])
-                        break
-                
     # For each VirtualMachine object in the slice, create an  
             
     # For each link to be provisioned, set up a quantum/neutron network and subnet if
     # it does not already have one.  (It will have a quantum/neutron network and 
     # subnet if it was provisioned by a previous call to provision.)
-    links_created_this_call = list()  # Links created by this call to provision
+    # Then create a port for each NIC of the VMs to be created.  These
+    # OpenStack calls are run in parallel: a link's network is created
+    # before the ports on it and all networks are created before we look up
+    # their VLANs.  The VMs are booted once all of this has succeeded.
+    # Subnet and IP addresses are handed out here, not in parallel in the
+    # tasks.  The tasks return the UUIDs of what they created and the links
+    # and NICs are updated once they are done: the slivers are only changed
+    # holding the slice's state lock, so Status and Describe calls see
+    # them consistently.
+    with geni_slice.getWriteLock() :
+        subnets_used = []
+        for link in links_to_be_provisioned:
+            if link.getSubnet() != None:
+                subnets_used.append(link.getSubnet())
+
+        used_ips = []
+        for vm in vms_to_be_provisioned :
+            for nic in vm.getNetworkInterfaces() :
+                nic.enable()
+                if nic.getIPAddress():
+                   used_ips.append(netaddr.IPAddress(nic.getIPAddress())) 
+
+            for nic in vm.getNetworkInterfaces() :
+                if not nic.getIPAddress():
+                    link = nic.getLink()
+                    if link == None :
+                       # NIC is not connected to a link.  Go to next NIC
+                        break
+
+                    subnet = link.getSubnet()
+                    if not subnet:
+                        subnet = geni_slice.generateSubnetAddress()
+                        while subnet in subnets_used:
+                            subnet = geni_slice.generateSubnetAddress()
+                        link.setSubnet(subnet)
+                    subnet_addr = netaddr.IPNetwork(subnet)
+                    for i in range(1,len(subnet_addr)):
+                        if not subnet_addr[i] in used_ips:
+                            nic.setIPAddress(str(subnet_addr[i]))
+                            nic.setNetmask('255.255.255.0')
+                            used_ips.append(subnet_addr[i])
+                            break
+                
+        for link in links_to_be_provisioned :
+            if link.getUUID() == None and not link.getSubnet() :
+                subnet = geni_slice.generateSubnetAddress()
+                while subnet in subnets_used:
+                    subnet = geni_slice.generateSubnetAddress()
+                link.setSubnet(subnet)
+                subnets_used.append(subnet)
+    provision_tasks = \
+        task_executor.TaskGraph(config.provision_concurrency,
+                                'provisioning tasks for %s' % tenant_name)
+    link_tasks = {}
+    failed_networks = [] # Networks of links that failed, to be deleted
     for link in links_to_be_provisioned :
         if link.getUUID() == None :
             # This network link has not been set up
-            uuids = _createNetworkForLink(link,used_ips)
-            if uuids == None :
-                # Failed to create this network link.  Cleanup actions before
-                # we return:
-                #    - delete the network links created so far in this
-                #      call to provisionResources
-                #    - delete tenant admin
-                #    - delete tenant
-                #for i in range(0, len(links_created_this_call)) :
-                #    _deleteNetworkLink(geni_slice, links_created_this_call)
-                #_deleteUserByUUID(admin_user_info['admin_uuid'])
-                #_deleteTenantByUUID(tenant_uuid)
-                return 'GRAM internal error: Failed to create a network for link %s' % link.getName()
-
-            link.setNetworkUUID(uuids['network_uuid'])
-            link.setSubnetUUID(uuids['subnet_uuid'])
-            link.setUUID(uuids['network_uuid'])
-            link.setAllocationState(constants.provisioned)
-            links_created_this_call.append(uuids['network_uuid'])
-            link.setAllocationState(constants.provisioned)
-            link.setOperationalState(constants.ready)
-
-    # Find the VLANs used by this slice
-    nets_info = _getNetsForTenant(tenant_uuid)
-    if nets_info == None :
-        # Failed to get information on networks  Cleanup actions before 
+            link_tasks[link] = \
+                provision_tasks.add('create network for link %s' % \
+                                        link.getName(),
+                                    _provisionLink,
+                                    (link, used_ips, failed_networks))
+    vlans_task = provision_tasks.add('get VLANs for tenant %s' % tenant_name,
+                                     _getNetsForTenant, (tenant_uuid,),
+                                     depends_on=link_tasks.values())
+    port_tasks = {}
+    for vm in vms_to_be_provisioned :
+        if vm.getUUID() != None : continue
+        for nic in vm.getNetworkInterfaces() :
+            link = nic.getLink()
+            if not nic.isEnabled() or link == None : continue
+            link_task = link_tasks.get(link)
+            depends_on = []
+            if link_task != None :
+                depends_on.append(link_task)
+            port_tasks[nic] = \
+                provision_tasks.add('create port for interface %s' % \
+                                        nic.getName(),
+                                    _createPortForNIC,
+                                    (nic, tenant_uuid, link_task),
+                                    depends_on=depends_on)
+    success = provision_tasks.run()
+
+    # Record the networks and ports that were created (also if some tasks
+    # failed, so that they are deleted with the slivers)
+    with geni_slice.getWriteLock() :
+        for link, task in link_tasks.items() :
+            if task.result != None :
+                link.setNetworkUUID(task.result['network_uuid'])
+                link.setSubnetUUID(task.result['subnet_uuid'])
+                link.setUUID(task.result['network_uuid'])
+                link.setAllocationState(constants.provisioned)
+                link.setOperationalState(constants.ready)
+        for nic, task in port_tasks.items() :
+            if task.result != None :
+                nic.setUUID(task.result['id'])
+                if task.result['mac_address'] != None :
+                    nic.setMACAddress(task.result['mac_address'])
+
+    if not success :
+        # Failed to create a network link or port.  Cleanup actions before
         # we return:
         #    - delete the network links created so far in this
         #      call to provisionResources
@@ -283,47 +358,86 @@ def provisionResources(geni_slice, slivers, users, gram_manager) :
         #    _deleteNetworkLink(geni_slice, links_created_this_call)
         #_deleteUserByUUID(admin_user_info['admin_uuid'])
         #_deleteTenantByUUID(tenant_uuid)
+        # Now that no task is using the tenant router, delete the networks
+        # of the links that failed
+        for network_uuid in failed_networks :
+            _deleteNetworkLink(geni_slice, network_uuid)
+        failed_task = provision_tasks.getFailedTasks()[0]
+        if failed_task.exception != None :
+            return str(failed_task.exception)
+        return 'GRAM internal error: Failed to %s' % failed_task.name
+
+    # Find the VLANs used by this slice
+    nets_info = vlans_task.result
+    if nets_info == None :
+        # Failed to get information on networks  Cleanup actions before 
+        # we return:
+        #    - delete the network links created so far in this
+        #      call to provisionResources
+        #    - delete tenant admin
+        #    - delete tenant
         return 'GRAM internal error: Failed to get vlan ids for networks created for slice  %s' % geni_slice.getSliceURN()
 
-    for net_uuid in nets_info.keys():
-        net_info = nets_info[net_uuid]
-        vlan = net_info['vlan']
-#        if net_uuid == control_net_info['control_net_uuid']:
-#            config.logger.info("Setting control net vlan to " + str(vlan))
-#            control_net_info['control_net_vlan'] = vlan
-#        else:
-        for link in geni_slice.getNetworkLinks():
-            if link.getNetworkUUID() == net_uuid:
-                name = net_info['name']
-                config.logger.info("Setting data net " + name + " VLAN to " + vlan)
-                link.setVLANTag(vlan)
+    with geni_slice.getWriteLock() :
+        for net_uuid in nets_info.keys():
+            net_info = nets_info[net_uuid]
+            vlan = net_info['vlan']
+#            if net_uuid == control_net_info['control_net_uuid']:
+#                config.logger.info("Setting control net vlan to " + str(vlan))
+#                control_net_info['control_net_vlan'] = vlan
+#            else:
+            for link in geni_slice.getNetworkLinks():
+                if link.getNetworkUUID() == net_uuid:
+                    name = net_info['name']
+                    config.logger.info("Setting data net " + name + " VLAN to " + vlan)
+                    link.setVLANTag(vlan)
+
+    # Now grab and set the mac addresses of the new ports from the port
+    # list.  (The REST API returns them when the ports are created.)
+    nics_without_mac = []
+    for vm in vms_to_be_provisioned :
+        for nic in vm.getNetworkInterfaces() :
+            if nic.getUUID() != None and nic.getMACAddress() == None :
+                nics_without_mac.append(nic)
+    if len(nics_without_mac) > 0 :
+        ports_info = _getPortsForTenant(tenant_uuid)
+        if ports_info == None :
+            config.logger.error('Failed to get MAC addresses for network interfaces for tenant %s' % tenant_uuid)
+            # Not doing any rollback.  Do we really want to fail the entire 
+            # provision if we can't get mac addresses?
+        else :
+            with geni_slice.getWriteLock() :
+                for nic in nics_without_mac :
+                    if ports_info.has_key(nic.getUUID()) :
+                        nic.setMACAddress(ports_info[nic.getUUID()]['mac_address'])
 
     # For each VM, assign IP addresses to all its interfaces that are
     # connected to a network link
-    for vm in vms_to_be_provisioned :
-        for nic in vm.getNetworkInterfaces() :
-            nic.enable()
-            #if nic.getIPAddress() == None :
-                # NIC needs an IP, if it is connected to a link
-            #    link = nic.getLink()
-            #    if link == None :
-                    # NIC is not connected to a link.  Go to next NIC
-            #        break
+    with geni_slice.getWriteLock() :
+        for vm in vms_to_be_provisioned :
+            for nic in vm.getNetworkInterfaces() :
+                nic.enable()
+                #if nic.getIPAddress() == None :
+                    # NIC needs an IP, if it is connected to a link
+                #    link = nic.getLink()
+                #    if link == None :
+                        # NIC is not connected to a link.  Go to next NIC
+                #        break
                 
-                # NIC is connected to a link.  We assign an IP address to the
-                # NIC only if the link it is connected to has been created
-           #     if link.getUUID() == None :
-                    # NIC is not connected to a link that not been 
-                    # provisioned.  Go to next NIC
-           #         break
-
-                # NIC is connected to a link that has been provisioned. Give
-                # it an IP address.  If IP addresses are from the 
-                # 10.0.x.0/24 subnet, this interface gets the
-                # ip address 10.0.x.nnn where nnn is the last octet for this vm
-          #      subnet_addr = link.getSubnet()
-          #      subnet_prefix = subnet_addr[0 : subnet_addr.rfind('0/24')]
-          #      nic.setIPAddress(str(netaddr.IPNetwork(subnet_addr)[vm.getLastOctet()]))
+                    # NIC is connected to a link.  We assign an IP address to the
+                    # NIC only if the link it is connected to has been created
+               #     if link.getUUID() == None :
+                        # NIC is not connected to a link that not been 
+                        # provisioned.  Go to next NIC
+               #         break
+
+                    # NIC is connected to a link that has been provisioned. Give
+                    # it an IP address.  If IP addresses are from the 
+                    # 10.0.x.0/24 subnet, this interface gets the
+                    # ip address 10.0.x.nnn where nnn is the last octet for this vm
+              #      subnet_addr = link.getSubnet()
+              #      subnet_prefix = subnet_addr[0 : subnet_addr.rfind('0/24')]
+              #      nic.setIPAddress(str(netaddr.IPNetwork(subnet_addr)[vm.getLastOctet()]))
 
     # For each VirtualMachine object in the slice, create an OpenStack
     # VM if such a VM has not already been created.
@@ -348,6 +462,56 @@ def provisionResources(geni_slice, slivers, users, gram_manager) :
                                   users, gram_manager, geni_slice)
     return create_return
 
+def _provisionLink(link, used_ips, failed_networks) :
+    """
+        Create the network, subnet and router interface for a link.
+        Returns the UUIDs of the network and subnet as a dictionary keyed
+        by 'network_uuid' and 'subnet_uuid' (provisionResources sets them
+        in the link).  Raises an exception holding the error message for
+        provisionResources on failure.  The network of a link that failed
+        is added to failed_networks: it is deleted once all the
+        provisioning tasks are done, as deleting it also deletes the
+        tenant router the other links are being attached to.
+    """
+    uuids = _createNetworkForLink(link, used_ips, failed_networks)
+    if uuids == None :
+        raise Exception('GRAM internal error: Failed to create a network for link %s' % link.getName())
+    return uuids
+
+
+def _createPortForNIC(nic, tenant_uuid, link_task=None) :
+    """
+        Create a port on the network of the NIC's link for the NIC.  If
+        the link is being provisioned, link_task is the task creating its
+        network.  Returns {'id', 'mac_address'} of the port (the MAC
+        address is None if we don't have it); provisionResources sets them
+        in the NIC.  The VM is later booted with this port.
+    """
+    link_object = nic.getLink()
+    if link_task != None :
+        net_uuid = link_task.result['network_uuid']
+        subnet_uuid = link_task.result['subnet_uuid']
+    else :
+        net_uuid = link_object.getNetworkUUID()
+        subnet_uuid = link_object.getSubnetUUID()
+    nic_ip_addr = nic.getIPAddress()
+    client = _getRESTClient()
+    inventory_cache.inventory.invalidate('ovs_vlans')
+    if client :
+        fixed_ip = {'subnet_id' : subnet_uuid}
+        if nic_ip_addr :
+            fixed_ip['ip_address'] = nic_ip_addr
+        port = client.create_port(net_uuid, tenant_uuid, [fixed_ip])
+        return {'id' : port['id'], 'mac_address' : port['mac_address']}
+    if nic_ip_addr :
+        cmd_string = '%s --tenant-id %s --fixed-ip subnet_id=%s,ip_address=%s %s' % (_networkCommand('port-create'), tenant_uuid, subnet_uuid, nic_ip_addr, net_uuid)
+    else:
+        cmd_string = '%s --tenant-id %s --fixed-ip subnet_id=%s %s' % (_networkCommand('port-create'), tenant_uuid, subnet_uuid, net_uuid)
+    output = _execCommand(cmd_string) 
+    return {'id' : _getValueByPropertyName(output, 'id'),
+            'mac_address' : None}
+
+
 def _createAllVMs(vms_to_be_provisioned, num_compute_nodes, users, gram_manager, slice_object):
     num_vms_created = 0    # number of VMs created in this provision call
     vm_uuids = []  # List of uuids of VMs created in this provision call
@@ -364,29 +528,45 @@ def _createAllVMs(vms_to_be_provisioned, num_compute_nodes, users, gram_manager,
                 user_names.append(user[key].split('+')[-1])
           
 
-    # For efficiency, create all VM's in parallel and then wait for them
-    # these threads to finish before returning
-    creation_threads = {}
+    # For efficiency, create the VM's in parallel on the shared VM creation
+    # pool and then wait for them to finish before returning.  The pool
+    # limits how many VM's are created at once for this slice and overall.
+    creation_requests = []
     for vm in vms_to_be_provisioned  :
         if vm.getUUID() == None :
             # This VM object does not have an openstack VM associated with it.
             # We need to create one.
+            timings = {}
             if num_vms_created == 0 or num_vms_created >= num_compute_nodes :
                 # We are in Step 1 or Step 3 of the VM placement algorithm
                 # described above.  We don't give openstack any hints on
                 # where this VM should go
-                creation_thread = \
-                    threading.Thread(target=_createVM, args=(vm, users, None))
-                creation_threads[vm] = creation_thread
-                creation_thread.start()
+                placement_hint = None
             else :
-                creation_thread = \
-                    threading.Thread(target=_createVM, args=(vm, users, vm_uuids))
-                creation_threads[vm] = creation_thread
-                creation_thread.start()
-
-    for vm, creation_thread in creation_threads.items():
-        creation_thread.join()
+                placement_hint = vm_uuids
+            creation_request = \
+                vm_creation_pool.pool.submit(slice_object.getSliceURN(),
+                                             vm.getName(), _createVM,
+                                             (vm, users, placement_hint,
+                                              timings))
+            creation_requests.append((vm, creation_request, timings))
+
+    for vm, creation_request, timings in creation_requests:
+        creation_request.wait()
+        config.logger.info('Created VM %s: queued %.1f sec, boot %.1f sec, poll %.1f sec' % \
+                               (vm.getName(), creation_request.getQueueTime(),
+                                timings.get('boot', 0), timings.get('poll', 0)))
+
+    # In asynchronous mode the VMs have only been booted.  The VM watcher
+    # tracks them from here on and finishes setting them up once they are
+    # ACTIVE.
+    if config.async_provisioning :
+        watchVMs(slice_object, [vm for vm, creation_request, timings \
+                                    in creation_requests \
+                                    if vm.getUUID() != None],
+                 gram_manager)
+
+    for vm, creation_request, timings in creation_requests:
         vm_uuid = vm.getUUID()
         if vm_uuid == None :
             # Failed to create this vm.  Cleanup actions before
@@ -406,20 +586,38 @@ def _createAllVMs(vms_to_be_provisioned, num_compute_nodes, users, gram_manager,
             #                        vm.getName())
             return 'GRAM internal error: Failed to create a VM for node %s' % vm.getName()
         else :
-            vm.setUUID(vm_uuid)
-            vm.setAllocationState(constants.provisioned)
-            num_vms_created += 1
-            vm_uuids.append(vm_uuid)
-            vm.setAuthorizedUsers(user_names)
-            vm.setAllocationState(constants.provisioned)
-            vm.setOperationalState(constants.notready)
-#                print "VM = %s" % vm
-
-    gram_manager.persist_state() # Save updated state after the VM's are set up
+            with slice_object.getWriteLock() :
+                vm.setUUID(vm_uuid)
+                vm.setAllocationState(constants.provisioned)
+                num_vms_created += 1
+                vm_uuids.append(vm_uuid)
+                vm.setAuthorizedUsers(user_names)
+                vm.setAllocationState(constants.provisioned)
+                if not config.async_provisioning :
+                    vm.setOperationalState(constants.notready)
+#                    print "VM = %s" % vm
+
+    # Save updated state after the VM's are set up
+    with slice_object.getReadLock() :
+        gram_manager.persist_state(slice_object)
     config.logger.info("Exiting createAllVMs thread...")
 
     return None
 
+def watchVMs(geni_slice, vms, gram_manager) :
+    """
+        Have the VM watcher track the given booting VMs of a slice and
+        finish setting them up once they are ACTIVE.  The slice's state is
+        saved once they are done.  Called when VMs are booted in
+        asynchronous mode and for VMs that were still being set up when
+        the aggregate's state was saved.
+    """
+    def persist_slice() :
+        with geni_slice.getReadLock() :
+            gram_manager.persist_state(geni_slice)
+    for vm in vms :
+        vm_watcher.watcher.watch(vm, persist_slice)
+
 # Delete all ports associated with given slice/tenant
 # Allow some failures: there will be some that can't be deleted
 # Or are automatically deleted by deleting others
@@ -456,7 +654,6 @@ def deleteSlivers(geni_slice, slivers) :
     """
     return_val = True  # Value returned by this method.  Be optimistic!
 
-    # We delete all the VMs before we delete the links.
     # Walk through the list of sliver_objects and create two list:
     # links_to_be_deleted and vms_to_be_deleted
     links_to_be_deleted = list()
@@ -472,48 +669,147 @@ def deleteSlivers(geni_slice, slivers) :
                            (len(links_to_be_deleted), 
                             len(vms_to_be_deleted))) 
 
-    # For each VM to be deleted, delete the VM and its associated network ports
-    for vm in vms_to_be_deleted  :
-        success = _deleteVM(vm)
-        if success :
-            vm.setAllocationState(constants.unallocated)
-            vm.setOperationalState(constants.stopping)
-        else :
+    # Delete the VMs and links in parallel.  The networks and subnets of a
+    # link are deleted once the VMs (ports) on the link are gone.
+    teardown_tasks = \
+        task_executor.TaskGraph(config.teardown_concurrency,
+                                'teardown tasks for %s' % \
+                                    geni_slice.getTenantName())
+    vm_tasks, link_tasks = \
+        _addDeleteSliverTasks(teardown_tasks, geni_slice,
+                              vms_to_be_deleted, links_to_be_deleted)
+    teardown_tasks.run()
+    _setSliversDeleted(geni_slice, vms_to_be_deleted + links_to_be_deleted,
+                       vm_tasks + link_tasks)
+    for task in vm_tasks + link_tasks :
+        if not task.result :
             return_val = False
 
+    ### Delete tenant router.  This section is empty right now as we don't
+    ### do per-tenant routers as yet.
+
+    return return_val
+
+
+def _addDeleteSliverTasks(teardown_tasks, geni_slice, vms_to_be_deleted,
+                          links_to_be_deleted) :
+    """
+        Add to the TaskGraph teardown_tasks tasks that delete the given VMs
+        and links of the slice (and the tenant router, if no links are to
+        be deleted).  Returns (tasks for the VMs, tasks for the links);
+        each task's result is True if the sliver was deleted.
+    """
+    # For each VM to be deleted, delete the VM and its associated network
+    # ports and floating IPs.  The floating IPs of the tenant are listed
+    # once for all the VMs.
+    vm_tasks = list()
+    if len(vms_to_be_deleted) > 0 :
+        floating_ips_task = \
+            teardown_tasks.add('list floating IPs of tenant %s' % \
+                                   geni_slice.getTenantName(),
+                               _getFloatingIpsForTenant,
+                               (geni_slice.getTenantUUID(),))
+        for vm in vms_to_be_deleted  :
+            vm_tasks.append(teardown_tasks.add('delete VM %s' % vm.getName(),
+                                               _deleteVMSliver,
+                                               (vm, floating_ips_task),
+                                               depends_on=[floating_ips_task]))
+
     if len(links_to_be_deleted) == 0 and geni_slice.getTenantRouterUUID():
         # Delete the router
-        router_uuid = geni_slice.getTenantRouterUUID()
-        cmd_string = '%s router-delete %s' % (config.network_type, router_uuid)
-        try:
-            _execCommand(cmd_string)
-            geni_slice.setTenantRouterUUID(None)
-        except:
-            config.logger.error("Failed to delete router %s" % router_uuid)
+        teardown_tasks.add('delete tenant router', _deleteTenantRouter,
+                           (geni_slice,), depends_on=vm_tasks)
 
     # Delete the networks and subnets associated with the links to be deleted 
+    link_tasks = list()
     for link in links_to_be_deleted :
-        success = _deleteNetworkLink(geni_slice,  link.getNetworkUUID())
-        if success :
-            link.setAllocationState(constants.unallocated)
-            link.setOperationalState(constants.stopping)
-        else :
-            return_val = False
+        depends_on = list()
+        for vm, vm_task in zip(vms_to_be_deleted, vm_tasks) :
+            for nic in vm.getNetworkInterfaces() :
+                if nic.getLink() == link :
+                    depends_on.append(vm_task)
+                    break
+        link_tasks.append(teardown_tasks.add('delete link %s' % \
+                                                 link.getName(),
+                                             _deleteLinkSliver,
+                                             (geni_slice, link),
+                                             depends_on=depends_on))
+    return vm_tasks, link_tasks
 
-    ### Delete tenant router.  This section is empty right now as we don't
-    ### do per-tenant routers as yet.
 
-    return return_val
+def _setSliversDeleted(geni_slice, slivers, tasks) :
+    """
+        Once the teardown tasks have run, update the state of the given
+        slivers whose task (in tasks, in the same order) deleted them.
+        The tasks don't change the slivers themselves: they run without
+        the slice's state lock.
+    """
+    with geni_slice.getWriteLock() :
+        for sliver, task in zip(slivers, tasks) :
+            if task.result :
+                sliver.setAllocationState(constants.unallocated)
+                sliver.setOperationalState(constants.stopping)
+
+
+def _deleteVMSliver(vm, floating_ips_task) :
+    """
+        Delete the VM.  floating_ips_task is the task that listed the 
+        tenant's floating IPs.  Returns True if the VM was deleted.
+    """
+    fip_ids = None
+    if floating_ips_task.result != None :
+        fip_ids = _getFloatingIpsOfVM(vm, floating_ips_task.result)
+    return _deleteVM(vm, fip_ids)
+
+
+def _deleteLinkSliver(geni_slice, link) :
+    return _deleteNetworkLink(geni_slice,  link.getNetworkUUID())
+
+
+def _deleteTenantRouter(geni_slice) :
+    router_uuid = geni_slice.getTenantRouterUUID()
+    cmd_string = '%s router-delete %s' % (config.network_type, router_uuid)
+    client = _getRESTClient()
+    try:
+        inventory_cache.inventory.invalidate('routers')
+        if client :
+            client.delete_router(router_uuid)
+        else :
+            _execCommand(cmd_string)
+        with geni_slice.getWriteLock() :
+            geni_slice.setTenantRouterUUID(None)
+    except:
+        config.logger.error("Failed to delete router %s" % router_uuid)
 
 
 def expireSlice(geni_slice) :
     """
         Called when a slice is past its expiration time.
     """
-    # Delete all slivers that belong to this slice
+    # Delete all slivers that belong to this slice.  Once its VMs, links
+    # and router are gone delete the tenant's security group, then its
+    # admin user and then the tenant itself.
     slivers = geni_slice.getSlivers().values()
-    deleteSlivers(geni_slice, slivers)
+    vms = [sliver for sliver in slivers \
+               if isinstance(sliver, resources.VirtualMachine)]
+    links = [sliver for sliver in slivers \
+                 if isinstance(sliver, resources.NetworkLink)]
+    config.logger.info('Deleting %s links and %s vms' % \
+                           (len(links), len(vms))) 
+    teardown_tasks = \
+        task_executor.TaskGraph(config.teardown_concurrency,
+                                'teardown tasks for %s' % \
+                                    geni_slice.getTenantName())
+    vm_tasks, link_tasks = \
+        _addDeleteSliverTasks(teardown_tasks, geni_slice, vms, links)
+    teardown_tasks.add('delete tenant %s' % geni_slice.getTenantName(),
+                       _deleteSliceTenant, (geni_slice,),
+                       depends_on=list(teardown_tasks.getTasks()))
+    teardown_tasks.run()
+    _setSliversDeleted(geni_slice, vms + links, vm_tasks + link_tasks)
+    return 
 
+def _deleteSliceTenant(geni_slice) :
     # Get information about the slice tenant admin
     admin_name, admin_pwd, admin_uuid = geni_slice.getTenantAdminInfo()
 
@@ -534,9 +830,10 @@ def expireSlice(geni_slice) :
             config.logger.error('Failed to delete tenant name = %s, uuid = %s'\
                                     % (geni_slice.getTenantName, 
                                        geni_slice.getTenantUUID()))
-        geni_slice.setTenantUUID(None) # Indicates tenant info is no longer valid
-
-    return 
+        vm_status.status_cache.invalidate(tenant_uuid)
+        with geni_slice.getWriteLock() :
+            # Indicates tenant info is no longer valid
+            geni_slice.setTenantUUID(None)
     
 
 
@@ -547,6 +844,14 @@ def _createTenant(tenant_name) :
     """
         Create an OpenStack tenant and return the uuid of this new tenant.
     """
+    client = _getRESTClient()
+    if client :
+        try :
+            return client.create_tenant(tenant_name)['id']
+        except :
+            config.logger.error('Failed to create tenant %s' % tenant_name)
+            return None
+
     # Create a tenant
     cmd_string = 'keystone tenant-create --name %s' % tenant_name
     try :
@@ -563,8 +868,12 @@ def _deleteTenantByUUID(tenant_uuid) :
         Delete the tenant with the given uuid.
     """
     cmd_string = 'keystone tenant-delete %s' % tenant_uuid
+    client = _getRESTClient()
     try :
-        _execCommand(cmd_string)
+        if client :
+            client.delete_tenant(tenant_uuid)
+        else :
+            _execCommand(cmd_string)
     except :
         return None          # failure
     else :
@@ -578,6 +887,29 @@ def _createTenantAdmin(tenant_name, tenant_uuid) :
     admin_name = 'admin-' + tenant_name
     if len(admin_name) > 63:
         admin_name = str(uuid.uuid4())
+
+    client = _getRESTClient()
+    if client :
+        try :
+            admin_uuid = client.create_user(admin_name,
+                                            config.tenant_admin_pwd,
+                                            tenant_uuid)['id']
+        except :
+            config.logger.error('Exception during keystone user-create')
+            return {}
+        try :
+            admin_role_uuid = None
+            for role in client.list_roles() :
+                if role['name'] == 'admin' :
+                    admin_role_uuid = role['id']
+            client.add_user_role(tenant_uuid, admin_uuid, admin_role_uuid)
+        except :
+            config.logger.error('Failed to give user an admin role')
+            _deleteUserByUUID(admin_uuid)
+            return {}
+        inventory_cache.inventory.invalidate('users')
+        return {'admin_name':admin_name, 'admin_pwd':config.tenant_admin_pwd,
+                'admin_uuid':admin_uuid }
     cmd_string = 'keystone user-create --name %s --pass %s --enabled true --tenant-id %s' % (admin_name, config.tenant_admin_pwd, tenant_uuid)
                                 
     try :
@@ -621,6 +953,8 @@ def _createTenantAdmin(tenant_name, tenant_uuid) :
         _deleteUserByUUID(admin_uuid)      
         return {}
 
+    inventory_cache.inventory.invalidate('users')
+
     # Success!  Return the admin username,  password and uuid.
     return {'admin_name':admin_name, 'admin_pwd':config.tenant_admin_pwd, \
                 'admin_uuid':admin_uuid }
@@ -632,6 +966,29 @@ def _createTenantSecurityGroup(tenant_name, admin_name, admin_pwd) :
     """
     secgroup_name = '%s_secgrp' % tenant_name
 
+    if _getRESTClient() :
+        # The security group belongs to the tenant, so we create it as the
+        # tenant admin.  Rules are the same as those added below.
+        client = _getRESTClient(admin_name, admin_pwd, tenant_name)
+        try :
+            secgroup = client.create_security_group(secgroup_name,
+                                                    'tenant-security-group')
+        except :
+            return None
+        try :
+            for protocol, from_port, to_port in [('tcp', 22, 22),
+                                                 ('icmp', -1, -1),
+                                                 ('tcp', 30000, 65535),
+                                                 ('udp', 30000, 65535)] :
+                client.add_security_group_rule(secgroup['id'], protocol,
+                                               from_port, to_port,
+                                               '0.0.0.0/0')
+        except :
+            _deleteTenantSecurityGroup(admin_name, admin_pwd, tenant_name,
+                                       secgroup_name)
+            return None
+        return secgroup_name
+
     cmd_string = 'nova --os-username=%s --os-password=%s --os-tenant-name=%s' \
         % (admin_name, admin_pwd, tenant_name)
     cmd_string += ' secgroup-create %s tenant-security-group' % secgroup_name
@@ -715,10 +1072,18 @@ def _deleteTenantSecurityGroup(admin_name, admin_pwd, tenant_name,
     # group will eventually get deleted.  There is no harm if the security 
     # group does not get deleted.  We just keep accumulating security groups
     # that are no longer in use.
+    client = None
+    if _getRESTClient() :
+        client = _getRESTClient(admin_name, admin_pwd, tenant_name)
     sec_grp_delete_attempts = 0
     while sec_grp_delete_attempts < 4 :
         try :
-            _execCommand(cmd_string)
+            if client :
+                for secgroup in client.list_security_groups() :
+                    if secgroup['name'] == secgrp_name :
+                        client.delete_security_group(secgroup['id'])
+            else :
+                _execCommand(cmd_string)
             # Delete successful.  Break out of loop
             break
         except :
@@ -737,8 +1102,13 @@ def _deleteUserByUUID(user_uuid) :
         Delete the user account for the user with the specified uuid.
     """
     cmd_string = 'keystone user-delete %s' % user_uuid
+    client = _getRESTClient()
     try :
-        _execCommand(cmd_string)
+        if client :
+            client.delete_user(user_uuid)
+        else :
+            _execCommand(cmd_string)
+        inventory_cache.inventory.invalidate('users')
     except :
         # Not much we can do other than log the failure
         config.logger.error('Failed to delete user account for uuid %s' % \
@@ -749,10 +1119,14 @@ def _createRouter(tenant_name, router_name) :
     """
         Create an OpenStack router and return the uuid of this new router.
     """
-    cmd_string = '%s router-create --tenant-id %s %s' % \
-        (config.network_type, tenant_name, router_name)
+    cmd_string = '%s --tenant-id %s %s' % \
+        (_networkCommand('router-create'), tenant_name, router_name)
 
+    client = _getRESTClient()
     try :
+        inventory_cache.inventory.invalidate('routers')
+        if client :
+            return client.create_router(router_name, tenant_name)['id']
         output = _execCommand(cmd_string) 
     except :
         # Failed to create router.
@@ -763,14 +1137,16 @@ def _createRouter(tenant_name, router_name) :
         return _getValueByPropertyName(output, 'id')
 
 
-def _createNetworkForLink(link_object,used_ips=None) :
+def _createNetworkForLink(link_object,used_ips=None,failed_networks=None) :
     """
         Creates a network (L2) and subnet (L3) for the link.
         Creates an interface on the slice router for this link.
 
         Returns UUIDs for the network and subnet as a dictionary keyed by
         'network_uuid' and 'subnet_uuid'.  One or both UUIDs will
-        be None on failure.
+        be None on failure.  If failed_networks is a list, the network
+        created for a link that failed is added to it for the caller to
+        delete, instead of being deleted here.
     """
     slice_object = link_object.getSlice()
 
@@ -778,16 +1154,24 @@ def _createNetworkForLink(link_object,used_ips=None) :
     # Create a network with the exprimenter specified name for the link
     tenant_uuid = slice_object.getTenantUUID()
     network_name = link_object.getName()
-    cmd_string = '%s net-create %s --tenant-id %s --provider:network_type vlan --provider:physical_network physnet1 --provider:segmentation_id %s' % (config.network_type, network_name, tenant_uuid, link_object.getVLANTag())
+    cmd_string = '%s %s --tenant-id %s --provider:network_type vlan --provider:physical_network physnet1 --provider:segmentation_id %s' % (_networkCommand('net-create'), network_name, tenant_uuid, link_object.getVLANTag())
                                                            
+    client = _getRESTClient()
     try :
-        output = _execCommand(cmd_string) 
+        if client :
+            provider_attributes = \
+                {'provider:network_type' : 'vlan',
+                 'provider:physical_network' : 'physnet1',
+                 'provider:segmentation_id' : link_object.getVLANTag()}
+            network_uuid = client.create_network(network_name, tenant_uuid,
+                                                 **provider_attributes)['id']
+        else :
+            output = _execCommand(cmd_string) 
+            network_uuid = _getValueByPropertyName(output, 'id')
     except :
         # Failed to create a network for this link.  Cleanup actions:
         #    - None
         return None
-    else :
-        network_uuid = _getValueByPropertyName(output, 'id')
 
     # Now create a subnet for this network.
     # First, get a subnet address of the form 10.0.x.0/24
@@ -796,8 +1180,9 @@ def _createNetworkForLink(link_object,used_ips=None) :
     config.logger.info(link_object.getSubnet())
 
     if not link_object.getSubnet():
-        subnet_addr = slice_object.generateSubnetAddress()
-        link_object.setSubnet(subnet_addr)
+        with slice_object.getWriteLock() :
+            subnet_addr = slice_object.generateSubnetAddress()
+            link_object.setSubnet(subnet_addr)
         config.logger.info("No subnet provided, using: " + subnet_addr)
     else:
         subnet_addr = link_object.getSubnet()
@@ -828,17 +1213,25 @@ def _createNetworkForLink(link_object,used_ips=None) :
     end_ip = str(subnet_ip[-3])
 
 
-    cmd_string = '%s subnet-create --tenant-id %s --gateway %s  --allocation-pool start=%s,end=%s  %s %s' % \
-        (config.network_type, tenant_uuid, gateway_addr, start_ip,end_ip,network_uuid, subnet_addr)
+    cmd_string = '%s --tenant-id %s --gateway %s  --allocation-pool start=%s,end=%s  %s %s' % \
+        (_networkCommand('subnet-create'), tenant_uuid, gateway_addr, start_ip,end_ip,network_uuid, subnet_addr)
     try :
-        output = _execCommand(cmd_string) 
+        if client :
+            subnet_uuid = client.create_subnet(network_uuid, tenant_uuid,
+                                               subnet_addr, gateway_addr,
+                                               [{'start' : start_ip,
+                                                 'end' : end_ip}])['id']
+        else :
+            output = _execCommand(cmd_string) 
+            subnet_uuid = _getValueByPropertyName(output, 'id')
     except :
         # Failed to create a subnet.  Cleanup actions:
         #    - Delete the network that was created
-        _deleteNetworkLink(slice_object, network_uuid)
+        if failed_networks != None :
+            failed_networks.append(network_uuid)
+        else :
+            _deleteNetworkLink(slice_object, network_uuid)
         return None
-    else :
-        subnet_uuid = _getValueByPropertyName(output, 'id')
 
     # create and delete a port on the subnet to create dhcp at a desired address
     #cmd_string = 'neutron port-create --tenant-id %s --fixed-ip subnet_id=%s,ip_address=%s %s' % (tenant_uuid, subnet_uuid,str(subnet_ip[-4]), network_uuid)
@@ -854,17 +1247,21 @@ def _createNetworkForLink(link_object,used_ips=None) :
                                                     router_name,
                                                     subnet_uuid)
     try :
-        _execCommand(cmd_string) 
+        if client :
+            client.add_router_interface(slice_object.getTenantRouterUUID(),
+                                        subnet_uuid)
+        else :
+            _execCommand(cmd_string) 
     except :
         # Failed to create interface.  Cleanup actions:
         #    - Delete the network created.  The subnet will be 
         #      deleted automatically
-        _deleteNetworkLink(slice_object, network_uuid)
+        if failed_networks != None :
+            failed_networks.append(network_uuid)
+        else :
+            _deleteNetworkLink(slice_object, network_uuid)
         return None
         
-    # Set operational status
-    link_object.setOperationalState(constants.ready)
-
     return {'network_uuid':network_uuid, 'subnet_uuid': subnet_uuid}
 
 
@@ -880,17 +1277,25 @@ def _deleteNetworkLink(slice_object, net_uuid) :
             if link.getNetworkUUID() == net_uuid:
                 subnet_uuid = link.getSubnetUUID()
         router_name = slice_object.getTenantRouterName()
+        router_uuid = slice_object.getTenantRouterUUID()
+        client = _getRESTClient()
         cmd_string = '%s router-interface-delete %s %s' % (config.network_type, router_name, subnet_uuid)
         try:
-            _execCommand(cmd_string)
+            if client :
+                client.remove_router_interface(router_uuid, subnet_uuid)
+            else :
+                _execCommand(cmd_string)
         except:
             config.logger.error("Failed to delete router interface %s %s" % (router_name, subnet_uuid))
 
         # Delete the router before deleting the net/subnet
-        router_uuid = slice_object.getTenantRouterUUID()
         cmd_string = '%s router-delete %s' % (config.network_type, router_uuid)
+        inventory_cache.inventory.invalidate('routers')
         try:
-            _execCommand(cmd_string)
+            if client :
+                client.delete_router(router_uuid)
+            else :
+                _execCommand(cmd_string)
         except:
             config.logger.error("Failed to delete router %s" % router_uuid)
         
@@ -898,7 +1303,10 @@ def _deleteNetworkLink(slice_object, net_uuid) :
 
         cmd_string = '%s net-delete %s' % (config.network_type, net_uuid)
         try :
-            _execCommand(cmd_string)
+            if client :
+                client.delete_network(net_uuid)
+            else :
+                _execCommand(cmd_string)
         except :
             # Failed to delete network.  Not much we can do.
             config.logger.error('Failed to delete network with uuid %s' % \
@@ -908,7 +1316,22 @@ def _deleteNetworkLink(slice_object, net_uuid) :
 
 
 def _getNetsForTenant(tenant_uuid):
-    cmd_string = '%s net-list -- --tenant_id=%s' % (config.network_type, tenant_uuid)
+    client = _getRESTClient()
+    if client :
+        try :
+            networks = client.list_networks(tenant_id=tenant_uuid)
+        except :
+            config.logger.error('Failed to get list of networks for tenant %s' % \
+                                    tenant_uuid)
+            return None
+        nets_info = dict()
+        for net in networks :
+            nets_info[net['id']] = \
+                {'name' : net['name'],
+                 'vlan' : str(net.get('provider:segmentation_id'))}
+        return nets_info
+
+    cmd_string = '%s -- --tenant_id=%s' % (_networkCommand('net-list'), tenant_uuid)
     try :
         output = _execCommand(cmd_string)
     except :
@@ -917,47 +1340,58 @@ def _getNetsForTenant(tenant_uuid):
                                 tenant_uuid)
         return None
 
-    output_lines = output.split('\n')
+    # The VLAN of each network is only in the net-show output.  Run the
+    # net-show's in parallel.
+    net_show_tasks = \
+        task_executor.TaskGraph(config.provision_concurrency,
+                                'net-show commands for tenant %s' % tenant_uuid)
+    nets = open_stack_output.parse_list(output).getRows()
+    for net in nets :
+        cmd_string = '%s %s' % (_networkCommand('net-show'), net['id'])
+        net_show_tasks.add(cmd_string, _execCommand, (cmd_string,))
+    if not net_show_tasks.run() :
+        for task in net_show_tasks.getFailedTasks() :
+            config.logger.error('Failed to get info on network: %s' % \
+                                    task.name)
+        return None
+
     nets_info = dict()
-    for i in range(3, len(output_lines)-2):
-        line = output_lines[i]
-        line_parts = line.split('|')
-        net_id = line_parts[1].strip()
-        name = line_parts[2].strip()
-        subnets = line_parts[3].strip()
-
-        cmd_string = '%s net-show %s' % (config.network_type, net_id)
-        try :
-            net_output = _execCommand(cmd_string)
-        except :
-            config.logger.error('Failed to get info on network %s' %  net_id)
-            return None
-            
-        net_output_lines = net_output.split('\n')
-        belongs = True
-        attributes = {'name' : name}
-        for j in range(3, len(net_output_lines)-2):
-            net_line = net_output_lines[j]
-            net_line_parts = net_line.split('|')
-            field = net_line_parts[1].strip()
-            value = net_line_parts[2].strip()
-            if field == 'name' and value != name:
-                belongs = False
-            elif field == 'tenant_id' and value != tenant_uuid:
-                belongs = False
-            elif field == 'provider:segmentation_id':
-                attributes['vlan'] = value
-        if belongs:
-            nets_info[net_id] = attributes
+    for net, task in zip(nets, net_show_tasks.getTasks()) :
+        net_id = net['id']
+        name = net['name']
+        net_properties = open_stack_output.parse_properties(task.result)
+        if net_properties.get('name') == name and \
+                net_properties.get('tenant_id') == tenant_uuid :
+            nets_info[net_id] = \
+                {'name' : name,
+                 'vlan' : str(net_properties.get('provider:segmentation_id'))}
     return nets_info
 
 # Return dictionary of 'id' => {'mac_address'=>mac_address, , 'fixed_ips'=>fixed_ips}
 #  for each port associated ith a given tenant
 def _getPortsForTenant(tenant_uuid,device_id=None):
+    client = _getRESTClient()
+    if client :
+        filters = {'tenant_id' : tenant_uuid}
+        if device_id != None :
+            filters['device_id'] = device_id
+        try :
+            ports = client.list_ports(**filters)
+        except :
+            config.logger.error('Failed to get port list for tenant %s' % \
+                                    tenant_uuid)
+            return None
+        ports_info = dict()
+        for port in ports :
+            ports_info[port['id']] = \
+                {'mac_address' : port['mac_address'],
+                 'fixed_ips' : _firstFixedIP(port['fixed_ips'])}
+        return ports_info
+
     if device_id != None:
-        cmd_string = '%s port-list -- --tenant_id=%s --device_id=%s' % (config.network_type, tenant_uuid,device_id)
+        cmd_string = '%s -- --tenant_id=%s --device_id=%s' % (_networkCommand('port-list'), tenant_uuid,device_id)
     else:
-        cmd_string = '%s port-list -- --tenant_id=%s' % (config.network_type, tenant_uuid)
+        cmd_string = '%s -- --tenant_id=%s' % (_networkCommand('port-list'), tenant_uuid)
     try :
         output = _execCommand(cmd_string)
     except :
@@ -965,23 +1399,34 @@ def _getPortsForTenant(tenant_uuid,device_id=None):
                                 tenant_uuid)
         return None
 
-    output_lines = output.split('\n')
     ports_info = dict()
-    for i in range(3, len(output_lines)-2):
-        port_info_columns = output_lines[i].split('|');
-        port_id = port_info_columns[1].strip()
-        port_mac_address = port_info_columns[3].strip()
-        port_fixed_ips = port_info_columns[4].strip()
-        port_info = {'mac_address' : port_mac_address, 'fixed_ips' : port_fixed_ips}
-        ports_info[port_id] = port_info
+    for port in open_stack_output.parse_list(output).getRows() :
+        ports_info[port['id']] = \
+            {'mac_address' : port['mac_address'],
+             'fixed_ips' : _firstFixedIP(port['fixed_ips'])}
 
     return ports_info
 
+
+def _firstFixedIP(fixed_ips) :
+    """
+        Return the first of the fixed IPs of a port as a dictionary
+        {'subnet_id', 'ip_address'}, or None if the port has none.
+    """
+    fixed_ips = open_stack_output.parse_fixed_ips(fixed_ips)
+    if len(fixed_ips) == 0 :
+        return None
+    return fixed_ips[0]
+
 # users is a list of dictionaries [keys=>list_of_ssh_keys, urn=>user_urn]
-def _createVM(vm_object, users, placement_hint):
+def _createVM(vm_object, users, placement_hint, timings=None):
     """
         Create a OpenStack VM 
+        If timings is a dictionary, the time taken by the boot request 
+        ('boot', including retries) and by waiting for the VM to leave the 
+        BUILD state ('poll') are stored in it
     """
+    if timings == None : timings = {}
     slice_object = vm_object.getSlice()
     admin_name, admin_pwd, admin_uuid  = slice_object.getTenantAdminInfo()
     tenant_uuid = slice_object.getTenantUUID()
@@ -994,39 +1439,16 @@ def _createVM(vm_object, users, placement_hint):
     mgmt_net_prefix = \
         config.management_network_cidr[0:config.management_network_cidr.rfind('0/24')]
 
-    # Create ports for the experiment data networks
+    client = _getRESTClient()
+
+    # The ports for the experiment data networks were created by
+    # provisionResources (_createPortForNIC)
     vm_net_infs = vm_object.getNetworkInterfaces()
-    for nic in vm_net_infs :
-        if nic.isEnabled() :
-            link_object = nic.getLink()
-            if link_object == None: continue
-            net_uuid = link_object.getNetworkUUID()
-            nic_ip_addr = nic.getIPAddress()
-            subnet_uuid = link_object.getSubnetUUID()
-            if nic.getIPAddress():
-                cmd_string = '%s port-create --tenant-id %s --fixed-ip subnet_id=%s,ip_address=%s %s' % (config.network_type, tenant_uuid, subnet_uuid,nic.getIPAddress(), net_uuid)
-            else:
-                cmd_string = '%s port-create --tenant-id %s --fixed-ip subnet_id=%s %s' % (config.network_type, tenant_uuid, subnet_uuid, net_uuid)
-            output = _execCommand(cmd_string) 
-            nic.setUUID(_getValueByPropertyName(output, 'id'))
-
-    # Now grab and set the mac addresses from the port list
-    ports_info = _getPortsForTenant(tenant_uuid)
-    if ports_info == None :
-        config.logger.error('Failed to get MAC addresses for network interfaces for tenant %s' % tenant_uuid)
-        # Not doing any rollback.  Do we really want to fail the entire 
-        # provision if we can't get mac addresses?
-    else :
-        for nic in vm_net_infs :
-            nic_uuid = nic._uuid
-            if ports_info.has_key(nic_uuid):
-                mac_address = ports_info[nic_uuid]['mac_address']
-                nic.setMACAddress(mac_address)
 
     # Create the VM.  Form the command string in stages.
     cmd_string = 'nova --os-username=%s --os-password=%s --os-tenant-name=%s' \
         % (admin_name, admin_pwd, slice_object.getTenantName())
-    cmd_string += (' boot %s --config-drive=true --poll --image %s --flavor %s' % \
+    cmd_string += (' boot %s --config-drive=true --image %s --flavor %s' % \
                        (vm_name, os_image_id, vm_flavor_id))
 
     component_name = vm_object.getComponentName()
@@ -1075,36 +1497,115 @@ def _createVM(vm_object, users, placement_hint):
         for i in range (0, len(placement_hint)) :
             cmd_string += (' --hint different_host=%s' % placement_hint[i])
 
-    # Issue the command to create the VM
+    # Issue the command to create the VM.  Retry if nova rate limits us.
     try :
-        output = _execCommand(cmd_string) 
+        boot_start = time.time()
+        if client :
+            user_data = None
+            if metadata_cmd_count > 0 :
+                user_data = _readUserData(zipped_userdata_filename)
+            networks = [{'uuid' : \
+                             resources.GramManagementNetwork.get_mgmt_net_uuid()}]
+            for nic in vm_net_infs :
+                if nic.isEnabled() and nic.getUUID() != None :
+                    networks.append({'port' : nic.getUUID()})
+            availability_zone = None
+            if component_name :
+                availability_zone = 'nova:' + component_name
+            scheduler_hints = None
+            if placement_hint != None :
+                scheduler_hints = {'different_host' : list(placement_hint)}
+            tenant_client = _getRESTClient(admin_name, admin_pwd,
+                                           slice_object.getTenantName())
+            server = vm_creation_pool.call_with_backoff( \
+                'boot VM %s' % vm_name, tenant_client.create_server,
+                (vm_name, os_image_id, vm_flavor_id, networks,
+                 [slice_object.getSecurityGroup()], user_data,
+                 availability_zone, True, scheduler_hints),
+                _isRateLimitError)
+            vm_uuid = server['id']
+        else :
+            output = vm_creation_pool.call_with_backoff( \
+                'boot VM %s' % vm_name, _execCommand, (cmd_string,),
+                _isRateLimitError)
+            # Get the UUID of the VM that was created 
+            vm_uuid = _getValueByPropertyName(output, 'id')
+        timings['boot'] = time.time() - boot_start
     except :
         config.logger.error('Failed to create VM %s' % vm_name)
         return None
 
-    # Get the UUID of the VM that was created 
-    vm_uuid = _getValueByPropertyName(output, 'id')
-
     # Delete the temp file
     os.unlink(zipped_userdata_filename)
 
     # Set the operational state of the VM to configuring
-    vm_object.setOperationalState(constants.configuring)
+    with slice_object.getWriteLock() :
+        vm_object.setOperationalState(constants.configuring)
+
+    if config.async_provisioning :
+        # Don't wait for the VM to boot.  _createAllVMs has the VM watcher
+        # finish setting it up once it is ACTIVE.
+        with slice_object.getWriteLock() :
+            vm_object.setUUID(vm_uuid)
+        return
+
+    # Wait for the VM to leave the BUILD state (what 'nova boot --poll'
+    # does)
+    try :
+        poll_start = time.time()
+        _waitForVM(vm_uuid)
+        timings['poll'] = time.time() - poll_start
+    except :
+        config.logger.error('Failed to create VM %s' % vm_name)
+        return None
+
+    if _finishVMCreation(vm_object, vm_uuid) :
+        with slice_object.getWriteLock() :
+            vm_object.setUUID(vm_uuid)
+
+
+def _finishVMCreation(vm_object, vm_uuid) :
+    """
+        Set up a VM once it has booted: create its floating IP (if the 
+        experimenter asked for an external IP), find its management 
+        network address and compute host and set up its SSH proxy.  The
+        VM is updated holding its slice's state lock once this is done.
+
+        Returns True on success, False otherwise.
+    """
+    slice_object = vm_object.getSlice()
+    tenant_uuid = slice_object.getTenantUUID()
+    vm_name = vm_object.getName()
+    mgmt_net_prefix = \
+        config.management_network_cidr[0:config.management_network_cidr.rfind('0/24')]
+    client = _getRESTClient()
+
+    # Nova has plugged the VM's ports into OVS on its compute node
+    inventory_cache.inventory.invalidate('ovs_vlans')
 
     # Create the floating IPs for the VM
+    external_ip = None
     if vm_object.getExternalIp() == 'true':
       ports_info = _getPortsForTenant(tenant_uuid,vm_uuid)
       if ports_info != None :
         for port in ports_info.keys():
-            mgmt_ip = eval(ports_info[port]['fixed_ips'])['ip_address']
+            fixed_ip = ports_info[port]['fixed_ips']
+            if fixed_ip == None : continue
+            mgmt_ip = fixed_ip['ip_address']
             found = string.find(mgmt_ip,mgmt_net_prefix)
-            if found != -1:
-                fip_cmd = "%s floatingip-create --tenant-id %s public" %\
-                    (config.network_type, tenant_uuid)
+            if found != -1 and client :
+                public_net_uuid = client.list_networks(name='public')[0]['id']
+                floatingip = client.create_floatingip(public_net_uuid,
+                                                      tenant_uuid)
+                external_ip = floatingip['floating_ip_address']
+                client.associate_floatingip(floatingip['id'], port)
+            elif found != -1:
+                fip_cmd = "%s --tenant-id %s public" %\
+                    (_networkCommand('floatingip-create'), tenant_uuid)
                 output = _execCommand(fip_cmd)
                 fip_id = _getValueByPropertyName(output,'id')
-                fip = _getValueByPropertyName(output,'floating_ip_address')
-                vm_object.setExternalIp(fip)
+                external_ip = \
+                    _getValueByPropertyName(output,'floating_ip_address')
                 fip_cmd = "%s floatingip-associate %s %s" %\
                     (config.network_type, fip_id, port)
                 output = _execCommand(fip_cmd)
@@ -1116,22 +1617,98 @@ def _createVM(vm_object, users, placement_hint):
     # look for the property with the name of the management network
     cmd_string = 'nova show %s' % vm_uuid
     try :
-        output = _execCommand(cmd_string)
+        if client :
+            server = client.show_server(vm_uuid)
+        else :
+            output = _execCommand(cmd_string)
     except :
         config.logger.error('Failed to get properties for vm %s' % vm_uuid)
-        return None
-    property_name = config.management_network_name + ' network'
-    mgmt_nic_ipaddr = _getValueByPropertyName(output, property_name)
-    compute_host = _getValueByPropertyName(output, 'OS-EXT-SRV-ATTR:host')
+        if external_ip != None :
+            with slice_object.getWriteLock() :
+                vm_object.setExternalIp(external_ip)
+        return False
+    if client :
+        mgmt_nic_ipaddr = None
+        mgmt_addresses = \
+            server.get('addresses', {}).get(config.management_network_name)
+        if mgmt_addresses :
+            mgmt_nic_ipaddr = mgmt_addresses[0]['addr']
+        compute_host = server.get('OS-EXT-SRV-ATTR:host')
+    else :
+        property_name = config.management_network_name + ' network'
+        mgmt_nic_ipaddr = _getValueByPropertyName(output, property_name)
+        compute_host = _getValueByPropertyName(output, 'OS-EXT-SRV-ATTR:host')
+    portNumber = None
     if mgmt_nic_ipaddr != None :
         portNumber = manage_ssh_proxy._addNewProxy(mgmt_nic_ipaddr)
-        vm_object.setSSHProxyLoginPort(portNumber)
-        vm_object.setHost(compute_host)
-        vm_object.setMgmtNetAddr(mgmt_nic_ipaddr)
         config.logger.info('SSH Proxy assigned port number %d to host %s' % \
                                (portNumber, vm_name))
+    with slice_object.getWriteLock() :
+        if external_ip != None :
+            vm_object.setExternalIp(external_ip)
+        if portNumber != None :
+            vm_object.setSSHProxyLoginPort(portNumber)
+            vm_object.setHost(compute_host)
+            vm_object.setMgmtNetAddr(mgmt_nic_ipaddr)
+    return True
+
+
+def _listServerStates() :
+    """
+        Returns {VM UUID => nova status (BUILD, ACTIVE, ERROR...)} for all
+        VMs of all tenants, using a single list call.
+    """
+    client = _getRESTClient()
+    if client :
+        return dict([(server['id'], server['status']) \
+                         for server in client.list_servers(all_tenants=True)])
+    output = _execCommand('nova list --all-tenants')
+    return dict([(row['ID'], row['Status']) for row in \
+                     open_stack_output.parse_list(output).getRows()])
+
+
+def _waitForVM(vm_uuid) :
+    """
+        Poll the status of the VM until it is no longer building.
+    """
+    client = _getRESTClient()
+    if client :
+        client.wait_for_server(vm_uuid, config.vm_boot_poll_interval)
+        return
+    cmd_string = 'nova show %s' % vm_uuid
+    while True :
+        output = _execCommand(cmd_string)
+        if _getValueByPropertyName(output, 'status') != 'BUILD' :
+            return
+        time.sleep(config.vm_boot_poll_interval)
+
+
+def _isRateLimitError(e) :
+    """
+        Did the OpenStack call that raised exception e fail because it
+        was rate limited (HTTP 413 overLimit or 429)?
+    """
+    if isinstance(e, open_stack_rest.OpenStackRESTError) :
+        return e.status in [413, 429]
+    if isinstance(e, OpenStackCommandError) :
+        return _RATE_LIMIT_MESSAGE.search(e.error_output) != None
+    return False
+
+_RATE_LIMIT_MESSAGE = \
+    re.compile(r'HTTP 413|HTTP 429|rate limit|OverLimit', re.IGNORECASE)
+
+
+def _readUserData(userdata_filename) :
+    """
+        Return the contents of the user data file, base64 encoded as the
+        nova API requires.
+    """
+    userdata_file = open(userdata_filename, 'r')
+    try :
+        return base64.b64encode(userdata_file.read())
+    finally :
+        userdata_file.close()
 
-    vm_object.setUUID(vm_uuid)
 
 def _createImage(slivers,options):
     found  = False
@@ -1148,8 +1725,15 @@ def _createImage(slivers,options):
                 uuid = sliver_object.getUUID()
                 nova_cmd = 'nova image-create %s %s' % (uuid,options['snapshot_name'])
                 config.logger.info("Performing %s " % nova_cmd)
+                client = _getRESTClient()
+                inventory_cache.inventory.invalidate('images')
                 try :
-                        _execCommand(nova_cmd)
+                        if client :
+                            client.server_action(uuid, 'createImage',
+                                                 {'name' : \
+                                                      options['snapshot_name']})
+                        else :
+                            _execCommand(nova_cmd)
                         ret_code = constants.SUCCESS
                         ret_str = ""
                 except:
@@ -1174,8 +1758,13 @@ def _deleteImage(options):
         return constants.REQUEST_PARSE_FAILED,"Image not specified"
     nova_cmd = 'nova %s %s' % (cmd, uuid)
     config.logger.info("Performing %s " % nova_cmd)
+    client = _getRESTClient()
+    inventory_cache.inventory.invalidate('images')
     try :
-        _execCommand(nova_cmd)
+        if client :
+            client.delete_image(uuid)
+        else :
+            _execCommand(nova_cmd)
     except:
         config.logger.error('Failed to perform operational action %s: %s' %
                             (action, nova_cmd))
@@ -1201,23 +1790,35 @@ def _performOperationalAction(vm_object, action, options):
 
     nova_cmd = 'nova %s %s' % (cmd, uuid)
     config.logger.info("Performing %s " % nova_cmd)
+    vm_status.status_cache.invalidate(vm_object.getSlice().getTenantUUID())
  
+    client = _getRESTClient()
     try :
-        _execCommand(nova_cmd)
+        if client :
+            if cmd == 'reboot' :
+                client.server_action(uuid, cmd, {'type' : 'SOFT'})
+            else :
+                client.server_action(uuid, cmd)
+        else :
+            _execCommand(nova_cmd)
     except:
         config.logger.error('Failed to perform operational action %s %s: %s' %
                             (action, vm_object.getUUID(), nova_cmd))
         ret_val = False
     return ret_val
 
-def _deleteVM(vm_object) :
+def _deleteVM(vm_object, fip_ids=None) :
     """
         Delete the OpenStack VM that corresponds to this vm_object.
-        Delete the network ports associated with the VM
+        Delete the network ports and floating IPs associated with the VM.
+        fip_ids is the list of IDs of the VM's floating IPs; if None, they
+        are looked up.
 
         Returns True of VM was successfully deleted.  False otherwise.
     """
     return_val = True
+    client = _getRESTClient()
+    inventory_cache.inventory.invalidate('ovs_vlans')
 
     # Delete ports associatd with the VM
     for nic in vm_object.getNetworkInterfaces() :
@@ -1225,18 +1826,25 @@ def _deleteVM(vm_object) :
         if port_uuid:
             cmd_string = '%s port-delete %s' % (config.network_type, port_uuid)
             try :
-                _execCommand(cmd_string)
+                if client :
+                    client.delete_port(port_uuid)
+                else :
+                    _execCommand(cmd_string)
             except :
                 config.logger.error('Failed to delete port %s for VM %s' % \
                                         (port_uuid, vm_object.getName()))
 
     # Delete floating IPs
     vm_uuid = vm_object.getUUID()
-    fip_ids = _getFloatingIpByVM(vm_uuid)
+    if fip_ids == None :
+        fip_ids = _getFloatingIpByVM(vm_uuid)
     for fip_id in fip_ids:
         cmd_string = '%s floatingip-delete %s' % (config.network_type, fip_id)
         try :
-            _execCommand(cmd_string)
+            if client :
+                client.delete_floatingip(fip_id)
+            else :
+                _execCommand(cmd_string)
         except :
             config.logger.error('Failed to delete floating ip %s for VN %s' % \
                                         (fip_id,vm_object.getName()))
@@ -1247,7 +1855,10 @@ def _deleteVM(vm_object) :
     if vm_uuid != None :
         cmd_string = 'nova delete %s' % vm_uuid
         try :
-            _execCommand(cmd_string)
+            if client :
+                client.delete_server(vm_uuid)
+            else :
+                _execCommand(cmd_string)
         except :
             config.logger.error('Failed to delete VM %s with uuid %s' % \
                                     (vm_object.getName(), vm_uuid))
@@ -1267,21 +1878,54 @@ def _getRouterUUID(router_name) :
         We may not need this function when we have per tenant routers
         working.
     """
-    cmd_string = '%s router-list' % config.network_type
-    output = _execCommand(cmd_string) 
-
-    return _getUUIDByName(output, router_name)
+    return _lookupUUIDByName('routers', router_name)
 
 
 def _getUserUUID(user_name) :
     """
         Return the UUID of the specified OpenStrack user.
     """
-    cmd_string = 'keystone user-list'
-    output = _execCommand(cmd_string) 
+    return _lookupUUIDByName('users', user_name)
+
+
+def _lookupUUIDByName(resource, name) :
+    """
+        Return the UUID of the object with the given name from the cached
+        listing of objects of that kind ('routers' or 'users').  An object
+        not in the cached listing may have been created since it was
+        fetched, so on a miss we fetch the listing again.
+    """
+    uuids_by_name = inventory_cache.inventory.get(resource)
+    if name not in uuids_by_name :
+        inventory_cache.inventory.invalidate(resource)
+        uuids_by_name = inventory_cache.inventory.get(resource)
+    return uuids_by_name.get(name)
+
+
+def _fetchRouters() :
+    """
+        Fetch {router name => router UUID} for the routers in OpenStack
+    """
+    client = _getRESTClient()
+    if client :
+        return dict([(router['name'], router['id']) \
+                         for router in client.list_routers()])
+    output = _execCommand(_networkCommand('router-list'))
+    return dict([(router['name'], router['id']) for router in \
+                     open_stack_output.parse_list(output).getRows()])
 
-    # Extract and return the uuid of the admin user 
-    return _getUUIDByName(output, user_name)
+
+def _fetchUsers() :
+    """
+        Fetch {user name => user UUID} for the keystone users
+    """
+    client = _getRESTClient()
+    if client :
+        return dict([(user['name'], user['id']) \
+                         for user in client.list_users()])
+    output = _execCommand('keystone user-list')
+    return dict([(user['name'], user['id']) for user in \
+                     open_stack_output.parse_list(output).getRows()])
 
 
 def  _getImageUUID(image_name) :
@@ -1292,6 +1936,7 @@ def  _getImageUUID(image_name) :
     output = resources.GramImageInfo.get_image_list()
     if not _getUUIDByName(output, image_name):
         resources.GramImageInfo.refresh()
+        output = resources.GramImageInfo.get_image_list()
 
 #    print output
     #cmd_string = 'nova image-list'
@@ -1322,30 +1967,15 @@ def _getUUIDByName(output_table, name) :
     """
         Helper function used to extract the uuid of an OpenStack object
         from the output of commands such as router-list, user-list, etc. 
-        The output of these commands is in the form of a table.  The first
-        column of the table has uuids of the objects listed and the other 
-        columns have information on the objects such as name
+        output_table is either the output of such a command (a table or
+        JSON list) or an already parsed open_stack_output.OutputTable.
 
-        This function finds the table row with the specified OpenStack 
-        object (name) and returns column 1 of this table row.
+        Returns the id of the object whose name is exactly name, or None
+        if there is no such object.
     """
-    # Split the output table into lines (rows of the table)
-    output_lines = output_table.split('\n')
-
-    # Escape any non-alpanumerics in name
-    name = re.escape(name)
-
-    # Find the row in the output table that has an entry for object name
-    # Column 1 of this row will have the uuid for this object
-    for i in range(len(output_lines)) :
-        if re.search(r'\b' + name + r'\b', output_lines[i]) :
-            # Found the table row for router_name.  Split this row into 
-            # individual columns and pick out column 1
-            
-            columns = output_lines[i].split('|')
-            return columns[1].strip()
-
-    return None   # Failed to find the uuid
+    if not isinstance(output_table, open_stack_output.OutputTable) :
+        output_table = open_stack_output.parse_list(output_table)
+    return output_table.getIdByName(name)
 
 
 def _getValueByPropertyName(output_table, property_name) :
@@ -1364,29 +1994,31 @@ def _getValueByPropertyName(output_table, property_name) :
         and returns the value of id (uuid).
 
         Returns None if a table row cannot be found for the specified 
-        property_name.
+        property_name.  Also accepts the JSON output of the
+        quantum/neutron clients.
     """
-    # Split the output into lines (rows of the table)
-    output_lines = output_table.split('\n')
-
-    # Escape any non-alpanumerics in property_name
-    property_name = re.escape(property_name)
-
-    # Look for the row with property_name
-    for i in range(len(output_lines)) :
-        if re.search(r'\b' + property_name + r'\b', output_lines[i]) :
-            # Found the table row with the id.  Split this row into individual
-            # columns and pick out column 2
-            columns = output_lines[i].split('|')
-            return columns[2].strip()
-
-    return None   # Failed to find the uuid
+    value = open_stack_output.parse_properties(output_table).get(property_name)
+    if value is not None :
+        value = str(value)
+    return value
 
 
 def _getComputeNodeCount() :
     """
         Returns the number of compute nodes on the rack.
     """
+    return len(inventory_cache.inventory.get('hypervisors'))
+
+
+def _fetchHypervisors() :
+    """
+        Fetch the list of hypervisor host names
+    """
+    client = _getRESTClient()
+    if client :
+        return [hypervisor['hypervisor_hostname'] \
+                    for hypervisor in client.list_hypervisors()]
+
     cmd_string = 'nova hypervisor-list'
     output = _execCommand(cmd_string)
 
@@ -1399,40 +2031,37 @@ def _getComputeNodeCount() :
     #    | .. | ...                 |
     #    | N  | computeN            |
     #    +----+---------------------+
-    # The number of compute nodes is therefore the number of lines in
-    # the output - 5 (there is an extra newline)
-    output_lines = output.split('\n')
-    return len(output_lines) - 5
+    return open_stack_output.parse_list(output).getColumn('Hypervisor hostname')
 
 # Get dictionary of hostnames : hostname => list of services
 def _listHosts(onlyForService=None):
     hosts = {}
-    command_string = 'nova host-list'
-    output = _execCommand(command_string)
-    output_lines = output.split('\n')
-    for i in range(3, len(output_lines)-2):
-        line = output_lines[i]
-        parts = line.split('|')
-        host_name = parts[1].strip()
-        service = parts[2].strip()
+    for host_name, service in inventory_cache.inventory.get('hosts'):
         if onlyForService and onlyForService != service: continue
         if not hosts.has_key(host_name): hosts[host_name] = []
         hosts[host_name].append(service)
     return hosts
 
+# Fetch list of (hostname, service) from nova
+def _fetchHosts():
+    client = _getRESTClient()
+    if client :
+        return [(host['host_name'], host['service']) \
+                    for host in client.list_hosts()]
+
+    command_string = 'nova host-list'
+    output = _execCommand(command_string)
+    return [(row['host_name'], row['service']) \
+                for row in open_stack_output.parse_list(output).getRows()]
+
 # Get dictionary of all supported flavors (id => description)
 def _listFlavors():
     flavors = {}
     #command_string = "nova flavor-list"
     #output = _execCommand(command_string)
     output = resources.GramImageInfo.get_flavor_list()
-    output_lines = output.split('\n')
-    for i in range(3, len(output_lines)-2):
-        line = output_lines[i]
-        parts = line.split('|')
-        id = int(parts[1].strip())
-        name = parts[2].strip()
-        flavors[id]=name
+    for row in output.getRows():
+        flavors[int(row['ID'])] = row['Name']
     return flavors
 
 # Get dictionary of all supported images (id => name)
@@ -1441,14 +2070,8 @@ def _listImages():
     command_string = "nova image-list"
     #output = _execCommand(command_string)
     output = resources.GramImageInfo.get_image_list()
-    #print output2
-    output_lines = output.split('\n')
-    for i in range(3, len(output_lines)-2):
-        line = output_lines[i]
-        parts = line.split('|')
-        image_id = parts[1].strip()
-        image_name = parts[2].strip()
-        images[image_id] = image_name
+    for row in output.getRows():
+        images[row['ID']] = row['Name']
 
     return images
 
@@ -1457,35 +2080,77 @@ def _listImages():
 # Return dictionary {mac => {'vlan':vlan, 'host':host}}
 def _lookup_vlans_for_tenant(tenant_id):
     map = {}
-    hosts = _listHosts('compute')
+    vlans_by_port_prefix = inventory_cache.inventory.get('ovs_vlans')
     ports = _getPortsForTenant(tenant_id)
-    for host in hosts.keys():
-        port_data = compute_node_interface.compute_node_command(host, ComputeNodeInterfaceHandler.COMMAND_OVS_VSCTL)
-        port_map = _read_vlan_port_map(port_data)
-        for port in ports.keys():
-            mac = ports[port]['mac_address']
-            vlan_id = _lookup_vlan_for_port(port, port_map)
-            if vlan_id: 
-                map[mac] = {'vlan': vlan_id, 'host':host}
+    for port in ports.keys():
+        mac = ports[port]['mac_address']
+        vlan_info = vlans_by_port_prefix.get(port[:11])
+        if vlan_info: 
+            map[mac] = vlan_info
     return map
 
 
-# Find the VLAN tag associated with given port interface
+# The port maps (see _read_vlan_port_map) last read from each compute host
+_ovs_port_maps = {}
+
+# Fetch {port prefix => {'vlan' : VLAN tag, 'host' : compute host}} for the
+# OVS ports on all compute hosts.  The 'ovs-vsctl show' commands are run on
+# the compute hosts in parallel.
 # The ovs-vsctl show command returns interfaces with a qvo prefix
 # and has all ports turncated to their first 12 characters, so
-# we match accordingly
-def _lookup_vlan_for_port(port, port_map):
-    vlan_id = None
-    port_prefix = port[:11]
-    for port in port_map:
-        if port.has_key('interface') and port.has_key('tag'):
-            tag = port['tag']
-            interface = port['interface']
-            interface_suffix = interface[3:]
-            if (port_prefix == interface_suffix):
-                vlan_id = tag
-                break
-    return vlan_id
+# the port prefix is the first 11 characters of the neutron port UUID
+def _fetchOVSVLANs():
+    hosts = _listHosts('compute').keys()
+    ovs_tasks = \
+        task_executor.TaskGraph(config.compute_node_interface_concurrency,
+                                'ovs-vsctl show commands')
+    for host in hosts:
+        ovs_tasks.add('ovs-vsctl show on %s' % host,
+                      compute_node_interface.compute_node_command,
+                      (host, ComputeNodeInterfaceHandler.COMMAND_OVS_VSCTL))
+    ovs_tasks.run()
+
+    vlans_by_port_prefix = {}
+    for host, task in zip(hosts, ovs_tasks.getTasks()):
+        if task.result != None:
+            _ovs_port_maps[host] = _read_vlan_port_map(task.result)
+        elif _ovs_port_maps.has_key(host):
+            config.logger.error('Using old OVS port map for host %s' % host)
+        else:
+            continue
+        for port in _ovs_port_maps[host]:
+            if port.has_key('interface') and port.has_key('tag'):
+                interface_suffix = port['interface'][3:]
+                vlans_by_port_prefix[interface_suffix] = \
+                    {'vlan' : port['tag'], 'host' : host}
+    return vlans_by_port_prefix
+
+
+# Parse the output of 'ovs-vsctl show' into a list of dictionaries
+# with the 'port', 'interface' and (if the port is tagged) 'tag' of
+# each port:
+#    Bridge br-int
+#        Port "qvo2e4c8a1b-3f"
+#            tag: 3
+#            Interface "qvo2e4c8a1b-3f"
+def _read_vlan_port_map(port_data):
+    port_map = []
+    port = None
+    for line in port_data.split('\n'):
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+        value = parts[1].strip('"')
+        if parts[0] == 'Bridge':
+            port = None
+        elif parts[0] == 'Port':
+            port = {'port' : value}
+            port_map.append(port)
+        elif port is not None and parts[0] == 'tag:':
+            port['tag'] = value
+        elif port is not None and parts[0] == 'Interface':
+            port['interface'] = value
+    return port_map
 
 def _getFloatingIpByVM(vm_uuid):
     """ Helper function to get the floating ip assigned to a specified VM
@@ -1495,31 +2160,67 @@ def _getFloatingIpByVM(vm_uuid):
     """
 
     fip_ids = []
+    client = _getRESTClient()
+    if client :
+        for port in client.list_ports(device_id=vm_uuid) :
+            for fip in client.list_floatingips(port_id=port['id']) :
+                config.logger.info("getting floating ip: " + fip['id'])
+                fip_ids.append(fip['id'])
+        return fip_ids
+
     # Get a list of ports on the VM
-    cmd = '%s port-list --device_id=%s' % (config.network_type, vm_uuid)
+    cmd = '%s --device_id=%s' % (_networkCommand('port-list'), vm_uuid)
     output = _execCommand(cmd)
-    output_lines = output.split('\n')
-    name = 'subnet'
-    for line in output_lines:
-        if re.search(name, line) :
-            columns = line.split('|')
-            port_id = columns[1].strip()
-            # for each port get a list of associated floating IPs
-            output2 = _execCommand("%s floatingip-list -- --port_id=%s" % (config.network_type, port_id))
-            port = re.escape(port_id)
-            output_lines2 = output2.split('\n')
-            # Find the row in the output table that has the desired port
-            for i in range(len(output_lines2)) :
-                if re.search(r'\b' + port + r'\b', output_lines2[i]) :
-                    # Found the table row for router_name.  Split this row into 
-                    # individual columns and pick out column 1
-                    columns = output_lines2[i].split('|')
-                    config.logger.info("getting floating ip: " + columns[1].strip())
-                    fip_ids.append(columns[1].strip())
+    for port in open_stack_output.parse_list(output).getRows():
+        if not _firstFixedIP(port.get('fixed_ips')): continue
+        port_id = port['id']
+        # for each port get a list of associated floating IPs
+        output2 = _execCommand("%s -- --port_id=%s" % \
+                                   (_networkCommand('floatingip-list'), port_id))
+        for fip in open_stack_output.parse_list(output2).getRows():
+            if fip.get('port_id', port_id) == port_id:
+                config.logger.info("getting floating ip: " + fip['id'])
+                fip_ids.append(fip['id'])
 
     return fip_ids
 
 
+def _getFloatingIpsForTenant(tenant_uuid):
+    """
+        Returns the floating IPs of the tenant as a list of dictionaries
+        with (at least) 'id', 'floating_ip_address' and 'fixed_ip_address'
+        keys, or None if they can't be listed.
+    """
+    client = _getRESTClient()
+    try :
+        if client :
+            return client.list_floatingips(tenant_id=tenant_uuid)
+        output = _execCommand("%s -- --tenant_id=%s" % \
+                                  (_networkCommand('floatingip-list'),
+                                   tenant_uuid))
+        return open_stack_output.parse_list(output).getRows()
+    except :
+        config.logger.error('Failed to get floating IPs for tenant %s' % \
+                                tenant_uuid)
+        return None
+
+
+def _getFloatingIpsOfVM(vm_object, floating_ips):
+    """
+        Returns the IDs of those of the given floating IPs (from 
+        _getFloatingIpsForTenant) that belong to the VM: those that are
+        its external IP or are associated with its management address.
+    """
+    fip_ids = []
+    for fip in floating_ips :
+        if fip.get('floating_ip_address') == vm_object.getExternalIp() or \
+                (vm_object.getMgmtNetAddr() != None and \
+                     fip.get('fixed_ip_address') == vm_object.getMgmtNetAddr()) :
+            config.logger.info("getting floating ip: " + fip['id'])
+            fip_ids.append(fip['id'])
+    return fip_ids
+
+
 def _getConfigParam(config_file,param):
     """
        Function to parse the gram config file and return the value of the specified parameter
@@ -1542,6 +2243,46 @@ def _getConfigParam(config_file,param):
 
 
 
+# Set if the REST backend was requested but we could not authenticate at
+# init, in which case we use the command line clients instead
+_rest_api_unavailable = False
+
+def _getRESTClient(username=None, password=None, tenant_name=None) :
+    """
+        Return the open_stack_rest client to use for OpenStack calls as
+        the given user (default: the GRAM admin account), or None if
+        OpenStack should be called through the command line clients.
+    """
+    if config.openstack_api != 'rest' or _rest_api_unavailable :
+        return None
+    return open_stack_rest.get_client(username, password, tenant_name)
+
+
+def _networkCommand(command) :
+    """
+        Return the quantum/neutron command line for the given command
+        (e.g. 'net-list'), asking for JSON output if so configured.
+        Arguments are to be appended by the caller.
+    """
+    if config.network_cli_json_output :
+        return '%s %s -f json' % (config.network_type, command)
+    return '%s %s' % (config.network_type, command)
+
+
+class OpenStackCommandError(subprocess.CalledProcessError) :
+    """
+        Raised by _execCommand when a command fails.  error_output holds
+        what the command wrote to stderr.
+    """
+    def __init__(self, returncode, cmd, output, error_output) :
+        subprocess.CalledProcessError.__init__(self, returncode, cmd, output)
+        self.error_output = error_output
+
+    def __str__(self) :
+        return "Command '%s' returned non-zero exit status %d: %s" % \
+            (self.cmd, self.returncode, self.error_output.strip())
+
+
 def _execCommand(cmd_string) :
     """
        Execute the specified command.  Return the output of the command or
@@ -1550,119 +2291,183 @@ def _execCommand(cmd_string) :
     config.logger.info('Issuing command %s' % cmd_string)
     command = cmd_string.split()
     try :
-        return subprocess.check_output(command) 
+        process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        output, error_output = process.communicate()
     except :
         config.logger.error('Error executing command %s' % cmd_string)
         raise
+    if process.returncode != 0 :
+        config.logger.error('Error executing command %s: %s' % \
+                                (cmd_string, error_output.strip()))
+        raise OpenStackCommandError(process.returncode, cmd_string, output,
+                                    error_output)
+    return output
 
 
-# Number of seconds must wait before actually updating sliver status
-# Calls to 'nova show' and 'nova console-log' are rate limited
-# and give errors if you call them too frequenty
-UPDATE_OPERATIONAL_STATUS_RATE_LIMIT = 2
 def updateOperationalStatus(geni_slice) :
     """
         Update the operational status of all VM resources.
+        The states of all the slice's VMs come from a single list call and
+        the console logs (for images that report boot completion there) are
+        fetched in parallel.  This is done at most every 
+        config.vm_status_refresh_interval seconds per slice: calls to 
+        'nova show' and 'nova console-log' are rate limited and give errors
+        if you call them too frequently.  The states are fetched without
+        holding the slice's state lock and set holding it for writing.
     """
-    vms = geni_slice.getVMs()
-    for i in range(0, len(vms)) :
-        vm_object = vms[i]
-        vm_uuid = vm_object.getUUID()
-        last_status_update = vm_object.getLastStatusUpdate()
-        now = time.time()
-        if last_status_update is not None and \
-                (now - last_status_update) < UPDATE_OPERATIONAL_STATUS_RATE_LIMIT:
-            config.logger.info("Not updating operational status until %f" % \
-                                    last_status_update)
-            continue;
-        vm_object.setLastStatusUpdate(now)
-        if vm_uuid != None :
-            # If this is an image for which we can look in log
-            # to determine successful completion of boot, use that instead
-            # of nova show status
-            setting_status_by_boot_complete_msg = \
-                _set_status_by_boot_complete_msg(vm_object)
-            if setting_status_by_boot_complete_msg: continue
-
-            cmd_string = 'nova show %s' % vm_uuid
-            try :
-                output = _execCommand(cmd_string) 
-            except :
-                # Failed to update operational status of this VM.   Set the
-                # state to failed
-                config.logger.error('Failed to find the status of VM for node %s' % vm_object.getName())
-                vm_object.setOperationalState(constants.failed)
-            else :
-                vm_state = _getValueByPropertyName(output, 'status')
-                if vm_state == 'ACTIVE' :
-                    vm_object.setOperationalState(constants.ready)
-                elif vm_state == 'ERROR' :
-                    vm_object.setOperationalState(constants.failed)
-
-    links = geni_slice.getNetworkLinks()
-    for i in range(0, len(links)) :
-        link_object = links[i]
-        network_uuid = link_object.getNetworkUUID() 
-        if network_uuid != None :
-            link_object.setOperationalState(constants.ready)
+    vms = list()
+    with geni_slice.getReadLock() :
+        for vm_object in geni_slice.getVMs() :
+            if vm_object.getUUID() == None : continue
+            if vm_watcher.watcher.isWatching(vm_object) :
+                # The VM watcher is tracking this VM while it boots
+                continue
+            vms.append(vm_object)
+        tenant_uuid = geni_slice.getTenantUUID()
+        admin_name, admin_pwd, admin_uuid = geni_slice.getTenantAdminInfo()
+        tenant_name = geni_slice.getTenantName()
+        console_vm_uuids = [vm_object.getUUID() for vm_object in vms \
+                                if _getBootCompleteMsg(vm_object) != None]
 
-# If the VM is booted with an image for which a 'boot_complete_msg' is
-# registered in the config.disk_image_metadata, use the console-log
-# rather than the nova show to determine the operational status
-def _set_status_by_boot_complete_msg(vm_object):
+    snapshot = None
+    if len(vms) > 0 :
+        try :
+            snapshot = vm_status.status_cache.get(tenant_uuid, 
+                                                  console_vm_uuids,
+                                                  lambda console_vm_uuids : \
+                                                      _fetchVMStatus(admin_name, admin_pwd, tenant_name, console_vm_uuids))
+        except Exception, e :
+            config.logger.error('Failed to find the status of VMs of slice %s: %s' % (geni_slice.getSliceURN(), str(e)))
+            snapshot = None
+
+    with geni_slice.getWriteLock() :
+        # The slice may have changed meanwhile (e.g. VMs deleted): only
+        # update the VMs it still has
+        slivers = geni_slice.getAllSlivers()
+        for vm_object in vms :
+            if not slivers.has_key(vm_object.getSliverURN()) or \
+                    vm_object.getUUID() == None or \
+                    vm_watcher.watcher.isWatching(vm_object) :
+                continue
+            _setOperationalStatus(vm_object, snapshot)
+
+        links = geni_slice.getNetworkLinks()
+        for i in range(0, len(links)) :
+            link_object = links[i]
+            network_uuid = link_object.getNetworkUUID() 
+            if network_uuid != None :
+                link_object.setOperationalState(constants.ready)
+
+def _setOperationalStatus(vm_object, snapshot) :
+    """
+        Set the operational status of a VM from a vm_status.VMStatusSnapshot
+        of its tenant (None if we couldn't get one)
+    """
     vm_uuid = vm_object.getUUID()
-    image_name = vm_object.getOSImageName()
-    if not image_name in config.disk_image_metadata or not \
-            'boot_complete_msg' in config.disk_image_metadata[image_name]:
-        return False
-
-    cmd_string = 'nova console-log --length 2 %s' % vm_uuid
-    try :
-        output = _execCommand(cmd_string)
-    except Exception, e:
-        config.logger.error("Failed to get console log %s" % vm_uuid)
+    if snapshot == None :
         vm_object.setOperationalState(constants.failed)
-    else:
-#        config.logger.info("VM IMAGE %s TYPE %s VERSION %s" % \
-#                               (image_name, vm_object.getOSType(), 
-#                                vm_object.getOSVersion()))
-        boot_complete_msg = \
-            config.disk_image_metadata[image_name]['boot_complete_msg']
-        
+        return
+    vm_object.setLastStatusUpdate(snapshot.fetch_time)
+
+    # If this is an image for which we can look in log
+    # to determine successful completion of boot, use that instead
+    # of nova status
+    boot_complete_msg = _getBootCompleteMsg(vm_object)
+    if boot_complete_msg != None :
+        output = snapshot.console_logs.get(vm_uuid)
+        if output == None :
+            config.logger.error("Failed to get console log %s" % vm_uuid)
+            vm_object.setOperationalState(constants.failed)
+            return
         boot_done = output.find(boot_complete_msg) >= 0
         config.logger.info("BOOT DONE MATCH = %s %s %s" % (boot_complete_msg, output, boot_done))
         if boot_done:
             vm_object.setOperationalState(constants.ready)
         else:
             vm_object.setOperationalState(constants.notready)
+        return
 
-    return True
+    vm_state = snapshot.states.get(vm_uuid)
+    if vm_state == None :
+        # Failed to update operational status of this VM.   Set the
+        # state to failed
+        config.logger.error('Failed to find the status of VM for node %s' % vm_object.getName())
+        vm_object.setOperationalState(constants.failed)
+    elif vm_state == 'ACTIVE' :
+        vm_object.setOperationalState(constants.ready)
+    elif vm_state == 'ERROR' :
+        vm_object.setOperationalState(constants.failed)
+
+# If the VM is booted with an image for which a 'boot_complete_msg' is
+# registered in the config.disk_image_metadata, use the console-log
+# rather than the nova status to determine the operational status
+def _getBootCompleteMsg(vm_object):
+    image_name = vm_object.getOSImageName()
+    if not image_name in config.disk_image_metadata or not \
+            'boot_complete_msg' in config.disk_image_metadata[image_name]:
+        return None
+    return config.disk_image_metadata[image_name]['boot_complete_msg']
+
+def _fetchVMStatus(admin_name, admin_pwd, tenant_name, console_vm_uuids) :
+    """
+        Returns ({VM UUID => nova status} for all VMs of the tenant (as
+        its admin user), {VM UUID => last 2 lines of console log, or None
+        on failure} for the VMs in console_vm_uuids)
+    """
+    client = _getRESTClient(admin_name, admin_pwd, tenant_name)
+    if client :
+        states = dict([(server['id'], server['status']) \
+                           for server in client.list_servers()])
+    else :
+        cmd_string = 'nova --os-username=%s --os-password=%s --os-tenant-name=%s list' % (admin_name, admin_pwd, tenant_name)
+        output = _execCommand(cmd_string)
+        states = dict([(row['ID'], row['Status']) for row in \
+                           open_stack_output.parse_list(output).getRows()])
+
+    console_log_tasks = \
+        task_executor.TaskGraph(config.vm_status_concurrency,
+                                'console-log commands for %s' % tenant_name)
+    for vm_uuid in console_vm_uuids :
+        console_log_tasks.add('console-log %s' % vm_uuid, _getConsoleLog,
+                              (vm_uuid,))
+    console_log_tasks.run()
+    console_logs = dict()
+    for vm_uuid, task in zip(console_vm_uuids, console_log_tasks.getTasks()) :
+        console_logs[vm_uuid] = task.result
+    return states, console_logs
+
+def _getConsoleLog(vm_uuid) :
+    cmd_string = 'nova console-log --length 2 %s' % vm_uuid
+    client = _getRESTClient()
+    if client :
+        return client.get_console_output(vm_uuid, 2)
+    return _execCommand(cmd_string)
 
 # Parse return from an OpenStack call and return table 
 #   {key: values, key : values}
 def _parseTableOutput(output):
-    lines = output.split('\n')
-    header_line = lines[1]
-    data_lines = lines[3:len(lines)-2]
-    header_parts = header_line.split('|')
-    headers = [header_part.strip() for header_part in header_parts \
-                   if header_part.strip() != '']
-    data = [[data_part.strip() for data_part in data_line.split('|')] \
-                 for data_line in data_lines]
-    for i in range(len(data)):
-        data[i] = data[i][1:len(headers)+1]
-    output = {}
-    for i in range(len(headers)):
-        header = headers[i]
-        data_for_header = [data_for_line[i] for data_for_line in data]
-        output[header] = data_for_header
-        
-    return output
+    return open_stack_output.parse_list(output).getColumns()
+
+# Columns of 'glance image-list' and the corresponding Glance API fields
+_GLANCE_IMAGE_COLUMNS = [('ID', 'id'), ('Name', 'name'),
+                         ('Disk Format', 'disk_format'),
+                         ('Container Format', 'container_format'),
+                         ('Size', 'size'), ('Status', 'status')]
 
 def listImages():
-    cmd_string = "glance image-list"
-    output = _execCommand(cmd_string)
-    parsed_output = _parseTableOutput(output)
+    client = _getRESTClient()
+    if client :
+        # Build the same table the CLI would have given us
+        images = client.list_glance_images()
+        parsed_output = {}
+        for column, field in _GLANCE_IMAGE_COLUMNS :
+            parsed_output[column] = [str(image.get(field, '')) \
+                                         for image in images]
+    else :
+        cmd_string = "glance image-list"
+        output = _execCommand(cmd_string)
+        parsed_output = _parseTableOutput(output)
 #    print "OUTPUT = %s" % output
 #    print "PARSED_OUTPUT = %s" % parsed_output
     names = parsed_output['Name']
@@ -1682,86 +2487,167 @@ def listImages():
     return res
 
 
-def get_all_tenant_info():
-
-    # Dictionary of 'vm_uuids', 'net_uuids', 'subnet_uuids', 'router_uuids'
-    #   'user_uuids', 'secgrp_uuids'
-    #  indexed by tenant_uuid
-    result = {} 
-
-    # Get all tenants
-    cmd_string = "keystone tenant-list"
-    output = _execCommand(cmd_string)
-    tenant_info = _parseTableOutput(output)
-
-    # Tenant ID's correspond to slices
-    tenant_ids = []
-    for i in range(len(tenant_info['name'])):
-        tenant_name = tenant_info['name'][i]
-        if tenant_name not in ['admin', 'service']:
-            tenant_ids.append(tenant_info['id'][i])
+def _listTenantUUIDs() :
+    """
+        Return the UUIDs of all OpenStack tenants (including admin and 
+        service)
+    """
+    client = _getRESTClient()
+    if client :
+        return [tenant['id'] for tenant in client.list_tenants()]
+    output = _execCommand("keystone tenant-list")
+    return _parseTableOutput(output)['id']
 
-    # Users are admins on slices
-    cmd_string = "keystone user-list"
-    output = _execCommand(cmd_string)
-#    print "USER-LIST %s" % output
-    users_info = _parseTableOutput(output)
-#    print "USERS_INFO = %s" % users_info
-    user_uuids_by_tenant_id = {}
-    for i in range(len(users_info['id'])):
-        if users_info['name'][i] not in \
+def get_all_tenant_info():
+    """
+        Returns {tenant UUID => {'vm_uuids', 'router_uuids', 'net_uuids',
+        'subnet_uuids' and, if the tenant has an admin user, 'user_uuids'}}
+        for the slice tenants (all but admin and service).  Each kind of
+        object is listed once for all tenants, the listings are made in
+        parallel (at most config.reconcile_concurrency at a time) and then
+        joined by tenant.  The entry of a tenant whose VMs may not all
+        have been listed (a 'nova list' cut short by Nova's limit) has
+        'incomplete' set.
+    """
+    client = _getRESTClient()
+    if client :
+        listers = [('tenants', client.list_tenants),
+                   ('users', client.list_users),
+                   ('vm_uuids', 
+                    lambda: client.list_servers(all_tenants=True)),
+                   ('router_uuids', client.list_routers),
+                   ('net_uuids', client.list_networks),
+                   ('subnet_uuids', client.list_subnets)]
+    else :
+        listers = [('tenants', _listTenantsCLI),
+                   ('users', _listUsersWithTenantsCLI),
+                   ('vm_uuids', _listServersOfAllTenantsCLI)]
+        for key, command in [('router_uuids', 'router-list'),
+                             ('net_uuids', 'net-list'),
+                             ('subnet_uuids', 'subnet-list')] :
+            listers.append((key, _networkListerCLI(command)))
+
+    graph = task_executor.TaskGraph(config.reconcile_concurrency, 
+                                    'tenant-info')
+    tasks = [(key, graph.add(key, lister, ())) for key, lister in listers]
+    if not graph.run() :
+        failed_task = graph.getFailedTasks()[0]
+        raise Exception("Failed to list %s: %s" % \
+                            (failed_task.name, failed_task.exception))
+    listings = dict([(key, task.result) for key, task in tasks])
+
+    result = {}
+    for tenant in listings['tenants']:
+        if tenant['name'] not in ['admin', 'service']:
+            result[tenant['id']] = {'vm_uuids' : [], 'router_uuids' : [],
+                                    'net_uuids' : [], 'subnet_uuids' : []}
+
+    for user in listings['users']:
+        if user['name'] in \
                 ['admin', 'cinder', 'glance', 'nova', config.network_type]:
-            user_uuid = users_info['id'][i]
-            user_cmd_string = 'keystone user-get %s' % user_uuid
-            user_output = _execCommand(user_cmd_string)
-            user_info = _parseTableOutput(user_output)
-            for j in range(len(user_info['Property'])):
-                if user_info['Property'][j] == 'tenantId':
-                    user_tenant_uuid = user_info['Value'][j]
-                    user_uuids_by_tenant_id[user_tenant_uuid] = [user_uuid]
-
-    # Nova instance ID's correspond to VM UUIDs
-    for tenant_id in tenant_ids:
+            continue
+        tenant_id = user.get('tenantId')
+        if tenant_id in result:
+            result[tenant_id]['user_uuids'] = [user['id']]
+
+    for key in ['vm_uuids', 'router_uuids', 'net_uuids', 'subnet_uuids']:
+        for obj in listings[key]:
+            tenant_id = obj.get('tenant_id')
+            if tenant_id in result:
+                result[tenant_id][key].append(obj['id'])
+
+    if not client :
+        for tenant_info in result.values() :
+            if len(tenant_info['vm_uuids']) >= config.nova_max_limit :
+                tenant_info['incomplete'] = True
 
-        result[tenant_id] = {}
-
-        cmd_string = 'nova list --tenant %s --all-tenants' % tenant_id
-        output = _execCommand(cmd_string)
-        vms_info = _parseTableOutput(output)
-        vm_uuids = []
-        if 'ID' in vms_info:
-            vm_uuids = vms_info['ID']
-        result[tenant_id]['vm_uuids'] = vm_uuids
+    return result
 
-        cmd_string = '%s router-list -F id --tenant_id=%s' % (config.network_type, tenant_id)
-        output = _execCommand(cmd_string)
-        router_info = _parseTableOutput(output)
-        router_uuids = []
-        if 'id' in router_info:
-            router_uuids = router_info['id']
-        result[tenant_id]['router_uuids'] = router_uuids
+def _listTenantsCLI():
+    """
+        Return [{'id', 'name'}] for all tenants
+    """
+    output = _execCommand('keystone tenant-list')
+    return open_stack_output.parse_list(output).getRows()
 
-        cmd_string = '%s net-list -F id --tenant_id=%s' % (config.network_type, tenant_id)
-        output = _execCommand(cmd_string)
-        net_info = _parseTableOutput(output)
-        net_uuids = []
-        if 'id' in net_info:
-            net_uuids = net_info['id']
-        result[tenant_id]['net_uuids'] = net_uuids
+def _listUsersWithTenantsCLI():
+    """
+        Return [{'id', 'name', 'tenantId'}] for all users.  The tenant of
+        a user is only shown by 'keystone user-get': that is run for the
+        users (other than the OpenStack service users) in parallel.
+    """
+    output = _execCommand('keystone user-list')
+    users = [{'id' : row['id'], 'name' : row['name']} for row in \
+                 open_stack_output.parse_list(output).getRows()]
 
-        cmd_string = '%s subnet-list -F id --tenant_id=%s' % (config.network_type, tenant_id)
-        output = _execCommand(cmd_string)
-        subnet_info = _parseTableOutput(output)
-        subnet_uuids = []
-        if 'id' in subnet_info:
-            subnet_uuids = subnet_info['id']
-        result[tenant_id]['subnet_uuids'] = subnet_uuids
+    def get_user_tenant(user) :
+        user_output = _execCommand('keystone user-get %s' % user['id'])
+        user_info = open_stack_output.parse_properties(user_output)
+        if 'tenantId' in user_info :
+            user['tenantId'] = user_info['tenantId']
 
-        if tenant_id in user_uuids_by_tenant_id:
-            result[tenant_id]['user_uuids'] = \
-                user_uuids_by_tenant_id[tenant_id]
+    graph = task_executor.TaskGraph(config.reconcile_concurrency, 'user-get')
+    for user in users :
+        if user['name'] not in \
+                ['admin', 'cinder', 'glance', 'nova', config.network_type]:
+            graph.add('user-get ' + user['name'], get_user_tenant, (user,))
+    if not graph.run() :
+        raise graph.getFailedTasks()[0].exception
+    return users
 
-    return result
+def _listServersOfAllTenantsCLI():
+    """
+        Return [{'id', 'tenant_id'}] for the VMs of all tenants.  If this 
+        nova client can't show the tenants of VMs in its listing, or the
+        listing may have been cut short by Nova (config.nova_max_limit),
+        the VMs of each tenant are listed separately (in parallel).
+    """
+    output = _execCommand('nova list --all-tenants --fields tenant_id')
+    table = open_stack_output.parse_list(output)
+    tenant_column = None
+    for header in ['Tenant Id', 'Tenant ID', 'tenant_id'] :
+        if header in table.getHeaders() :
+            tenant_column = header
+    rows = table.getRows()
+    if tenant_column and len(rows) < config.nova_max_limit :
+        return [{'id' : row['ID'], 'tenant_id' : row[tenant_column]} \
+                    for row in rows]
+
+    servers = []
+    def list_tenant_servers(tenant_id) :
+        output = _execCommand('nova list --tenant %s --all-tenants' % \
+                                  tenant_id)
+        for row in open_stack_output.parse_list(output).getRows() :
+            servers.append({'id' : row['ID'], 'tenant_id' : tenant_id})
+
+    graph = task_executor.TaskGraph(config.reconcile_concurrency, 
+                                    'nova-list')
+    for tenant in _listTenantsCLI() :
+        if tenant['name'] in ['admin', 'service'] : continue
+        graph.add('nova list ' + tenant['id'], list_tenant_servers,
+                  (tenant['id'],))
+    if not graph.run() :
+        raise graph.getFailedTasks()[0].exception
+    return servers
+
+def _networkListerCLI(command):
+    """
+        Return a function that returns [{'id', 'tenant_id'}] for all
+        objects listed by the given network command (e.g. net-list)
+    """
+    def lister() :
+        output = _execCommand('%s -F id -F tenant_id' % \
+                                  _networkCommand(command))
+        return open_stack_output.parse_list(output).getRows()
+    return lister
+
+vm_watcher.watcher.setFunctions(_listServerStates, _finishVMCreation)
+
+inventory_cache.inventory.register('hosts', _fetchHosts)
+inventory_cache.inventory.register('hypervisors', _fetchHypervisors)
+inventory_cache.inventory.register('routers', _fetchRouters)
+inventory_cache.inventory.register('users', _fetchUsers)
+inventory_cache.inventory.register('ovs_vlans', _fetchOVSVLANs)
 
 if __name__ == "__main__":
     import sys
@@ -0,0 +1,288 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Parsing of the output of the OpenStack command line clients.
+#
+# The quantum/neutron clients are asked for '-f json' output, which is
+# decoded directly.  The nova, keystone and glance clients only print
+# ASCII tables such as
+#
+#    +--------------------------------------+------------+--------+
+#    | ID                                   | Name       | Status |
+#    +--------------------------------------+------------+--------+
+#    | 0e4e4d4c-02e5-4ea3-9dd5-4e2d6dcbd4f9 | ubuntu-12  | ACTIVE |
+#    +--------------------------------------+------------+--------+
+#
+# which are parsed in a single pass.  Either way the result is decoded
+# once into rows (dicts) indexed by id and by name, so lookups are exact
+# and don't depend on the table layout.
+
+import json
+
+# Column names under which the CLIs report object ids and names
+_ID_COLUMNS = ['id', 'ID']
+_NAME_COLUMNS = ['name', 'Name', 'Hypervisor hostname', 'host_name']
+
+
+class OutputTable:
+    """
+        The rows of a listing (e.g. net-list, user-list), each a dictionary
+        of column name => value, indexed by id and by name.
+    """
+    def __init__(self, headers, rows):
+        self._headers = headers
+        self._rows = rows
+        self._by_id = {}
+        self._by_name = {}
+        id_column = _find_column(headers, _ID_COLUMNS)
+        name_column = _find_column(headers, _NAME_COLUMNS)
+        for row in rows:
+            if id_column:
+                self._by_id.setdefault(row.get(id_column), row)
+            if name_column:
+                self._by_name.setdefault(row.get(name_column), row)
+        self._id_column = id_column
+
+    def __len__(self):
+        return len(self._rows)
+
+    def getHeaders(self):
+        return self._headers
+
+    def getRows(self):
+        return self._rows
+
+    def getById(self, object_id):
+        return self._by_id.get(object_id)
+
+    def getByName(self, name):
+        return self._by_name.get(name)
+
+    def getIdByName(self, name):
+        """
+            Return the id of the object with exactly the given name, or
+            None if there is no such object.
+        """
+        row = self._by_name.get(name)
+        if row is None or self._id_column is None:
+            return None
+        return row[self._id_column]
+
+    def getColumn(self, header):
+        return [row.get(header) for row in self._rows]
+
+    def getColumns(self):
+        """
+            Return the table as {header : [values]}
+        """
+        columns = {}
+        for header in self._headers:
+            columns[header] = self.getColumn(header)
+        return columns
+
+
+def _find_column(headers, candidates):
+    for candidate in candidates:
+        if candidate in headers:
+            return candidate
+    return None
+
+
+def is_json(output):
+    stripped = output.lstrip()
+    return stripped.startswith('[') or stripped.startswith('{')
+
+
+def parse_list(output):
+    """
+        Parse the output of a list command (JSON or ASCII table) into
+        an OutputTable
+    """
+    if is_json(output):
+        rows = json.loads(output)
+        headers = []
+        for row in rows:
+            for header in row.keys():
+                if header not in headers:
+                    headers.append(header)
+        return OutputTable(headers, rows)
+
+    headers = None
+    rows = []
+    for line in output.split('\n'):
+        if not line.startswith('|'):
+            continue # Border, blank or message line
+        parts = [part.strip() for part in line.split('|')[1:-1]]
+        if headers is None:
+            headers = parts
+        elif parts[0] == '' and rows:
+            # Continuation of a multi-line cell (e.g. fixed_ips)
+            row = rows[-1]
+            for header, part in zip(headers, parts):
+                if part:
+                    row[header] = (row[header] + '\n' + part).lstrip('\n')
+        else:
+            rows.append(dict(zip(headers, parts)))
+    if headers is None:
+        headers = []
+    return OutputTable(headers, rows)
+
+
+def parse_properties(output):
+    """
+        Parse the output of a create or show command into a dictionary
+        of property => value.  Handles JSON and the two column
+        | Property | Value | tables.
+    """
+    if is_json(output):
+        properties = json.loads(output)
+        if isinstance(properties, list):
+            # Some CLI versions print show output as a Field/Value listing
+            properties = dict([(row.get('Field'), row.get('Value')) \
+                                   for row in properties])
+        return properties
+
+    properties = {}
+    first_row = True
+    last_property = None
+    for line in output.split('\n'):
+        if not line.startswith('|'):
+            continue
+        parts = line.split('|')
+        if len(parts) < 4:
+            continue
+        if first_row:
+            # Header row ('Property | Value' or 'Field | Value')
+            first_row = False
+            continue
+        name = parts[1].strip()
+        value = parts[2].strip()
+        if name == '' and last_property is not None:
+            # Continuation of a multi-line value
+            properties[last_property] += '\n' + value
+            continue
+        properties[name] = value
+        last_property = name
+    return properties
+
+
+def parse_fixed_ips(fixed_ips):
+    """
+        The fixed_ips of a port as a list of {'subnet_id', 'ip_address'}
+        dictionaries.  The CLIs print these as one JSON object per line.
+    """
+    if isinstance(fixed_ips, list):
+        return fixed_ips
+    if not fixed_ips:
+        return []
+    result = []
+    for line in fixed_ips.split('\n'):
+        line = line.strip()
+        if line:
+            result.append(json.loads(line))
+    return result
+
+
+# Generate ASCII tables in the CLI format for the benchmark below
+def _format_table(headers, rows):
+    widths = [len(header) for header in headers]
+    for row in rows:
+        for i in range(len(headers)):
+            widths[i] = max(widths[i], len(row[i]))
+    border = '+' + '+'.join(['-' * (width + 2) for width in widths]) + '+'
+    def format_row(values):
+        return '| ' + ' | '.join([values[i].ljust(widths[i]) \
+                                      for i in range(len(values))]) + ' |'
+    lines = [border, format_row(headers), border]
+    for row in rows:
+        lines.append(format_row(row))
+    lines.append(border)
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == "__main__":
+    # Microbenchmark: compare the regex-per-row table scraping GRAM used
+    # before with parsing a table (or JSON) once and looking names up
+    # in the index.  Usage: python open_stack_output.py [rows] [lookups]
+    import re
+    import sys
+    import time
+    import uuid
+
+    def legacy_get_uuid_by_name(output_table, name):
+        output_lines = output_table.split('\n')
+        name = re.escape(name)
+        for i in range(len(output_lines)):
+            if re.search(r'\b' + name + r'\b', output_lines[i]):
+                columns = output_lines[i].split('|')
+                return columns[1].strip()
+        return None
+
+    num_rows = 1000
+    num_lookups = 1000
+    if len(sys.argv) > 1: num_rows = int(sys.argv[1])
+    if len(sys.argv) > 2: num_lookups = int(sys.argv[2])
+
+    # A port-list like table: id, name, mac_address, fixed_ips.  Every
+    # other port is named like its successor with an '-old' suffix.
+    headers = ['id', 'name', 'mac_address', 'fixed_ips']
+    rows = []
+    for i in range(num_rows):
+        name = 'port-%d' % (i / 2)
+        if i % 2 == 0: name += '-old'
+        rows.append([str(uuid.uuid4()), name,
+                     'fa:16:3e:%02x:%02x:%02x' % (i / 65536, (i / 256) % 256,
+                                                  i % 256),
+                     json.dumps({'subnet_id' : str(uuid.uuid4()),
+                                 'ip_address' : '10.0.%d.%d' % \
+                                     (i / 250, i % 250 + 2)})])
+    table_output = _format_table(headers, rows)
+    json_output = json.dumps([dict(zip(headers, row)) for row in rows])
+    names = ['port-%d' % ((i * 7919) % (num_rows / 2)) \
+                 for i in range(num_lookups)]
+
+    start = time.time()
+    legacy_ids = [legacy_get_uuid_by_name(table_output, name) \
+                      for name in names]
+    legacy_time = time.time() - start
+
+    start = time.time()
+    table = parse_list(table_output)
+    table_ids = [table.getIdByName(name) for name in names]
+    table_time = time.time() - start
+
+    start = time.time()
+    table = parse_list(json_output)
+    json_ids = [table.getIdByName(name) for name in names]
+    json_time = time.time() - start
+
+    # The legacy scraper finds 'port-1' in the 'port-1-old' row: count
+    # the lookups it gets wrong
+    wrong = len([i for i in range(num_lookups) \
+                     if legacy_ids[i] != table_ids[i]])
+    print "%d rows, %d lookups" % (num_rows, num_lookups)
+    print "   legacy regex scan:    %8.4f sec (%d wrong answers)" % \
+        (legacy_time, wrong)
+    print "   parse table + index:  %8.4f sec" % table_time
+    print "   parse JSON + index:   %8.4f sec" % json_time
+    assert table_ids == json_ids
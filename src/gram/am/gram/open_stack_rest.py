@@ -0,0 +1,587 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Client for the Keystone (v2.0), Nova (v2), Neutron/Quantum (v2.0) and
+# Glance (v1) REST APIs.
+#
+# This is the 'rest' backend of open_stack_interface: instead of forking
+# a nova/neutron/keystone command line client for every operation (each of
+# which re-authenticates and re-imports its client libraries) we keep one
+# Keystone token per set of credentials and a pool of keep-alive HTTP
+# connections per API endpoint.  All calls return the decoded JSON
+# structures (dicts and lists) of the OpenStack APIs.
+#
+# Failures raise OpenStackRESTError, so callers can treat a failed REST call
+# the same way they treat a failed _execCommand.
+
+import calendar
+import httplib
+import json
+import socket
+import threading
+import time
+import urllib
+import urlparse
+
+import config
+
+
+class OpenStackRESTError(Exception):
+    """
+        Raised when an OpenStack API request fails.  status is the HTTP
+        status code of the response, or None if no response was received.
+    """
+    def __init__(self, message, status=None):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class HTTPConnectionPool:
+    """
+        Pool of idle keep-alive HTTP(S) connections, keyed by endpoint
+        (scheme, host, port).  Shared by all OpenStackRESTClient instances.
+    """
+    def __init__(self, max_idle_per_endpoint, timeout):
+        self._max_idle = max_idle_per_endpoint
+        self._timeout = timeout
+        self._idle = {} # (scheme, netloc) => list of idle connections
+        self._lock = threading.Lock()
+
+    def get(self, scheme, netloc):
+        """
+            Returns (connection, reused) where reused is True if the
+            connection was taken from the idle pool.
+        """
+        key = (scheme, netloc)
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        finally:
+            self._lock.release()
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self._timeout), \
+                False
+        return httplib.HTTPConnection(netloc, timeout=self._timeout), False
+
+    def put(self, scheme, netloc, conn):
+        key = (scheme, netloc)
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self._max_idle:
+                idle.append(conn)
+                return
+        finally:
+            self._lock.release()
+        conn.close()
+
+    def close_all(self):
+        self._lock.acquire()
+        try:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle = {}
+        finally:
+            self._lock.release()
+
+
+class OpenStackRESTClient:
+    """
+        Talks to the OpenStack APIs as a given user of a given tenant.
+        The Keystone token and service catalog are fetched on first use,
+        cached, and refreshed when the token nears expiry or is rejected.
+    """
+
+    # Refresh the token this many seconds before Keystone says it expires
+    TOKEN_EXPIRY_MARGIN = 60
+
+    # Methods that may be retried once the request has been sent
+    IDEMPOTENT_METHODS = ['GET', 'HEAD', 'PUT', 'DELETE']
+
+    def __init__(self, auth_url, username, password, tenant_name,
+                 region_name, connection_pool):
+        self._auth_url = auth_url.rstrip('/')
+        self._username = username
+        self._password = password
+        self._tenant_name = tenant_name
+        self._region_name = region_name
+        self._pool = connection_pool
+
+        self._token = None
+        self._token_expires = 0
+        self._tenant_id = None
+        self._endpoints = {} # service type => {'publicURL', 'adminURL'}
+        self._auth_lock = threading.Lock()
+
+    ######## Authentication and request plumbing
+
+    def authenticate(self):
+        """
+            Get a new token (and service catalog) from Keystone.
+        """
+        body = {'auth' : {'tenantName' : self._tenant_name,
+                          'passwordCredentials' :
+                              {'username' : self._username,
+                               'password' : self._password}}}
+        response = self._send('POST', self._auth_url + '/tokens', body, None)
+        access = response['access']
+        token = access['token']
+        endpoints = {}
+        for service in access.get('serviceCatalog', []):
+            for endpoint in service.get('endpoints', []):
+                if self._region_name and 'region' in endpoint and \
+                        endpoint['region'] != self._region_name:
+                    continue
+                endpoints[service['type']] = endpoint
+                break
+        self._endpoints = endpoints
+        self._tenant_id = token.get('tenant', {}).get('id')
+        self._token_expires = _parse_expiry(token.get('expires'))
+        self._token = token['id']
+
+    def get_token(self):
+        self._auth_lock.acquire()
+        try:
+            if self._token is None or \
+                    time.time() > self._token_expires - \
+                    OpenStackRESTClient.TOKEN_EXPIRY_MARGIN:
+                self.authenticate()
+            return self._token
+        finally:
+            self._auth_lock.release()
+
+    def _invalidate_token(self, token):
+        self._auth_lock.acquire()
+        try:
+            if self._token == token:
+                self._token = None
+        finally:
+            self._auth_lock.release()
+
+    def _endpoint_url(self, service_type, admin=False):
+        self.get_token()
+        if service_type not in self._endpoints:
+            raise OpenStackRESTError('No %s endpoint in service catalog' % \
+                                         service_type)
+        endpoint = self._endpoints[service_type]
+        if admin and 'adminURL' in endpoint:
+            return endpoint['adminURL'].rstrip('/')
+        return endpoint['publicURL'].rstrip('/')
+
+    def request(self, service_type, method, path, body=None, admin=False):
+        """
+            Issue a request against the given service (e.g. 'compute',
+            'network').  Returns the decoded JSON body (None if empty).
+            A rejected token is refreshed and the request retried once.
+        """
+        url = self._endpoint_url(service_type, admin) + path
+        token = self.get_token()
+        try:
+            return self._send(method, url, body, token)
+        except OpenStackRESTError, e:
+            if e.status != 401:
+                raise
+        self._invalidate_token(token)
+        return self._send(method, url, body, self.get_token())
+
+    def _send(self, method, url, body, token):
+        parsed = urlparse.urlparse(url)
+        path = parsed.path
+        if parsed.query:
+            path += '?' + parsed.query
+        headers = {'Accept' : 'application/json',
+                   'Connection' : 'keep-alive'}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if token:
+            headers['X-Auth-Token'] = token
+
+        # An idle pooled connection may have been closed by the server.
+        # In that case drop it and retry: any request that failed while
+        # being sent, and idempotent ones if the response failed.  A POST
+        # that was sent may have been acted upon (e.g. a server created)
+        # and a failure on a new connection is never retried.
+        while True:
+            conn, reused = self._pool.get(parsed.scheme, parsed.netloc)
+            sent = False
+            try:
+                conn.request(method, path, data, headers)
+                sent = True
+                response = conn.getresponse()
+                status = response.status
+                content = response.read()
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                if reused and (not sent or method in \
+                                   OpenStackRESTClient.IDEMPOTENT_METHODS):
+                    continue
+                raise OpenStackRESTError('%s %s failed: %s' % \
+                                             (method, url, str(e)))
+            if response.getheader('connection', '').lower() == 'close':
+                conn.close()
+            else:
+                self._pool.put(parsed.scheme, parsed.netloc, conn)
+            break
+
+        if status >= 300:
+            raise OpenStackRESTError('%s %s returned %d: %s' % \
+                                         (method, url, status, content),
+                                     status)
+        if not content:
+            return None
+        try:
+            return json.loads(content)
+        except ValueError:
+            return content
+
+    ######## Identity (Keystone v2.0 admin API)
+
+    def list_tenants(self):
+        return self.request('identity', 'GET', '/tenants', admin=True)['tenants']
+
+    def create_tenant(self, name):
+        body = {'tenant' : {'name' : name, 'enabled' : True}}
+        return self.request('identity', 'POST', '/tenants', body,
+                            admin=True)['tenant']
+
+    def delete_tenant(self, tenant_id):
+        self.request('identity', 'DELETE', '/tenants/%s' % tenant_id,
+                     admin=True)
+
+    def list_users(self):
+        return self.request('identity', 'GET', '/users', admin=True)['users']
+
+    def get_user(self, user_id):
+        return self.request('identity', 'GET', '/users/%s' % user_id,
+                            admin=True)['user']
+
+    def create_user(self, name, password, tenant_id):
+        body = {'user' : {'name' : name, 'password' : password,
+                          'tenantId' : tenant_id, 'enabled' : True}}
+        return self.request('identity', 'POST', '/users', body,
+                            admin=True)['user']
+
+    def delete_user(self, user_id):
+        self.request('identity', 'DELETE', '/users/%s' % user_id, admin=True)
+
+    def list_roles(self):
+        return self.request('identity', 'GET', '/OS-KSADM/roles',
+                            admin=True)['roles']
+
+    def add_user_role(self, tenant_id, user_id, role_id):
+        self.request('identity', 'PUT',
+                     '/tenants/%s/users/%s/roles/OS-KSADM/%s' % \
+                         (tenant_id, user_id, role_id), admin=True)
+
+    ######## Compute (Nova v2 API)
+
+    def list_servers(self, all_tenants=False, tenant_id=None):
+        """
+            Nova returns at most osapi_max_limit servers per request:
+            the listing is paged through (marker = last server listed)
+            until Nova has no next page.
+        """
+        query = {}
+        if all_tenants:
+            query['all_tenants'] = 1
+        if tenant_id:
+            query['tenant_id'] = tenant_id
+        servers = []
+        while True:
+            response = self.request('compute', 'GET', '/servers/detail' + \
+                                        _query_string(query))
+            page = response['servers']
+            servers.extend(page)
+            if len(page) == 0:
+                return servers
+            links = response.get('servers_links')
+            if links is not None and \
+                    'next' not in [link.get('rel') for link in links]:
+                return servers
+            # Without links, keep going until a page is empty
+            query['marker'] = page[-1]['id']
+
+    def show_server(self, server_id):
+        return self.request('compute', 'GET',
+                            '/servers/%s' % server_id)['server']
+
+    def create_server(self, name, image_id, flavor_id, networks,
+                      security_groups=None, user_data=None,
+                      availability_zone=None, config_drive=False,
+                      scheduler_hints=None):
+        """
+            networks is a list of {'uuid' : net_id} or {'port' : port_id}.
+            user_data must already be base64 encoded.
+        """
+        server = {'name' : name, 'imageRef' : image_id,
+                  'flavorRef' : flavor_id, 'networks' : networks}
+        if security_groups:
+            server['security_groups'] = \
+                [{'name' : group} for group in security_groups]
+        if user_data:
+            server['user_data'] = user_data
+        if availability_zone:
+            server['availability_zone'] = availability_zone
+        if config_drive:
+            server['config_drive'] = True
+        body = {'server' : server}
+        if scheduler_hints:
+            body['os:scheduler_hints'] = scheduler_hints
+        return self.request('compute', 'POST', '/servers', body)['server']
+
+    def wait_for_server(self, server_id, poll_interval=5, timeout=None):
+        """
+            Poll a server until it leaves the BUILD state (what the CLI's
+            'boot --poll' does).  Returns the final server record.
+        """
+        start = time.time()
+        while True:
+            server = self.show_server(server_id)
+            if server.get('status') != 'BUILD':
+                return server
+            if timeout is not None and time.time() - start > timeout:
+                return server
+            time.sleep(poll_interval)
+
+    def delete_server(self, server_id):
+        self.request('compute', 'DELETE', '/servers/%s' % server_id)
+
+    def server_action(self, server_id, action, argument=None):
+        return self.request('compute', 'POST',
+                            '/servers/%s/action' % server_id,
+                            {action : argument})
+
+    def get_console_output(self, server_id, length=None):
+        result = self.server_action(server_id, 'os-getConsoleOutput',
+                                    {'length' : length})
+        return result['output']
+
+    def list_hypervisors(self):
+        return self.request('compute', 'GET', '/os-hypervisors')['hypervisors']
+
+    def list_hosts(self):
+        return self.request('compute', 'GET', '/os-hosts')['hosts']
+
+    def list_flavors(self):
+        return self.request('compute', 'GET', '/flavors/detail')['flavors']
+
+    def list_images(self):
+        return self.request('compute', 'GET', '/images/detail')['images']
+
+    def delete_image(self, image_id):
+        self.request('compute', 'DELETE', '/images/%s' % image_id)
+
+    def list_security_groups(self):
+        return self.request('compute', 'GET',
+                            '/os-security-groups')['security_groups']
+
+    def create_security_group(self, name, description):
+        body = {'security_group' : {'name' : name,
+                                    'description' : description}}
+        return self.request('compute', 'POST', '/os-security-groups',
+                            body)['security_group']
+
+    def add_security_group_rule(self, group_id, protocol, from_port, to_port,
+                                cidr):
+        body = {'security_group_rule' : {'parent_group_id' : group_id,
+                                         'ip_protocol' : protocol,
+                                         'from_port' : from_port,
+                                         'to_port' : to_port,
+                                         'cidr' : cidr}}
+        return self.request('compute', 'POST', '/os-security-group-rules',
+                            body)['security_group_rule']
+
+    def delete_security_group(self, group_id):
+        self.request('compute', 'DELETE', '/os-security-groups/%s' % group_id)
+
+    ######## Networking (Quantum/Neutron v2.0 API)
+
+    def _network_list(self, collection, filters):
+        return self.request('network', 'GET', '/v2.0/%s' % collection + \
+                                _query_string(filters))[collection]
+
+    def _network_create(self, resource, attributes):
+        return self.request('network', 'POST', '/v2.0/%ss' % resource,
+                            {resource : attributes})[resource]
+
+    def _network_delete(self, resource, resource_id):
+        self.request('network', 'DELETE',
+                     '/v2.0/%ss/%s' % (resource, resource_id))
+
+    def list_networks(self, **filters):
+        return self._network_list('networks', filters)
+
+    def show_network(self, network_id):
+        return self.request('network', 'GET',
+                            '/v2.0/networks/%s' % network_id)['network']
+
+    def create_network(self, name, tenant_id, **attributes):
+        attributes['name'] = name
+        attributes['tenant_id'] = tenant_id
+        return self._network_create('network', attributes)
+
+    def delete_network(self, network_id):
+        self._network_delete('network', network_id)
+
+    def list_subnets(self, **filters):
+        return self._network_list('subnets', filters)
+
+    def create_subnet(self, network_id, tenant_id, cidr, gateway_ip,
+                      allocation_pools):
+        return self._network_create('subnet',
+                                    {'network_id' : network_id,
+                                     'tenant_id' : tenant_id,
+                                     'cidr' : cidr,
+                                     'ip_version' : 4,
+                                     'gateway_ip' : gateway_ip,
+                                     'allocation_pools' : allocation_pools})
+
+    def list_ports(self, **filters):
+        return self._network_list('ports', filters)
+
+    def create_port(self, network_id, tenant_id, fixed_ips):
+        return self._network_create('port', {'network_id' : network_id,
+                                             'tenant_id' : tenant_id,
+                                             'fixed_ips' : fixed_ips})
+
+    def delete_port(self, port_id):
+        self._network_delete('port', port_id)
+
+    def list_routers(self, **filters):
+        return self._network_list('routers', filters)
+
+    def create_router(self, name, tenant_id):
+        return self._network_create('router', {'name' : name,
+                                               'tenant_id' : tenant_id})
+
+    def delete_router(self, router_id):
+        self._network_delete('router', router_id)
+
+    def add_router_interface(self, router_id, subnet_id):
+        return self.request('network', 'PUT',
+                            '/v2.0/routers/%s/add_router_interface' % \
+                                router_id, {'subnet_id' : subnet_id})
+
+    def remove_router_interface(self, router_id, subnet_id):
+        return self.request('network', 'PUT',
+                            '/v2.0/routers/%s/remove_router_interface' % \
+                                router_id, {'subnet_id' : subnet_id})
+
+    def list_floatingips(self, **filters):
+        return self._network_list('floatingips', filters)
+
+    def create_floatingip(self, external_network_id, tenant_id):
+        return self._network_create('floatingip',
+                                    {'floating_network_id' : \
+                                         external_network_id,
+                                     'tenant_id' : tenant_id})
+
+    def associate_floatingip(self, floatingip_id, port_id):
+        return self.request('network', 'PUT',
+                            '/v2.0/floatingips/%s' % floatingip_id,
+                            {'floatingip' : {'port_id' : port_id}})
+
+    def delete_floatingip(self, floatingip_id):
+        self._network_delete('floatingip', floatingip_id)
+
+    ######## Image (Glance v1 API)
+
+    def list_glance_images(self):
+        return self.request('image', 'GET', '/v1/images/detail')['images']
+
+
+def _query_string(params):
+    if not params:
+        return ''
+    return '?' + urllib.urlencode(sorted(params.items()))
+
+
+def _parse_expiry(expires):
+    """
+        Keystone reports token expiry as e.g. 2013-06-04T15:03:41Z.
+        Returns seconds since the epoch (now + 1 hour if unparseable).
+    """
+    try:
+        return calendar.timegm(time.strptime(expires[:19],
+                                             '%Y-%m-%dT%H:%M:%S'))
+    except Exception:
+        return time.time() + 3600
+
+
+# One pool and one client (token) per set of credentials, shared by all
+# threads of the aggregate manager
+_connection_pool = None
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(username=None, password=None, tenant_name=None):
+    """
+        Return the (shared) client for the given credentials.  The
+        credentials default to the GRAM admin account in config.
+    """
+    global _connection_pool
+    if username is None:
+        username = config.os_username
+        password = config.os_password
+        tenant_name = config.os_tenant_name
+    key = (username, password, tenant_name)
+    _clients_lock.acquire()
+    try:
+        if _connection_pool is None:
+            _connection_pool = \
+                HTTPConnectionPool(config.openstack_api_pool_size,
+                                   config.openstack_api_timeout)
+        if key not in _clients:
+            _clients[key] = OpenStackRESTClient(config.os_auth_url,
+                                                username, password,
+                                                tenant_name,
+                                                config.os_region_name,
+                                                _connection_pool)
+        return _clients[key]
+    finally:
+        _clients_lock.release()
+
+
+if __name__ == "__main__":
+    # Exercise the client against an OpenStack installation (or
+    # open_stack_fake_server.py) given an auth URL, e.g.
+    #    python open_stack_rest.py http://localhost:5000/v2.0 admin pwd admin
+    import sys
+    import logging
+    logging.basicConfig()
+    if len(sys.argv) < 5:
+        print "Usage: open_stack_rest.py auth_url username password tenant"
+        sys.exit(1)
+    pool = HTTPConnectionPool(4, 30)
+    client = OpenStackRESTClient(sys.argv[1], sys.argv[2], sys.argv[3],
+                                 sys.argv[4], None, pool)
+    print "HYPERVISORS = %s" % client.list_hypervisors()
+    print "HOSTS = %s" % client.list_hosts()
+    print "TENANTS = %s" % client.list_tenants()
+    print "NETWORKS = %s" % client.list_networks()
+    print "SERVERS = %s" % client.list_servers(all_tenants=True)
@@ -0,0 +1,192 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Reconcile the restored state of the aggregate with OpenStack.
+#
+# At startup, each slice restored from a snapshot is checked against the
+# OpenStack objects of its tenant.  A slice whose tenant no longer exists,
+# or whose VMs, networks, subnets, router or admin user differ from those
+# of its tenant, is deleted from GRAM and OpenStack.  The OpenStack objects
+# of all tenants are listed once (open_stack_interface.get_all_tenant_info)
+# and the slices are checked against that listing one at a time.  A slice
+# is not deleted if the listing of its tenant may be incomplete.
+#
+# Run in the background (Reconciler.start), the aggregate manager serves
+# requests while the slices are checked: the slices not yet checked are
+# fenced off by holding their locks, and each is released as soon as it
+# has been checked.  Slices created in the meantime aren't affected.
+
+import threading
+import time
+
+import config
+import open_stack_interface
+
+
+def get_slice_info(slice_object) :
+    """
+        Returns the UUIDs of the OpenStack objects of a slice as GRAM
+        knows them: {'vm_uuids', 'net_uuids', 'subnet_uuids', 
+        'router_uuids', 'user_uuids'}
+    """
+    tenant_admin_name, tenant_admin_pwd, tenant_admin_uuid = \
+        slice_object.getTenantAdminInfo()
+    slice_info = {'router_uuids' : [slice_object.getTenantRouterUUID()],
+                  'user_uuids' : [tenant_admin_uuid],
+                  'net_uuids' : [], 'subnet_uuids' : [], 'vm_uuids' : []}
+    for network_link in slice_object.getNetworkLinks() :
+        net_uuid = network_link.getNetworkUUID()
+        if net_uuid not in slice_info['net_uuids'] :
+            slice_info['net_uuids'].append(net_uuid)
+        subnet_uuid = network_link.getSubnetUUID()
+        if subnet_uuid not in slice_info['subnet_uuids'] :
+            slice_info['subnet_uuids'].append(subnet_uuid)
+    for vm in slice_object.getVMs() :
+        slice_info['vm_uuids'].append(vm.getUUID())
+    return slice_info
+
+
+def is_consistent(slice_info, tenant_info) :
+    """
+        Does OpenStack have exactly the objects GRAM has for a slice?
+        tenant_info is the entry for the slice's tenant in the result of
+        get_all_tenant_info (None if there's no such tenant).
+    """
+    if tenant_info is None : return False
+    for key, gram_uuids in slice_info.items() :
+        if key not in tenant_info : return False
+        if sorted(gram_uuids) != sorted(tenant_info[key]) : return False
+    return True
+
+
+class Reconciler :
+
+    def __init__(self, slice_objects, delete_slice) :
+        # delete_slice(slice_object) deletes a slice from GRAM and OpenStack
+        self._slice_objects = list(slice_objects)
+        self._delete_slice = delete_slice
+        self._fenced = threading.Event()
+        self._unverified = set() # URNs of the slices not yet checked
+        self._deleted = [] # URNs of the slices deleted
+        self._phases = [] # (phase name, seconds) in order
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self) :
+        """
+            Reconcile in a background thread.  Returns once the slices to
+            be checked are fenced off.
+        """
+        self._thread = threading.Thread(target=self.run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        self._fenced.wait()
+
+    def run(self) :
+        """
+            Reconcile in this thread
+        """
+        start_time = time.time()
+        for slice_object in self._slice_objects :
+            slice_object.getLock().acquire()
+            slice_object.getWriteLock().acquire()
+            self._unverified.add(slice_object.getSliceURN())
+        self._fenced.set()
+        try :
+            self._reconcile()
+        finally :
+            for slice_object in self._slice_objects :
+                if slice_object.getSliceURN() in self._unverified :
+                    self._unfence(slice_object)
+        self._record_phase('reconcile (total)', start_time)
+        config.logger.info("Reconciled %d slices with OpenStack (%d deleted): %s" % \
+                               (len(self._slice_objects), len(self._deleted),
+                                ", ".join(["%s %.2f sec" % phase \
+                                               for phase in self._phases])))
+
+    def _reconcile(self) :
+        if len(self._slice_objects) == 0 : return
+        start_time = time.time()
+        try :
+            os_info = open_stack_interface.get_all_tenant_info()
+        except Exception, e :
+            config.logger.error("Failed to list OpenStack objects; not reconciling: %s" % e)
+            return
+        self._record_phase('list OpenStack objects', start_time)
+
+        start_time = time.time()
+        for slice_object in self._slice_objects :
+            slice_urn = slice_object.getSliceURN()
+            write_locked = True
+            try :
+                slice_info = get_slice_info(slice_object)
+                tenant_info = os_info.get(slice_object.getTenantUUID())
+                if is_consistent(slice_info, tenant_info) :
+                    pass
+                elif tenant_info is not None and \
+                        tenant_info.get('incomplete') :
+                    config.logger.warning("OpenStack may not have listed all the VMs of slice %s (tenant %s): not deleting it" % \
+                                              (slice_urn,
+                                               slice_object.getTenantUUID()))
+                else :
+                    config.logger.info("OpenStack and GRAM-internal representations of slice %s (tenant %s) are inconsistent: deleting from OpenStack and GRAM" % \
+                                           (slice_urn, 
+                                            slice_object.getTenantUUID()))
+                    # The teardown tasks update the slice holding its
+                    # state lock: it stays fenced by its slice lock only
+                    slice_object.getWriteLock().release()
+                    write_locked = False
+                    self._delete_slice(slice_object)
+                    self._deleted.append(slice_urn)
+            except Exception, e :
+                config.logger.error("Failed to reconcile slice %s: %s" % \
+                                        (slice_urn, e))
+            self._unfence(slice_object, write_locked)
+        self._record_phase('check slices', start_time)
+
+    def _unfence(self, slice_object, write_locked=True) :
+        self._lock.acquire()
+        try :
+            self._unverified.discard(slice_object.getSliceURN())
+        finally :
+            self._lock.release()
+        if write_locked :
+            slice_object.getWriteLock().release()
+        slice_object.getLock().release()
+
+    def _record_phase(self, name, start_time) :
+        self._lock.acquire()
+        try :
+            self._phases.append((name, time.time() - start_time))
+        finally :
+            self._lock.release()
+
+    def getStatistics(self) :
+        self._lock.acquire()
+        try :
+            return {'slices' : len(self._slice_objects),
+                    'unverified' : len(self._unverified),
+                    'deleted' : list(self._deleted),
+                    'phases' : list(self._phases)}
+        finally :
+            self._lock.release()
@@ -26,6 +26,7 @@
 
 import datetime
 import dateutil.parser
+import hashlib
 import inspect
 import uuid
 import threading
@@ -34,7 +35,12 @@ import subprocess
 
 import config
 import constants
+import inventory_cache
 import open_stack_interface
+import open_stack_output
+import rw_lock
+
+from xml.dom.minidom import parseString
 
 # Helper function for generating field-by-field image 
 # for resources
@@ -66,42 +72,62 @@ def resource_image(obj, label):
 
 
 # Holds information about GRAM images, based on nova calls
+# The image, flavor and compute host listings are kept in the shared
+# inventory cache, which fetches them again when they expire
+# (config.inventory_cache_ttls) or are invalidated
 class GramImageInfo :
-  _image_list = None
-  _flavor_list = None
-  _last_update = None
-  _compute_hosts = None
+
+  # Image and flavor lists are kept as open_stack_output.OutputTable's
+  # with (at least) 'ID' and 'Name' columns, as 'nova image-list' and
+  # 'nova flavor-list' print them
+  @staticmethod
+  def fetch_image_list():
+      client = open_stack_interface._getRESTClient()
+      if client :
+          images = [{'ID' : image['id'], 'Name' : image['name'],
+                     'Status' : image.get('status')} \
+                        for image in client.list_images()]
+          return open_stack_output.OutputTable(['ID', 'Name', 'Status'],
+                                               images)
+      return open_stack_output.parse_list(_execCommand('nova image-list'))
+
+  @staticmethod
+  def fetch_flavor_list():
+      client = open_stack_interface._getRESTClient()
+      if client :
+          flavors = [{'ID' : flavor['id'], 'Name' : flavor['name']} \
+                         for flavor in client.list_flavors()]
+          return open_stack_output.OutputTable(['ID', 'Name'], flavors)
+      return open_stack_output.parse_list(_execCommand('nova flavor-list'))
 
   @staticmethod
   def refresh():
-      if not GramImageInfo._compute_hosts:
-          GramImageInfo._compute_hosts = open_stack_interface._listHosts('compute')
+      inventory_cache.inventory.invalidate('images')
+      inventory_cache.inventory.invalidate('flavors')
 
-      cmd = 'nova image-list'
+  @staticmethod
+  def get_image_list():
       try :
-          GramImageInfo._image_list = _execCommand(cmd)
-          GramImageInfo._last_update = datetime.datetime.utcnow()
+          return inventory_cache.inventory.get('images')
       except :
           config.logger.error('Failed to execute "nova image-list"')
-      cmd = 'nova flavor-list'
-      try:
-          GramImageInfo._flavor_list = _execCommand(cmd)
-      except:
-          config.logger.error('Failed to execute "nova flavor-list"')
+          return None
 
   @staticmethod
-  def get_image_list():
-      now = datetime.datetime.utcnow()
-      if not GramImageInfo._last_update or (now - GramImageInfo._last_update).seconds > 6000:
-          GramImageInfo.refresh()
-      return GramImageInfo._image_list
+  def get_flavor_list():
+      try :
+          return inventory_cache.inventory.get('flavors')
+      except :
+          config.logger.error('Failed to execute "nova flavor-list"')
+          return None
 
+  # Dictionary of compute host name => list of services
   @staticmethod
-  def get_flavor_list():
-      now = datetime.datetime.utcnow()
-      if not GramImageInfo._last_update or (now - GramImageInfo._last_update).seconds > 6000:
-        GramImageInfo.refresh()
-      return GramImageInfo._flavor_list
+  def get_compute_hosts():
+      return open_stack_interface._listHosts('compute')
+
+inventory_cache.inventory.register('images', GramImageInfo.fetch_image_list)
+inventory_cache.inventory.register('flavors', GramImageInfo.fetch_flavor_list)
 
     
 # Holds information about the GRAM management network (used for aggregate
@@ -118,11 +144,82 @@ class GramManagementNetwork :
       return GramManagementNetwork._mgmt_net_uuid
 
 
+# Maps the URNs of the slivers of all slices at this aggregate to their
+# slice and sliver objects.  Kept up to date by Slice.addSliver and 
+# Slice.removeSliver, and reset when the slices are restored from a snapshot.
+class SliverURNtoSliceObject :
+   _slivers = {} # (Slice, sliver) indexed by sliver URN
+   _lock = threading.Lock()
+
+   @staticmethod
+   def get_slice_object(sliver_urn) :
+      """
+          Returns the Slice object that has the sliver with the given URN
+      """
+      return SliverURNtoSliceObject.get_sliver_object(sliver_urn)[0]
+
+   @staticmethod
+   def get_sliver_object(sliver_urn) :
+      """
+          Returns the Slice and sliver objects of the sliver with the 
+          given URN ((None, None) if there is no such sliver)
+      """
+      with SliverURNtoSliceObject._lock :
+         return SliverURNtoSliceObject._slivers.get(sliver_urn, (None, None))
+
+   @staticmethod
+   def get_sliver_objects() :
+      """
+          Returns a list of the (Slice, sliver) of all slivers at this 
+          aggregate
+      """
+      with SliverURNtoSliceObject._lock :
+         return SliverURNtoSliceObject._slivers.values()
+
+   @staticmethod
+   def set_sliver_object(sliver_urn, slice_object, sliver_object) :
+      with SliverURNtoSliceObject._lock :
+         SliverURNtoSliceObject._slivers[sliver_urn] = \
+             (slice_object, sliver_object)
+
+   @staticmethod
+   def remove_sliver_object(sliver_urn, slice_object) :
+      with SliverURNtoSliceObject._lock :
+         entry = SliverURNtoSliceObject._slivers.get(sliver_urn)
+         if entry is not None and entry[0] is slice_object :
+            del SliverURNtoSliceObject._slivers[sliver_urn]
+
+   @staticmethod
+   def set_slice_objects(slice_objects) :
+      """
+          Index the slivers of the given slices (e.g. restored from a 
+          snapshot) in place of those indexed so far
+      """
+      slivers = {}
+      for slice_object in slice_objects :
+         for sliver_urn, sliver_object in \
+                slice_object.getAllSlivers().items() :
+            slivers[sliver_urn] = (slice_object, sliver_object)
+      with SliverURNtoSliceObject._lock :
+         SliverURNtoSliceObject._slivers = slivers
+
+
 # A slice that has been allocated.
+#
+# Two locks control access to a slice and its slivers.  The slice lock
+# (getLock) serializes the AM API calls that change the slice (allocate,
+# provision, delete, renew) and is held while they make their OpenStack
+# calls.  The state lock (getReadLock/getWriteLock) protects the in-memory
+# state: it is held for writing only briefly, while slivers are added or
+# removed or their states changed, so Status and Describe (which hold it
+# for reading, and for writing only while they set the VM states they got
+# from OpenStack) don't wait for the OpenStack calls of a Provision or
+# Delete.
 class Slice:
    def __init__(self, slice_urn) :
       self._slice_urn = slice_urn
-      self._slice_lock = threading.RLock() # Control access to Slice and Slivers
+      self._slice_lock = threading.RLock() # Serialize changes to the slice
+      self._state_lock = rw_lock.ReadWriteLock() # In-memory Slice and Slivers
       self._tenant_name = None    # OpenStack tenant name
       self._tenant_uuid = None    # OpenStack tenant uuid
       self._tenant_admin_name = None # Admin user for this tenant
@@ -133,12 +230,18 @@ class Slice:
       self._router_uuid = None    # UUID of router for this tenant (slice)
       self._user_urn = None
       self._expiration = None
-      self._request_rspec = None  # Most recent request rspec (may be > 1)
-      self._manifest_rspec = None   ## TEMP: We should not be saving manifests
+      self._request_rspec_id = None  # Most recent request rspec (may be > 1)
+      self._manifest_rspec_id = None   ## TEMP: We should not be saving manifests
+      self._rspecs = {} # Rspecs of the slice and its slivers by rspec ID
+      self._rspec_references = {} # Number of references to each rspec ID
+      self._rspec_doms = {} # Parsed rspecs by rspec ID
+      self._rspec_lock = threading.Lock()
+      self._manifest_cache = None # rspec_handler.ManifestCache
       self._slivers = {} # Map of sliverURNs to slivers
       self._VMs = []    # VirtualMachines that belong to this slice
       self._NICs = []   # NetworkInterfaces that belong to this slice
       self._links = []  # NetworkLinks that belong to this slice
+      self._slivers_by_name = {} # (sliver class name, name) => [slivers]
       self._last_subnet_assigned = 2 # If value is x then the last subnet
                                      # address assinged to a link in the slice
                                      # was 10.0.x.0/24.  Starts with 2 since
@@ -156,14 +259,26 @@ class Slice:
    def getLock(self) :
       return self._slice_lock
 
+   def getReadLock(self) :
+      return self._state_lock.reader
+
+   def getWriteLock(self) :
+      return self._state_lock.writer
+
    # Called by slivers to add themselves to the slice
    def addSliver(self, sliver) :
+      with self._state_lock.writer :
+         return self._addSliver(sliver)
+
+   def _addSliver(self, sliver) :
       sliver_urn = sliver.getSliverURN()
       if sliver_urn != None :
          self._slivers[sliver_urn] = sliver
+         SliverURNtoSliceObject.set_sliver_object(sliver_urn, self, sliver)
       else :
          config.logger.error('Adding sliver to slice; sliver does not have a URN')
 
+      self._indexSliverName(sliver, sliver.getName())
       if sliver.__class__.__name__ == 'VirtualMachine' :
          self._VMs.append(sliver)
          return True
@@ -178,23 +293,60 @@ class Slice:
          return False
 
    def removeSliver(self, sliver) :
+      with self._state_lock.writer :
+         self._removeSliver(sliver)
+
+   def _removeSliver(self, sliver) :
       sliver_urn = sliver.getSliverURN()
       config.logger.info("Deleting sliver: " + sliver_urn) 
       # Remove sliver from list of slivers
       if sliver_urn in self._slivers :
          del self._slivers[sliver_urn]
+         SliverURNtoSliceObject.remove_sliver_object(sliver_urn, self)
+         sliver.releaseRspecs()
+      # And from the index of slivers by name
+      self._unindexSliverName(sliver, sliver.getName())
 
       # Remove sliver from appropriate list based on sliver type
       if sliver.__class__.__name__ == 'VirtualMachine' :
          # First remove from the slice all NICs associated with this VM
          for nic in sliver.getNetworkInterfaces() :
-            self.removeSliver(nic)
+            self._removeSliver(nic)
          self._VMs.remove(sliver)
       elif sliver.__class__.__name__ == 'NetworkInterface' :
          self._NICs.remove(sliver)
       elif sliver.__class__.__name__ == 'NetworkLink' :
          self._links.remove(sliver)
          
+   # Called by slivers when their name changes
+   def renameSliver(self, sliver, old_name) :
+      with self._state_lock.writer :
+         self._unindexSliverName(sliver, old_name)
+         self._indexSliverName(sliver, sliver.getName())
+
+   def _indexSliverName(self, sliver, name) :
+      if name is None :
+         return
+      key = (sliver.__class__.__name__, name)
+      slivers = self._slivers_by_name.setdefault(key, [])
+      if sliver not in slivers :
+         slivers.append(sliver)
+
+   def _unindexSliverName(self, sliver, name) :
+      key = (sliver.__class__.__name__, name)
+      slivers = self._slivers_by_name.get(key)
+      if slivers and sliver in slivers :
+         slivers.remove(sliver)
+         if len(slivers) == 0 :
+            del self._slivers_by_name[key]
+
+   # Return the (first) sliver of the given class with the given name
+   def _getSliverByName(self, class_name, name) :
+      slivers = self._slivers_by_name.get((class_name, name))
+      if slivers :
+         return slivers[0]
+      return None
+
    def setTenantUUID(self, tenant_id ): 
       self._tenant_uuid = tenant_id
 
@@ -235,10 +387,13 @@ class Slice:
       return self._router_uuid
 
    def getNetworkInterfaceByName(self, name) :
-      for i in range(len(self._NICs)) :
-         if self._NICs[i].getName() == name :
-            return self._NICs[i]
-      return None
+      return self._getSliverByName('NetworkInterface', name)
+
+   def getVMByName(self, name) :
+      return self._getSliverByName('VirtualMachine', name)
+
+   def getNetworkLinkByName(self, name) :
+      return self._getSliverByName('NetworkLink', name)
 
    def getNetworkLinks(self) :
       return self._links
@@ -317,19 +472,108 @@ class Slice:
       return self._expiration
 
    def setManifestRspec(self, manifest) :
-      self._manifest_rspec = manifest
+      manifest_rspec_id = self.storeRspec(manifest)
+      self.releaseRspec(self._manifest_rspec_id)
+      self._manifest_rspec_id = manifest_rspec_id
 
    def getManifestRspec(self) : 
-      return self._manifest_rspec
+      return self.getStoredRspec(self._manifest_rspec_id)
+
+   def getManifestRspecId(self) :
+      return self._manifest_rspec_id
 
    def setExpiration(self, expiration): # Set expiration of slice
       self._expiration = expiration;
 
    def setRequestRspec(self, rspec) :
-      self._request_rspec = rspec
+      request_rspec_id = self.storeRspec(rspec)
+      self.releaseRspec(self._request_rspec_id)
+      self._request_rspec_id = request_rspec_id
       
    def getRequestRspec(self) :
-      return self._request_rspec
+      return self.getStoredRspec(self._request_rspec_id)
+
+   def getRequestRspecId(self) :
+      return self._request_rspec_id
+
+   def getRequestRspecDOM(self) :
+      return self.getRspecDOM(self._request_rspec_id)
+
+   def getManifestCache(self) :
+      return self._manifest_cache
+
+   def setManifestCache(self, manifest_cache) :
+      self._manifest_cache = manifest_cache
+
+   # The slice and its slivers share one copy of each distinct rspec,
+   # identified by the SHA-1 digest of its text and kept as long as
+   # something refers to it
+   def storeRspec(self, rspec) :
+      """
+          Add a reference to the given rspec to the slice's rspec store.
+          Returns the ID of the rspec (None if rspec is None).
+      """
+      if rspec is None :
+         return None
+      data = rspec
+      if isinstance(data, unicode) :
+         data = data.encode('utf-8')
+      rspec_id = hashlib.sha1(data).hexdigest()
+      with self._rspec_lock :
+         if rspec_id not in self._rspecs :
+            self._rspecs[rspec_id] = rspec
+            self._rspec_references[rspec_id] = 0
+         self._rspec_references[rspec_id] += 1
+      return rspec_id
+
+   def releaseRspec(self, rspec_id) :
+      """
+          Drop a reference to the given rspec.  The rspec is removed from
+          the store once nothing refers to it.
+      """
+      if rspec_id is None :
+         return
+      with self._rspec_lock :
+         if rspec_id not in self._rspec_references :
+            return
+         self._rspec_references[rspec_id] -= 1
+         if self._rspec_references[rspec_id] == 0 :
+            del self._rspec_references[rspec_id]
+            del self._rspecs[rspec_id]
+            if rspec_id in self._rspec_doms :
+               del self._rspec_doms[rspec_id]
+
+   def getStoredRspec(self, rspec_id) :
+      if rspec_id is None :
+         return None
+      with self._rspec_lock :
+         return self._rspecs.get(rspec_id)
+
+   def getRspecDOM(self, rspec_id) :
+      """
+          Returns the parsed DOM of the given rspec, parsing it only the
+          first time.  The DOM is shared: callers must not modify it.
+      """
+      rspec = self.getStoredRspec(rspec_id)
+      if rspec is None :
+         return None
+      with self._rspec_lock :
+         if rspec_id in self._rspec_doms :
+            return self._rspec_doms[rspec_id]
+      if isinstance(rspec, unicode) :
+         rspec = rspec.encode('utf-8')
+      dom = parseString(rspec)
+      with self._rspec_lock :
+         if rspec_id in self._rspecs :
+            self._rspec_doms[rspec_id] = dom
+      return dom
+
+   def getRspecs(self) :
+      """
+          Returns {rspec ID => rspec} of the rspecs in the store
+      """
+      with self._rspec_lock :
+         return dict(self._rspecs)
       
 
 # Base class for resource slivers
@@ -345,8 +589,9 @@ class Sliver():
       now = datetime.datetime.utcnow()
       self._creation = now # Sliver creation time
       self._name = None    # Experimenter specified name of the sliver
-      self._request_rspec = None # Rspec provided at allocation time
-      self._manifest_rspec = None # Rspec of current resource state
+      self._request_rspec_id = None # Rspec provided at allocation time
+      self._manifest_rspec_id = None # Rspec of current resource state
+      # (both kept in the slice's rspec store)
       self._allocation_state = constants.allocated  # API v3 allocation state
       self._operational_state = constants.notready  # Operational state
       self._user_urn = None
@@ -374,7 +619,9 @@ class Sliver():
       return self._component_name
 
    def setName(self, name) :
+      old_name = self._name
       self._name = name
+      self._slice.renameSliver(self, old_name)
 
    def getName(self) :
       return self._name
@@ -422,16 +669,38 @@ class Sliver():
       self._user_urn = user_urn
 
    def setRequestRspec(self, rspec) :
-      self._request_rspec = rspec
+      request_rspec_id = self._slice.storeRspec(rspec)
+      self._slice.releaseRspec(self._request_rspec_id)
+      self._request_rspec_id = request_rspec_id
       
    def getRequestRspec(self) :
-      return self._request_rspec
+      return self._slice.getStoredRspec(self._request_rspec_id)
+
+   def getRequestRspecId(self) :
+      return self._request_rspec_id
+
+   def getRequestRspecDOM(self) :
+      return self._slice.getRspecDOM(self._request_rspec_id)
       
    def setManifestRspec(self, rspec) :
-      self._manifest_rspec = rspec
+      manifest_rspec_id = self._slice.storeRspec(rspec)
+      self._slice.releaseRspec(self._manifest_rspec_id)
+      self._manifest_rspec_id = manifest_rspec_id
       
    def getManifestRspec(self) :
-      return self._manifest_rspec
+      return self._slice.getStoredRspec(self._manifest_rspec_id)
+
+   def getManifestRspecId(self) :
+      return self._manifest_rspec_id
+
+   def releaseRspecs(self) :
+      """
+          Drop this sliver's references to rspecs in the slice's store
+      """
+      self._slice.releaseRspec(self._request_rspec_id)
+      self._slice.releaseRspec(self._manifest_rspec_id)
+      self._request_rspec_id = None
+      self._manifest_rspec_id = None
       
    def status(self, geni_error=''):
         """Returns a status dict for this sliver. Used in numerous        
@@ -24,6 +24,8 @@
 from xml.dom.minidom import *
 import socket
 import re
+import threading
+from StringIO import StringIO
 
 import config
 import constants
@@ -32,6 +34,7 @@ from resources import GramImageInfo, Slice, VirtualMachine, NetworkInterface, Ne
 import uuid
 import utils
 import netaddr
+import rspec_parser
 import stitching
 
 def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
@@ -52,32 +55,31 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
     sliver_list = []
     controller_link_info = {}
         
-    # Parse the xml rspec
-    rspec_dom = parseString(rspec)
+    # Parse the xml rspec (or use the recent parse of it)
+    request = rspec_parser.parse(rspec)
 
     # Look for DOM elements tagged 'node'.  These are the VMs requested by the
     # experimenter.
     # For each node in the rspec, extract experimenter specified information
-    node_list = rspec_dom.getElementsByTagName('node')
+    node_list = request.getNodes()
+    compute_hosts = set(GramImageInfo.get_compute_hosts().keys())
     for node in node_list :
         # Get information about the node from the rspec
-        node_attributes = node.attributes
+        node_attributes = node.attrib
 
 
         # Find the name of the node.  We need to make sure we don't already
         # have a node with this name before we do anything else.
         if node_attributes.has_key('client_id') :
-            node_name = node_attributes['client_id'].value
-            list_of_existing_vms = geni_slice.getVMs()
-            for i in range(0, len(list_of_existing_vms)) :
-                if node_name == list_of_existing_vms[i].getName() :
-                    # Duplicate name.  Fail this allocate
-                    error_string = \
-                        'Rspec error: VM with name %s already exists' % \
-                        node_name
-                    error_code = constants.REQUEST_PARSE_FAILED
-                    config.logger.error(error_string)
-                    return error_string, error_code, sliver_list, None
+            node_name = node_attributes['client_id']
+            if geni_slice.getVMByName(node_name) is not None :
+                # Duplicate name.  Fail this allocate
+                error_string = \
+                    'Rspec error: VM with name %s already exists' % \
+                    node_name
+                error_code = constants.REQUEST_PARSE_FAILED
+                config.logger.error(error_string)
+                return error_string, error_code, sliver_list, None
         else :
             error_string = 'Malformed rspec: Node name not specified' 
             error_code = constants.REQUEST_PARSE_FAILED
@@ -87,7 +89,7 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
         # If the node is already bound (component_manager_id is set)
         # Ignore the node if it isn't bound to my component_manager_id
         if node_attributes.has_key('component_manager_id'):
-            cmi = node_attributes['component_manager_id'].value
+            cmi = node_attributes['component_manager_id']
             if cmi  != agg_urn:
                 print "Ignoring remote node : %s" % cmi
                 continue
@@ -99,9 +101,8 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
         sliver_list.append(vm_object)
 
         # Check for component_id
-        compute_hosts = GramImageInfo._compute_hosts.keys()
         if node_attributes.has_key('component_id'):
-          ci = getHostFromUrn(node_attributes['component_id'].value)
+          ci = getHostFromUrn(node_attributes['component_id'])
           if ci:
             if ci.lower() not in compute_hosts:
                 error_string = "Invalid value for component_id"
@@ -112,7 +113,7 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
 
         # Check for component_name
         if node_attributes.has_key('component_name'):
-            cn = node_attributes['component_id'].value
+            cn = node_attributes['component_id']
             if cn.lower() not in compute_hosts:
                 error_string = "Invalid value for component_name"
                 error_code = constants.UNSUPPORTED
@@ -122,7 +123,7 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
 
         # Make sure there isn't an exclusive="true" clause in the node 
         if node_attributes.has_key("exclusive"):
-            value = node_attributes["exclusive"].value
+            value = node_attributes["exclusive"]
             if value.lower() == 'true':
                 error_string = "GRAM instance can't allocate exclusive compute resources"
                 error_code = constants.UNSUPPORTED
@@ -130,21 +131,20 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
                 return error_string, error_code, sliver_list, None
 
         if node_attributes.has_key("external_ip"):
-            value = node_attributes["external_ip"].value
+            value = node_attributes["external_ip"]
             if value.lower() == 'true':
                 vm_object.setExternalIp('true')
     
-        found = node.getElementsByTagName('emulab:routable_control_ip') +\
-            node.getElementsByTagName('routable_control_ip')
+        found = rspec_parser.findAll(node, 'routable_control_ip')
         if found:
             vm_object.setExternalIp('true')
 
 
         # Get flavor from the sliver_type
-        sliver_type_list = node.getElementsByTagName('sliver_type')
+        sliver_type_list = rspec_parser.findAll(node, 'sliver_type')
         for sliver_type in sliver_type_list:
-            if sliver_type.attributes.has_key('name') :
-                sliver_type_name = sliver_type.attributes['name'].value
+            if sliver_type.attrib.has_key('name') :
+                sliver_type_name = sliver_type.attrib['name']
             else :
                 sliver_type_name = config.default_VM_flavor
             if open_stack_interface._getFlavorID(sliver_type_name):
@@ -159,18 +159,18 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
                 return error_string, error_code, sliver_list, None
 
             # Get disk image by name from node
-            disk_image_list = sliver_type.getElementsByTagName('disk_image')
+            disk_image_list = rspec_parser.findAll(sliver_type, 'disk_image')
             for disk_image in disk_image_list:
-                if disk_image.attributes.has_key('name') :
-                    disk_image_name = disk_image.attributes['name'].value
+                if disk_image.attrib.has_key('name') :
+                    disk_image_name = disk_image.attrib['name']
                 else :
                     disk_image_name = config.default_OS_image
-                if disk_image.attributes.has_key('os'):
-                    os_type = disk_image.attributes['os'].value
+                if disk_image.attrib.has_key('os'):
+                    os_type = disk_image.attrib['os']
                 else:
                     os_type = config.default_OS_type
-                if disk_image.attributes.has_key('version'):
-                    os_version = disk_image.attributes['version'].value
+                if disk_image.attrib.has_key('version'):
+                    os_version = disk_image.attrib['version']
                 else:
                     os_version = config.default_OS_version
                 disk_image_uuid = \
@@ -190,7 +190,7 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
 
         
         # Get interfaces associated with the node
-        interface_list = node.getElementsByTagName('interface')
+        interface_list = rspec_parser.findAll(node, 'interface')
         for interface in interface_list :
             # Create a NetworkInterface object this interface and associate
             # it with the VirtualMachine object for the node
@@ -198,34 +198,34 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
             vm_object.addNetworkInterface(interface_object)
             
             # Get information about this network interface from rspec
-            interface_attributes = interface.attributes
+            interface_attributes = interface.attrib
             if interface_attributes.has_key('client_id') :
-                interface_object.setName(interface_attributes['client_id'].value)
+                interface_object.setName(interface_attributes['client_id'])
             else :
                 error_string = 'Malformed rspec: Interface name not specified'
                 error_code = constants.REQUEST_PARSE_FAILED
                 config.logger.error(error_string)
                 return error_string, error_code, sliver_list, None
-            ip_list = interface.getElementsByTagName('ip')
+            ip_list = rspec_parser.findAll(interface, 'ip')
             if len(ip_list) > 1:
                 error_string = 'Malformed rspec: Interface can have only one ip'
                 error_code = constants.REQUEST_PARSE_FAILED
                 config.logger.error(error_string)
                 return error_string, error_code, sliver_list, None
             for ip in ip_list:
-                if ip.attributes.has_key('address'):
-                    interface_object.setIPAddress(ip.attributes['address'].value)
-                if ip.attributes.has_key('netmask'):
-                    interface_object.setNetmask(ip.attributes['netmask'].value)
+                if ip.attrib.has_key('address'):
+                    interface_object.setIPAddress(ip.attrib['address'])
+                if ip.attrib.has_key('netmask'):
+                    interface_object.setNetmask(ip.attrib['netmask'])
                 
 
         # Get the list of services for this node (install and execute services)
-        service_list = node.getElementsByTagName('services')
+        service_list = rspec_parser.findAll(node, 'services')
         # First handle all the install items in the list of services requested
         for service in service_list :
-            install_list = service.getElementsByTagName('install')
+            install_list = rspec_parser.findAll(service, 'install')
             for install in install_list :
-                install_attributes = install.attributes
+                install_attributes = install.attrib
                 if not (install_attributes.has_key('url') and 
                         install_attributes.has_key('install_path')) :
                     error_string = 'Source URL or destination path missing for install element in request rspec'
@@ -233,10 +233,10 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
                     config.logger.error(error_string)
                     return error_string, error_code, sliver_list, None
 
-                source_url = install_attributes['url'].value
-                destination = install_attributes['install_path'].value
+                source_url = install_attributes['url']
+                destination = install_attributes['install_path']
                 if install_attributes.has_key('file_type') :
-                    file_type = install_attributes['file_type'].value
+                    file_type = install_attributes['file_type']
                 else :
                     file_type = None
                 vm_object.addInstallItem(source_url, destination, file_type)
@@ -245,18 +245,18 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
         
         # Next take care of the execute services requested
         for service in service_list :
-            execute_list = service.getElementsByTagName('execute')
+            execute_list = rspec_parser.findAll(service, 'execute')
             for execute in execute_list :
-                execute_attributes = execute.attributes
+                execute_attributes = execute.attrib
                 if not execute_attributes.has_key('command') :
                     error_string = 'Command missing for execute element in request rspec'
                     error_code = constants.REQUEST_PARSE_FAILED
                     config.logger.error(error_string)
                     return error_string, error_code, sliver_list, None
 
-                exec_command = execute_attributes['command'].value
+                exec_command = execute_attributes['command']
                 if execute_attributes.has_key('shell') :
-                    exec_shell = execute_attributes['shell'].value
+                    exec_shell = execute_attributes['shell']
                 else :
                     exec_shell = config.default_execute_shell
                 vm_object.addExecuteItem(exec_command, exec_shell)
@@ -266,29 +266,26 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
 
     # Done getting information about nodes in the rspec.  Now get information
     # about links.
-    link_list = [link for link in rspec_dom.getElementsByTagName('rspec')[0].childNodes if
-                 link.nodeName == 'link']
+    link_list = request.getLinks()
 
 
     for link in link_list :
 #        print 'link: ' + link.toxml()
         # Get information about this link from the rspec
-        link_attributes = link.attributes
+        link_attributes = link.attrib
 
         # Find the name of the link.  We need to make sure we don't already
         # have a link with this name before we do anything else.
         if link_attributes.has_key('client_id') :
-            link_name = link_attributes['client_id'].value
-            list_of_existing_links = geni_slice.getNetworkLinks()
-            for i in range(0, len(list_of_existing_links)) :
-                if link_name == list_of_existing_links[i].getName() :
-                    # Duplicate name.  Fail this allocate
-                    error_string = \
-                        'Rspec error: Link with name %s already exists' % \
-                        link_name
-                    error_code = constants.REQUEST_PARSE_FAILED
-                    config.logger.error(error_string)
-                    return error_string, error_code, sliver_list, None
+            link_name = link_attributes['client_id']
+            if geni_slice.getNetworkLinkByName(link_name) is not None :
+                # Duplicate name.  Fail this allocate
+                error_string = \
+                    'Rspec error: Link with name %s already exists' % \
+                    link_name
+                error_code = constants.REQUEST_PARSE_FAILED
+                config.logger.error(error_string)
+                return error_string, error_code, sliver_list, None
         else :
             error_string = 'Malformed rspec: Link name not specified'
             error_code = constants.REQUEST_PARSE_FAILED
@@ -301,29 +298,29 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
         sliver_list.append(link_object)
 
         # Check if a shared vlan is specified for the link
-        shared_vlan_tags = link.getElementsByTagName('sharedvlan:link_shared_vlan')
+        shared_vlan_tags = rspec_parser.findAll(link, 'link_shared_vlan')
         if len(shared_vlan_tags) == 1:
-            vlan_tag = int(shared_vlan_tags[0].attributes['name'].value)
+            vlan_tag = int(shared_vlan_tags[0].get('name'))
             link_object.setVLANTag(vlan_tag)
             config.logger.info("Using shared vlan: " + str(vlan_tag))
 
         # Gather OF Controller for this link (if any)
-        controllers = link.getElementsByTagName('openflow:controller')
+        controllers = rspec_parser.findAll(link, 'controller')
         if len(controllers) > 0:
             controller_node = controllers[0]
-            controller_url = controller_node.attributes['url'].value
+            controller_url = controller_node.attrib['url']
             controller_link_info[link_name] = controller_url
 
         # Get the end-points for this link.  Each end_point is a network
         # interface
-        end_points = link.getElementsByTagName('interface_ref')
+        end_points = rspec_parser.findAll(link, 'interface_ref')
         subnet = None
         for i in range(len(end_points)) :
-            end_point_attributes = end_points[i].attributes
+            end_point_attributes = end_points[i].attrib
             
             # get the name of the interface at this end_point
             if end_point_attributes.has_key('client_id') :
-                interface_name = end_point_attributes['client_id'].value
+                interface_name = end_point_attributes['client_id']
 
             # Find the NetworkInterface with this interface_name
             interface_object =  \
@@ -358,7 +355,7 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
 
     if stitching_handler:
         error_string, error_code, request_details =  \
-            stitching_handler.parseRequestRSpec(rspec_dom)
+            stitching_handler.parseRequestRSpec(request)
 
     return error_string, error_code, sliver_list, controller_link_info
 
@@ -367,64 +364,214 @@ def generateManifestForSlivers(geni_slice, geni_slivers, recompute, \
                                    allocate, 
                                    aggregate_urn,  \
                                    stitching_handler = None):
-    
-    err_code = constants.SUCCESS
-    err_output = None
-
-    # Clone the request and set the 'type' to 'manifest
-    request = geni_slice.getRequestRspec()
-    if request == None:
-        return None, constants.REQUEST_PARSE_FAILED, "Empty Request RSpec"
-
-    if isinstance(request, basestring): request = parseString(request)
-    manifest_doc = request.cloneNode(True)
-    config.logger.error("DOC = %s" % manifest_doc.toxml())
-    manifest = manifest_doc.getElementsByTagName('rspec')[0]
-    manifest.setAttribute('type', 'manifest')
-
-    # Change schema location from request.xsd to manifest.xsd
-    schema_location_tag = 'xsi:schemaLocation'
-    if manifest.attributes.has_key(schema_location_tag):
-        schema_location = manifest.attributes[schema_location_tag].value
-        revised_schema_location = \
-            schema_location.replace('request.xsd', 'manifest.xsd')
-        manifest.setAttribute(schema_location_tag, revised_schema_location)
-
-    root = Document()
-    
 
-    # For each sliver, find the corresponding manifest element
-    # and copy relevant information
-    for sliver in geni_slivers:
-        sliver_element  = None
-        client_id = sliver.getName()
-        sliver_id = sliver.getSliverURN()
-        for child in manifest.childNodes:
-            if (isinstance(sliver, NetworkLink) and child.nodeName == 'link')\
-                    or \
-                    (isinstance(sliver, VirtualMachine) and child.nodeName =='node'):
-                if child.attributes['client_id'].value == client_id:
-                    sliver_element = child
-                    break
-
-        if sliver_element:
-            
-            updateManifestForSliver(sliver, sliver_element, root, \
-                                    aggregate_urn)
-
-        if stitching_handler:
-            err_output, err_code = \
-                stitching_handler.updateManifestForSliver(manifest, sliver,
-                                                          allocate)
+    # The manifest is kept up to date from the (cached, parsed) request
+    # by the slice's manifest cache
+    request_rspec_id = geni_slice.getRequestRspecId()
+    manifest_cache = geni_slice.getManifestCache()
+    if manifest_cache is None or \
+            manifest_cache.getRequestRspecId() != request_rspec_id:
+        request = geni_slice.getRequestRspecDOM()
+        if request == None:
+            return None, constants.REQUEST_PARSE_FAILED, "Empty Request RSpec"
+        manifest_cache = ManifestCache(request_rspec_id, request)
+        geni_slice.setManifestCache(manifest_cache)
+
+    return manifest_cache.generate(geni_slivers, allocate, aggregate_urn,
+                                   stitching_handler)
+
+
+# The manifest of a slice, generated from a copy of its request rspec
+# (with the 'type' set to 'manifest').  For each child of the rspec
+# element, the cache keeps the state of the slivers it was last updated
+# for and its (pretty printed) text.  A child is copied from the request
+# again, updated and printed only when that state changes (see
+# getManifestState).  Node and link elements are found by their
+# client_id.
+class ManifestCache:
+
+    def __init__(self, request_rspec_id, request):
+        self._lock = threading.Lock()
+        self._request_rspec_id = request_rspec_id
+
+        # Clone the request and set the 'type' to 'manifest'
+        manifest_doc = request.cloneNode(True)
+        manifest = manifest_doc.getElementsByTagName('rspec')[0]
+        manifest.setAttribute('type', 'manifest')
+
+        # Change schema location from request.xsd to manifest.xsd
+        schema_location_tag = 'xsi:schemaLocation'
+        if manifest.attributes.has_key(schema_location_tag):
+            schema_location = manifest.attributes[schema_location_tag].value
+            revised_schema_location = \
+                schema_location.replace('request.xsd', 'manifest.xsd')
+            manifest.setAttribute(schema_location_tag, revised_schema_location)
+        self._manifest = manifest
+        self._root = Document()
+
+        # The children of the manifest, with the request's children they
+        # were copied from
+        self._request_children = \
+            list(request.getElementsByTagName('rspec')[0].childNodes)
+        self._children = list(manifest.childNodes)
+        self._states = [None] * len(self._children) # None: as in request
+        self._texts = [None] * len(self._children)
+
+        # (nodeName, client_id) => index of the (first) such node or link
+        self._elements = {}
+        # Index of the child holding the (first) stitching element
+        self._stitching_index = None
+        for index, child in enumerate(self._children):
+            if child.nodeType != Node.ELEMENT_NODE:
+                continue
+            if child.nodeName in ['node', 'link'] and \
+                    child.attributes.has_key('client_id'):
+                key = (child.nodeName, child.attributes['client_id'].value)
+                if key not in self._elements:
+                    self._elements[key] = index
+            if self._stitching_index is None and \
+                    (child.nodeName == 'stitching' or \
+                         len(child.getElementsByTagName('stitching')) > 0):
+                self._stitching_index = index
+
+        # The manifest's start and end tags (unless the manifest has no 
+        # elements; then it is printed whole)
+        self._print_whole = len(self._children) == 0 or \
+            (len(self._children) == 1 and \
+                 self._children[0].nodeType == Node.TEXT_NODE)
+        shell = manifest.cloneNode(False)
+        shell.appendChild(manifest_doc.createComment('children'))
+        lines = cleanLines(shell.toprettyxml(indent = '    '))
+        self._start_tag = lines[0]
+        self._end_tag = lines[-1]
+
+    def getRequestRspecId(self):
+        return self._request_rspec_id
+
+    def generate(self, geni_slivers, allocate, aggregate_urn, 
+                 stitching_handler = None):
+        """
+            Return manifest, error string, error code (see
+            generateManifestForSlivers)
+        """
+        # For each sliver, find the corresponding manifest element
+        slivers_by_index = {}
+        link_slivers = []
+        for sliver in geni_slivers:
+            if isinstance(sliver, NetworkLink):
+                key = ('link', sliver.getName())
+                link_slivers.append(sliver)
+            elif isinstance(sliver, VirtualMachine):
+                key = ('node', sliver.getName())
+            else:
+                continue
+            index = self._elements.get(key)
+            if index is not None:
+                slivers_by_index.setdefault(index, []).append(sliver)
+
+        self._lock.acquire()
+        try:
+            for index in range(len(self._children)):
+                slivers = slivers_by_index.get(index, [])
+                state = None
+                if len(slivers) > 0:
+                    state = tuple([getManifestState(sliver, aggregate_urn) \
+                                       for sliver in slivers])
+                stitched = stitching_handler is not None and \
+                    index == self._stitching_index and len(link_slivers) > 0
+                if stitched:
+                    # The stitching element shows the VLANs reserved for
+                    # the links and those available at the edge points.
+                    # If allocating, always update it
+                    state = (tuple([sliver.getSliverURN() \
+                                        for sliver in link_slivers]),
+                             stitching_handler.getAvailabilityVersion())
+                    if allocate: state = object()
+                if state == self._states[index] and \
+                        self._texts[index] is not None:
+                    continue
+
+                # Copy the child from the request again unless unchanged
+                child = self._children[index]
+                if self._states[index] is not None:
+                    fresh_child = self._request_children[index].cloneNode(True)
+                    self._manifest.replaceChild(fresh_child, child)
+                    self._children[index] = child = fresh_child
+                self._states[index] = state
+                self._texts[index] = None
+
+                # Copy relevant information from the slivers
+                for sliver in slivers:
+                    updateManifestForSliver(sliver, child, self._root, \
+                                                aggregate_urn)
+                if stitched:
+                    for sliver in link_slivers:
+                        err_output, err_code = \
+                            stitching_handler.updateManifestForSliver(self._manifest,
+                                                                      sliver,
+                                                                      allocate)
+                        if err_code != constants.SUCCESS:
+                            return None, err_output, err_code
+
+                self._texts[index] = \
+                    ''.join([line + '\n' for line in \
+                                 cleanLines(printChild(child))])
+
+            if self._print_whole:
+                clean_xml = ''.join([line + '\n' for line in \
+                    cleanLines(self._manifest.toprettyxml(indent = '    '))])
+            else:
+                clean_xml = self._start_tag + '\n' + \
+                    ''.join(self._texts) + self._end_tag + '\n'
+        finally:
+            self._lock.release()
+
+        config.logger.info("Clean %s = %s" % ("MANIFEST", clean_xml))
+        return clean_xml, None, constants.SUCCESS
+
+
+# The state of a sliver shown in its manifest element (see 
+# updateManifestForSliver)
+def getManifestState(sliver_object, component_manager_id):
+    state = [sliver_object.__class__.__name__, sliver_object.getName(),
+             sliver_object.getSliverURN(), component_manager_id,
+             sliver_object.getAllocationState(), 
+             sliver_object.getOperationalState()]
+    if isinstance(sliver_object, NetworkLink):
+        state.append(sliver_object.getVLANTag())
+    elif isinstance(sliver_object, VirtualMachine):
+        users = sliver_object.getAuthorizedUsers()
+        if users is not None: users = tuple(users)
+        state = state + [sliver_object.getHost(), 
+                         sliver_object.getVMFlavor(),
+                         sliver_object.getOSImageName(), 
+                         sliver_object.getOSType(),
+                         sliver_object.getOSVersion(), users,
+                         sliver_object.getExternalIp(), 
+                         sliver_object.getSSHProxyLoginPort(),
+                         config.urn_prefix, config.image_urn_prefix,
+                         config.public_ip]
+        for interface in sliver_object.getNetworkInterfaces():
+            state.append((interface.getName(), interface.getMACAddress(),
+                          interface.getIPAddress(), interface.getNetmask()))
+    return tuple(state)
 
-            if err_code != constants.SUCCESS:
-                return None, err_output, err_code
 
-    return cleanXML(manifest, "MANIFEST"), err_output, err_code
+# Pretty print a child of the rspec element as toprettyxml prints it
+# within the rspec element
+def printChild(child):
+    writer = StringIO()
+    child.writexml(writer, '    ', '    ', '\n')
+    return writer.getvalue()
 
 
+# The element returned belongs to the slice's cached DOM of the request
+# rspec and must not be modified
 def getRequestElementForSliver(sliver):
-    full_request_rspec = parseString(sliver.getRequestRspec()).getElementsByTagName('rspec')[0]
+    request_dom = sliver.getRequestRspecDOM()
+    if request_dom is None:
+        return None
+    full_request_rspec = request_dom.getElementsByTagName('rspec')[0]
     for child in full_request_rspec.childNodes:
         if child.attributes is None or not child.attributes.has_key('client_id'):
             continue
@@ -527,8 +674,6 @@ def updateManifestForSliver(sliver_object, sliver_elt, root, \
             for user in users:
                 login = root.createElement("login")
                 login.setAttribute("authentication", "ssh-keys")
-                my_host_name = \
-                    socket.gethostbyaddr(socket.gethostname())[0]
                 #login.setAttribute("externally-routable-ip", sliver_object.getExternalIp())
                 if sliver_object.getExternalIp():
                     login.setAttribute("hostname", sliver_object.getExternalIp())
@@ -544,33 +689,36 @@ def updateManifestForSliver(sliver_object, sliver_elt, root, \
 def cleanXML(doc, label):
     xml = doc.toprettyxml(indent = '    ')
 #    config.logger.info("%s = %s" % (label, xml))
-    clean_xml = ""
-    for line in xml.split('\n'):
-        if line.strip():
-            clean_xml += line + '\n'
+    clean_xml = ''.join([line + '\n' for line in cleanLines(xml)])
     config.logger.info("Clean %s = %s" % (label, clean_xml))
     return clean_xml
 
+# Return the lines of xml that aren't blank
+def cleanLines(xml):
+    return [line for line in xml.split('\n') if line.strip()]
+
 
 # Generate advertisement RSPEC for aggeregate based on 
 # flavors and disk images registered with open stack
 def generateAdvertisement(am_urn, stitching_handler = None):
+    return ''.join(generateAdvertisementChunks(am_urn, stitching_handler))
+
+# Generate the advertisement RSPEC as a sequence of strings.
+# The sliver types (every flavor with every disk image) are the same for
+# all compute nodes: they are rendered once and that one string is
+# yielded for each node, between the node's own element and interface.
+def generateAdvertisementChunks(am_urn, stitching_handler = None):
 
     component_manager_id = am_urn
-    component_name = "" #str(uuid.uuid4())
-    component_id = 'urn:public:geni:gpo:vm+' + component_name
     exclusive = 'false'
-    client_id="VM"
 
     urn_prefix = getURNprefix(am_urn)
-    compute_nodes = GramImageInfo._compute_hosts
+    compute_nodes = GramImageInfo.get_compute_hosts()
+    hostname = socket.gethostname()
 
-    flavors = open_stack_interface._listFlavors()
-    sliver_type = config.default_VM_flavor
-    node_types = ""
-    for flavor_name in flavors.values():
-        node_type = '<sliver_type name="%s"/>' % flavor_name
-        node_types = node_types + node_type + "\n"
+    flavor_names = open_stack_interface._listFlavors().values()
+    node_types = ''.join(['<sliver_type name="%s"/>\n' % flavor_name \
+                              for flavor_name in flavor_names])
 
     # Constants for linking compute nodes to switch
     switch_cmid = am_urn
@@ -579,10 +727,8 @@ def generateAdvertisement(am_urn, stitching_handler = None):
     switch_iface_cid = config.urn_prefix+"interface+" + switch_name + ":internal"
 
     #images = open_stack_interface._listImages()
-    #print "IMAGES = " + str(images)
     images = config.disk_image_metadata
-#    print "IMAGES = " + str(images)
-    image_types = ""
+    image_types = []
     for image in images:
         description = ""
         if config.disk_image_metadata.has_key(image):
@@ -591,8 +737,9 @@ def generateAdvertisement(am_urn, stitching_handler = None):
             if metadata.has_key('version'): version = metadata['version']
             #if metadata.has_key('description'): description = metadata['description']
             description = 'standard'
-        disk_image = '      <disk_image name="%s" os="%s" version="%s" description="%s" />' % (image, os, version, description)
-        image_types = image_types + disk_image + "\n"
+        disk_image = '      <disk_image name="%s" os="%s" version="%s" description="%s" />\n' % (image, os, version, description)
+        image_types.append(disk_image)
+    image_types = ''.join(image_types)
 
     location_block = ''
     if config.location != None and \
@@ -601,44 +748,15 @@ def generateAdvertisement(am_urn, stitching_handler = None):
             (config.location['latitude'], 
              config.location['longitude'])
 
-    sliver_block = ''
-    for flavor_name in flavors.values():
-        entry = '    <sliver_type name="%s">' % flavor_name
-        sliver_block = sliver_block + entry + '\n'
-        sliver_block = sliver_block + image_types
-        sliver_block = sliver_block + '    </sliver_type> \n'
+    sliver_block = ''.join(['    <sliver_type name="%s">\n' % flavor_name + \
+                                image_types + '    </sliver_type> \n' \
+                                for flavor_name in flavor_names])
 
-    node_block = ''
-    stitching_link_block = ""
-    for compute_node in compute_nodes.keys():
-        component_id_template = urn_prefix + socket.gethostname() + '+%s+' + compute_node
-        component_id = component_id_template % 'node'
-        component_id_interface = component_id_template % 'interface'
-        interface_block ='    <interface component_id="%s:%s" role="%s"/>\n' % (component_id_interface, 'eth2', 'experimental')
-        entry = '<node component_name="%s" component_manager_id="%s" component_id="%s" exclusive="%s">' % \
-            (compute_node, component_manager_id, component_id, exclusive)
-        node_block = node_block + entry + '\n'
-        node_block = node_block + location_block + '\n'
-        node_block = node_block + sliver_block
-        node_block = node_block + interface_block
-        node_block = node_block + '</node> \n \n'
-
-        stitching_link_template = '<link component_name="%s" ' + \
-            'component_id="%s">\n' +\
-            '<interface_ref component_id="%s:eth2"/>\n' + \
-            '<interface_ref component_id="%s"/>\n' + \
-            '</link>'
-        link_name = "link-" + compute_node
-        link_id = urn_prefix + "link+" + switch_name + "_" + compute_node
-        stitching_link = stitching_link_template % \
-            (link_name, link_id, component_id_interface, switch_iface_cid)
-        stitching_link_block = stitching_link_block + "\n" + stitching_link
-
-    # Add links from local switch to remote switch for stitched links
-    external_refs = ""
+    # Links from local switch to remote switch for stitched links
+    external_links = []
+    external_refs = []
     if stitching_handler and 'edge_points' in config.stitching_info:
         for edge_point in config.stitching_info['edge_points']:
-            # ***
             remote_link = edge_point['remote_switch']
             local_link = edge_point['local_link']
             remote_parts = remote_link.split('+')
@@ -651,12 +769,53 @@ def generateAdvertisement(am_urn, stitching_handler = None):
                 '   <interface_ref component_id="%s"/>\n' +\
                 '   <interface_ref component_id="%s"/>\n' +\
                 '</link>'
-            external_link = link_template % (link_cn, link_cid, local_link, remote_link)
-            stitching_link_block = stitching_link_block + "\n" + external_link
+            external_links.append("\n" + link_template % \
+                                      (link_cn, link_cid, local_link, 
+                                       remote_link))
             external_ref = '<external_ref component_id="%s" component_manager_id="%s"/>' % (link_cid, link_cmid)
-            external_refs = external_refs + "\n" + external_ref
+            external_refs.append("\n" + external_ref)
+
+    schema_locs = ["http://www.geni.net/resources/rspec/3",
+                   "http://www.geni.net/resources/rspec/3/ad.xsd",
+                   "http://hpn.east.isi.edu/rspec/ext/stitch/0.1/",
+                   "http://hpn.east.isi.edu/rspec/ext/stitch/0.1/stitch-schema.xsd",
+                   "http://www.geni.net/resources/rspec/ext/opstate/1",
+                   "http://www.geni.net/resources/rspec/ext/opstate/1/ad.xsd"]
+    advert_header = '''<?xml version="1.0" encoding="UTF-8"?> 
+         <rspec xmlns="http://www.geni.net/resources/rspec/3" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="%s" type="advertisement">''' % (' '.join(schema_locs))
 
-    # Add node for the switch with interface to all the compute nodes
+    yield advert_header + '\n'
+    for external_ref in external_refs: yield external_ref
+    yield '\n'
+
+    # A node for every compute node with its eth2 interface
+    node_template = '<node component_name="%s" component_manager_id="%s" component_id="%s" exclusive="%s">\n' + \
+        location_block + '\n'
+    interface_template = '    <interface component_id="%s:%s" role="%s"/>\n' + \
+        '</node> \n \n'
+    stitching_link_template = '\n<link component_name="%s" ' + \
+        'component_id="%s">\n' +\
+        '<interface_ref component_id="%s:eth2"/>\n' + \
+        '<interface_ref component_id="%s"/>\n' + \
+        '</link>'
+    stitching_links = []
+    for compute_node in compute_nodes.keys():
+        component_id_template = urn_prefix + hostname + '+%s+' + compute_node
+        component_id = component_id_template % 'node'
+        component_id_interface = component_id_template % 'interface'
+        yield node_template % \
+            (compute_node, component_manager_id, component_id, exclusive)
+        yield sliver_block
+        yield interface_template % \
+            (component_id_interface, 'eth2', 'experimental')
+
+        # And a link from its eth2 interface to the switch
+        link_name = "link-" + compute_node
+        link_id = urn_prefix + "link+" + switch_name + "_" + compute_node
+        stitching_links.append(stitching_link_template % \
+            (link_name, link_id, component_id_interface, switch_iface_cid))
+
+    # PLUS a node for the switch with interface to all the compute nodes
     switch_node_template = \
         '<node component_manager_id="%s" component_name="%s" ' +\
         'component_id="%s" exclusive="True">'
@@ -665,9 +824,7 @@ def generateAdvertisement(am_urn, stitching_handler = None):
         '   <interface component_id="%s" role="experimental"/>'
     switch_node =  switch_node_template % \
         (switch_cmid, switch_name, switch_cid)
-    switch_node_ifaces = ""
-    switch_node_iface = switch_interface_template % switch_iface_cid
-    switch_node_ifaces = "\n" + switch_node_iface
+    switch_node_ifaces = "\n" + switch_interface_template % switch_iface_cid
     
     # And (if stitching) interfaces to all stitch ports
     if stitching_handler and 'edge_points' in config.stitching_info:
@@ -676,15 +833,21 @@ def generateAdvertisement(am_urn, stitching_handler = None):
             stitch_iface = switch_interface_template % local_link
             switch_node_ifaces = switch_node_ifaces + "\n" + stitch_iface
         
-    switch_node = switch_node + "\n" + switch_hw_type + \
-        switch_node_ifaces + "\n</node>"
-    node_block = node_block + "\n" + switch_node
+    yield "\n" + switch_node + "\n" + switch_hw_type + \
+        switch_node_ifaces + "\n</node>" + '\n'
 
+    for stitching_link in stitching_links: yield stitching_link
+    for external_link in external_links: yield external_link
+    yield '\n'
+
+    if stitching_handler:
+        stitching_advertisement_doc = \
+            stitching_handler.generateAdvertisement(switch_cid)
+        yield stitching_advertisement_doc.childNodes[0].toprettyxml()
 
     POA_header = '<rspec_opstate xmlns="http://www.geni.net/resources/rspec/ext/opstate/1" ' + \
                 'aggregate_manager_id=' + '"' + am_urn + '" '
 
-  
     POA_block = POA_header + 'start="OPSTATE_GENI_NOT_READY"> \n' + \
                 node_types + \
                 '<state name="OPSTATE_GENI_NOT_READY"> \n' + \
@@ -731,89 +894,7 @@ def generateAdvertisement(am_urn, stitching_handler = None):
 #      ci_block += "</sliver_type>\n"
 #      ci_block += "</node>\n"       
 
-#    tmpl = '''  <node component_manager_id="%s"
-#        component_name="%s"
-#        component_id="%s"
-#        exclusive="%s">
-#  %s <sliver_type name="%s"> 
-#  %s </sliver_type>
-#  </node>
-#  %s
-#  %s
-#  </rspec>
-#  '''
-
-    schema_locs = ["http://www.geni.net/resources/rspec/3",
-                   "http://www.geni.net/resources/rspec/3/ad.xsd",
-                   "http://hpn.east.isi.edu/rspec/ext/stitch/0.1/",
-                   "http://hpn.east.isi.edu/rspec/ext/stitch/0.1/stitch-schema.xsd",
-                   "http://www.geni.net/resources/rspec/ext/opstate/1",
-                   "http://www.geni.net/resources/rspec/ext/opstate/1/ad.xsd"]
-    advert_header = '''<?xml version="1.0" encoding="UTF-8"?> 
-         <rspec xmlns="http://www.geni.net/resources/rspec/3" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="%s" type="advertisement">''' % (' '.join(schema_locs))
-
-    stitching_advertisement =""
-#    config.logger.error("STITCHING_HANDLER = %s" % stitching_handler)
-    if stitching_handler:
-        stitching_advertisement_doc = \
-            stitching_handler.generateAdvertisement(switch_cid)
-        stitching_advertisement = \
-            stitching_advertisement_doc.childNodes[0].toprettyxml()
-
-        stitching_nodes = ""
-        stitching_node_elts = stitching_advertisement_doc.getElementsByTagName('node');
-        for stitching_node_elt in stitching_node_elts:
-            node_id = stitching_node_elt.attributes['id'].value
-            stitching_node = stitching_advertisement_doc.createElement("node")
-            stitching_node.setAttribute('component_name', node_id)
-            stitching_node.setAttribute('component_id', component_id)
-            stitching_node.setAttribute('component_manager_id', component_manager_id)
-            stitching_node.setAttribute("exclusive", exclusive)
-            link_elts = stitching_node_elt.getElementsByTagName('link')
-            if len(link_elts) == 0: continue
-            link_elt =link_elts[0];
-            stitching_node_interface_id = link_elt.attributes['id'].value
-            stitching_node_interface_elt = stitching_advertisement_doc.createElement('interface')
-            stitching_node_interface_elt.setAttribute('component_id', stitching_node_interface_id)
-            stitching_node_interface_elt.setAttribute('role', 'experimental')
-            stitching_node.appendChild(stitching_node_interface_elt)
-
-            stitching_nodes += stitching_node.toprettyxml()
-
-        stitching_links = ""
-        client_id = 0
-        for compute_node in compute_nodes.keys():
-            component_id = urn_prefix + socket.gethostname() + '+interface+' + compute_node
-            compute_interface_ref = "%s:%s" % (component_id, 'eth2')
-            for stitching_node in stitching_node_elts:
-                link_elts = stitching_node.getElementsByTagName('link')
-                if len(link_elts) == 0: continue
-                link_elt = link_elts[0]
-                switch_interface_ref = link_elt.attributes['id'].value
-                link_id = "stitch-compute-link-%d" % client_id
-                client_id = client_id+1
-                stitching_link = '<link component_id="%s">\n<interface_ref component_id="%s"/>\n<interface_ref component_id="%s"/>\n</link>\n\n' % \
-                    (link_id, compute_interface_ref, switch_interface_ref)
-                stitching_links += stitching_link
-
-        
-#        node_block = node_block + '\n' + stitching_nodes + '\n' + stitching_links;
-
-    # Need to have a node for every compute node
-    #   with its eth2 interface
-    # PLUS a node for the switch 'force10'
-    #   with all the stitchable interfaces
-    # Then a link from every eth2 interface to the swtich
-
-    result = advert_header  + '\n' + external_refs + '\n' + \
-        node_block + '\n' + \
-        stitching_link_block + '\n' + stitching_advertisement + \
-        POA_block + ci_block + '</rspec>'
-
-#        (tmpl % (component_manager_id, component_name, \
-#                     component_id, exclusive, node_types, \
-#                     sliver_type, image_types,  stitching_advertisement, POA_block)) 
-    return result
+    yield POA_block + ci_block + '</rspec>'
 
 def getURNprefix(am_urn):
         host = socket.gethostname().split('.')[0]
@@ -827,3 +908,56 @@ def getHostFromUrn(urn):
             return m.group(1)
 
 
+
+
+if __name__ == "__main__":
+    # Benchmark of generating the advertisement, with the OpenStack
+    # listings it is built from registered in the inventory cache.
+    # Usage: python rspec_handler.py [nodes [flavors [images]]]
+    import logging
+    import sys
+    import time
+    import zlib
+    import inventory_cache
+    import open_stack_output
+
+    logging.basicConfig()
+    config.logger = logging.getLogger('rspec_handler')
+    num_nodes, num_flavors, num_images = 64, 20, 100
+    if len(sys.argv) > 1: num_nodes = int(sys.argv[1])
+    if len(sys.argv) > 2: num_flavors = int(sys.argv[2])
+    if len(sys.argv) > 3: num_images = int(sys.argv[3])
+
+    hosts = [('compute%d' % i, 'compute') for i in range(num_nodes)]
+    flavors = [{'ID' : str(i + 1), 'Name' : 'm1.flavor%d' % i} \
+                   for i in range(num_flavors)]
+    inventory_cache.inventory.register('hosts', lambda: hosts)
+    inventory_cache.inventory.register('flavors', 
+        lambda: open_stack_output.OutputTable(['ID', 'Name'], flavors))
+    for i in range(num_images):
+        config.disk_image_metadata['image%d' % i] = \
+            {'os' : 'Linux', 'version' : '12.04', 'description' : ''}
+    am_urn = config.urn_prefix + socket.gethostname() + '+authority+am'
+
+    runs = 10
+    start_time = time.time()
+    for i in range(runs):
+        chunks = list(generateAdvertisementChunks(am_urn))
+    chunks_time = (time.time() - start_time) / runs
+    start_time = time.time()
+    for i in range(runs):
+        advertisement = generateAdvertisement(am_urn)
+    join_time = (time.time() - start_time) / runs
+    start_time = time.time()
+    for i in range(runs):
+        compressor = zlib.compressobj()
+        compressed = [compressor.compress(chunk) for chunk in \
+                          generateAdvertisementChunks(am_urn)]
+        compressed.append(compressor.flush())
+    compress_time = (time.time() - start_time) / runs
+    parseString(advertisement)
+
+    print "%d nodes x %d flavors x %d images: %d bytes in %d chunks" % \
+        (num_nodes, num_flavors, num_images, len(advertisement), len(chunks))
+    print "Chunks %.1f ms, joined %.1f ms, streamed through zlib %.1f ms" % \
+        (chunks_time * 1000, join_time * 1000, compress_time * 1000)
@@ -0,0 +1,248 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Parsing of request RSpecs.
+#
+# An Allocate looks at the request RSpec several times: the GRAM resource
+# manager (AM authorization) counts its nodes and stitching capacity,
+# rspec_handler.parseRequestRspec creates the slivers from it and the
+# stitching handler looks for this aggregate's hops, once for every link.
+# Each of these used to parse the RSpec into a minidom DOM, which is slow
+# and several times the size of the RSpec.  A RequestRSpec is parsed once,
+# with cElementTree, and indexes the elements these look up.  parse()
+# returns the same RequestRSpec for an RSpec it parsed recently, so the
+# parts of one request share one parse.
+#
+# Elements are looked up by their local name, whatever their namespace
+# prefix (e.g. both routable_control_ip and emulab:routable_control_ip).
+# A RequestRSpec is shared and must not be modified.  Manifests are still
+# built from a minidom DOM of the request (Slice.getRequestRspecDOM), as
+# ElementTree does not keep namespace prefixes when writing XML.
+
+import threading
+from collections import OrderedDict
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+# Number of recently parsed RSpecs kept by parse()
+RECENT_PARSES = 4
+
+
+# Return the name of an element without its namespace
+def localName(element):
+    tag = element.tag
+    if tag[:1] == '{':
+        return tag[tag.index('}') + 1:]
+    return tag
+
+# Return the elements with the given local name below element
+def findAll(element, name):
+    return [descendant for descendant in element.iter() \
+                if descendant is not element and localName(descendant) == name]
+
+# Return the children of element with the given local name
+def findChildren(element, name):
+    return [child for child in element if localName(child) == name]
+
+# Return the text of the first element with the given local name below
+# element, or None
+def findText(element, name):
+    for descendant in element.iter():
+        if descendant is not element and localName(descendant) == name:
+            return descendant.text
+    return None
+
+
+class RequestRSpec:
+
+    def __init__(self, rspec):
+        if isinstance(rspec, unicode):
+            rspec = rspec.encode('utf-8')
+        self._root = ElementTree.fromstring(rspec)
+        self._nodes = []
+        self._stitching = None
+        for element in self._root.iter():
+            name = localName(element)
+            if name == 'node':
+                self._nodes.append(element)
+            elif name == 'stitching' and self._stitching is None:
+                self._stitching = element
+        self._links = findChildren(self._root, 'link')
+        self._paths = {} # Stitching path ID => [path elements]
+        if self._stitching is not None:
+            for path in findAll(self._stitching, 'path'):
+                self._paths.setdefault(path.get('id'), []).append(path)
+
+    # The rspec element
+    def getRoot(self): return self._root
+
+    # All node elements
+    def getNodes(self): return self._nodes
+
+    # The link elements of the rspec (not of the stitching extension)
+    def getLinks(self): return self._links
+
+    # The (first) stitching element or None
+    def getStitching(self): return self._stitching
+
+    # The stitching path elements with the given ID
+    def getStitchingPaths(self, path_id): 
+        return self._paths.get(path_id, [])
+
+
+_recent = OrderedDict() # RSpec => RequestRSpec, least recently used first
+_recent_lock = threading.Lock()
+
+def parse(rspec):
+    """
+        Return the RequestRSpec of the given request RSpec (string or
+        RequestRSpec), parsing it unless it was parsed recently
+    """
+    if isinstance(rspec, RequestRSpec):
+        return rspec
+    _recent_lock.acquire()
+    try:
+        request = _recent.pop(rspec, None)
+        if request is not None:
+            _recent[rspec] = request
+            return request
+    finally:
+        _recent_lock.release()
+
+    request = RequestRSpec(rspec)
+
+    _recent_lock.acquire()
+    try:
+        _recent[rspec] = request
+        while len(_recent) > RECENT_PARSES:
+            _recent.popitem(last=False)
+    finally:
+        _recent_lock.release()
+    return request
+
+
+if __name__ == "__main__":
+    # Benchmark of parsing large request RSpecs, as done for an Allocate:
+    # once by the GRAM resource manager, once by parseRequestRspec and once
+    # by the stitching handler for every link (minidom), against one
+    # RequestRSpec.  The corpus of generated RSpecs (nodes with an
+    # interface on each of a number of LANs, each LAN stitched to another
+    # aggregate) is written to a temporary directory; RSpec files given on
+    # the command line are added to it.
+    # Usage: python rspec_parser.py [rspec_file ...]
+    import gc
+    import os
+    import sys
+    import tempfile
+    import time
+    from xml.dom.minidom import parseString
+
+    aggregate_urn = 'urn:publicid:IDN+gram.example.net+authority+am'
+    remote_urn = 'urn:publicid:IDN+remote.example.net+authority+am'
+
+    def generate_request(num_nodes, num_links):
+        lines = ['<rspec type="request" ' + \
+                     'xmlns="http://www.geni.net/resources/rspec/3" ' + \
+                     'xmlns:emulab="http://www.protogeni.net/resources/rspec/ext/emulab/1">']
+        for i in range(num_nodes):
+            lines.append('  <node client_id="vm%d" component_manager_id="%s" exclusive="false">' % (i, aggregate_urn))
+            lines.append('    <sliver_type name="m1.small">')
+            lines.append('      <disk_image name="ubuntu-12.04" os="Linux" version="12"/>')
+            lines.append('    </sliver_type>')
+            lines.append('    <emulab:routable_control_ip/>')
+            for j in range(num_links):
+                lines.append('    <interface client_id="vm%d:if%d">' % (i, j))
+                lines.append('      <ip address="10.%d.%d.%d" netmask="255.255.0.0" type="ipv4"/>' % (j, i / 250, i % 250 + 1))
+                lines.append('    </interface>')
+            lines.append('    <services>')
+            lines.append('      <install url="http://example.net/software.tar.gz" install_path="/local"/>')
+            lines.append('      <execute command="sudo /local/install.sh" shell="sh"/>')
+            lines.append('    </services>')
+            lines.append('  </node>')
+        for j in range(num_links):
+            lines.append('  <link client_id="lan%d">' % j)
+            lines.append('    <component_manager name="%s"/>' % aggregate_urn)
+            lines.append('    <component_manager name="%s"/>' % remote_urn)
+            for i in range(num_nodes):
+                lines.append('    <interface_ref client_id="vm%d:if%d"/>' % (i, j))
+            lines.append('  </link>')
+        lines.append('  <stitching xmlns="http://hpn.east.isi.edu/rspec/ext/stitch/0.1/" lastUpdateTime="20130101:00:00:00">')
+        for j in range(num_links):
+            lines.append('    <path id="lan%d">' % j)
+            for hop, urn in enumerate([aggregate_urn, remote_urn]):
+                lines.append('      <hop id="%d">' % (hop + 1))
+                lines.append('        <link id="%s+interface+switch:port%d">' % (urn.split('+authority')[0], j))
+                lines.append('          <capacity>100000</capacity>')
+                lines.append('          <switchingCapabilityDescriptor><switchingcapType>l2sc</switchingcapType><switchingCapabilitySpecificInfo><switchingCapabilitySpecificInfo_L2sc>')
+                lines.append('            <vlanRangeAvailability>100-200</vlanRangeAvailability>')
+                lines.append('            <suggestedVLANRange>%d</suggestedVLANRange>' % (100 + j))
+                lines.append('          </switchingCapabilitySpecificInfo_L2sc></switchingCapabilitySpecificInfo></switchingCapabilityDescriptor>')
+                lines.append('        </link>')
+                lines.append('      </hop>')
+            lines.append('    </path>')
+        lines.append('  </stitching>')
+        lines.append('</rspec>')
+        return '\n'.join(lines) + '\n'
+
+    directory = tempfile.mkdtemp()
+    corpus = []
+    for num_nodes, num_links in [(10, 1), (100, 2), (500, 4), (1000, 8)]:
+        filename = os.path.join(directory, 
+                                'request-%d-nodes-%d-links.rspec' % \
+                                    (num_nodes, num_links))
+        f = open(filename, 'w')
+        f.write(generate_request(num_nodes, num_links))
+        f.close()
+        corpus.append(filename)
+    corpus = corpus + sys.argv[1:]
+    print "Corpus in %s" % directory
+
+    for filename in corpus:
+        f = open(filename)
+        rspec = f.read()
+        f.close()
+
+        # minidom: one parse per use
+        request = RequestRSpec(rspec)
+        uses = 2 + len(request.getLinks())
+        start_time = time.time()
+        for i in range(uses):
+            dom = parseString(rspec)
+        minidom_time = time.time() - start_time
+        del dom
+        gc.collect()
+
+        # RequestRSpec: one parse, shared
+        _recent.clear()
+        start_time = time.time()
+        for i in range(uses):
+            request = parse(rspec)
+        parse_time = time.time() - start_time
+
+        print "%s: %d bytes, %d nodes, %d links: minidom x %d %.1f ms, RequestRSpec %.1f ms" % \
+            (os.path.basename(filename), len(rspec), len(request.getNodes()),
+             len(request.getLinks()), uses, minidom_time * 1000, 
+             parse_time * 1000)
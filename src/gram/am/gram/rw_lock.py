@@ -0,0 +1,217 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Read-write lock for the in-memory state of a slice.
+#
+# Any number of threads may hold the lock for reading (e.g. Status and
+# Describe) while no thread holds it for writing.  The lock is reentrant:
+# a thread that holds it may acquire it again, and a thread that holds it
+# for writing may also acquire it for reading.  A thread that holds it
+# only for reading may not acquire it for writing (that would deadlock
+# with another reader doing the same).  Once a writer is waiting, new
+# readers wait too so that writers aren't starved.
+#
+#    lock = ReadWriteLock()
+#    with lock.reader :
+#        ... read the state ...
+#    with lock.writer :
+#        ... change the state ...
+
+import thread
+import threading
+
+
+class ReadWriteLock :
+
+    def __init__(self) :
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = {} # Thread ID => number of read acquisitions
+        self._writer = None # Thread ID of the writer, if any
+        self._writer_count = 0 # Number of acquisitions by the writer
+        self._writers_waiting = 0
+        self.reader = _LockHandle(self.acquire_read, self.release_read)
+        self.writer = _LockHandle(self.acquire_write, self.release_write)
+
+    def acquire_read(self) :
+        me = thread.get_ident()
+        self._condition.acquire()
+        try :
+            if self._writer == me :
+                self._writer_count += 1
+                return
+            if me in self._readers :
+                self._readers[me] += 1
+                return
+            while self._writer is not None or self._writers_waiting > 0 :
+                self._condition.wait()
+            self._readers[me] = 1
+        finally :
+            self._condition.release()
+
+    def release_read(self) :
+        me = thread.get_ident()
+        self._condition.acquire()
+        try :
+            if self._writer == me :
+                self._writer_count -= 1
+                return
+            count = self._readers[me] - 1
+            if count > 0 :
+                self._readers[me] = count
+            else :
+                del self._readers[me]
+                if len(self._readers) == 0 :
+                    self._condition.notifyAll()
+        finally :
+            self._condition.release()
+
+    def acquire_write(self) :
+        me = thread.get_ident()
+        self._condition.acquire()
+        try :
+            if self._writer == me :
+                self._writer_count += 1
+                return
+            if me in self._readers :
+                raise RuntimeError("Can't acquire a lock held for reading " + \
+                                       "for writing")
+            self._writers_waiting += 1
+            try :
+                while self._writer is not None or len(self._readers) > 0 :
+                    self._condition.wait()
+            finally :
+                self._writers_waiting -= 1
+            self._writer = me
+            self._writer_count = 1
+        finally :
+            self._condition.release()
+
+    def release_write(self) :
+        self._condition.acquire()
+        try :
+            if self._writer != thread.get_ident() :
+                raise RuntimeError("Lock not held for writing")
+            self._writer_count -= 1
+            if self._writer_count == 0 :
+                self._writer = None
+                self._condition.notifyAll()
+        finally :
+            self._condition.release()
+
+
+# One side of a ReadWriteLock, usable in a 'with' statement
+class _LockHandle :
+
+    def __init__(self, acquire, release) :
+        self.acquire = acquire
+        self.release = release
+
+    def __enter__(self) :
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) :
+        self.release()
+        return False
+
+
+if __name__ == "__main__":
+    # Stress test: Status calls (which hold a slice's state lock for
+    # reading) running alongside a Provision of the same slice (which
+    # holds the slice lock while it makes its OpenStack calls, simulated 
+    # here by sleeping, and the state lock for writing only while it 
+    # changes the slivers).  Checks that readers never see a writer
+    # inside the lock and reports how long Status calls waited, compared
+    # with Status taking the slice lock as it used to.
+    # Usage: python rw_lock.py [num_status_threads [provision_seconds]]
+    import logging
+    import sys
+    import time
+
+    import config
+    import constants
+    import utils
+    from resources import Slice, VirtualMachine, NetworkInterface, \
+        NetworkLink
+
+    logging.basicConfig()
+    config.logger = logging.getLogger('rw_lock')
+    config.logger.setLevel(logging.WARNING)
+    num_readers = 8
+    provision_seconds = 2.0
+    if len(sys.argv) > 1 : num_readers = int(sys.argv[1])
+    if len(sys.argv) > 2 : provision_seconds = float(sys.argv[2])
+    num_steps = 20
+
+    def run(status_lock_name) :
+        slice_object = Slice('urn:publicid:IDN+geni:stress+slice+s')
+        link = NetworkLink(slice_object)
+        for vm_num in range(10) :
+            vm = VirtualMachine(slice_object)
+            nic = NetworkInterface(slice_object, vm)
+            vm.addNetworkInterface(nic)
+            nic.setLink(link)
+            link.addEndpoint(nic)
+        writing = [False]
+        failures = []
+        waits = []
+        done = threading.Event()
+
+        def provision() :
+            with slice_object.getLock() :
+                for step in range(num_steps) :
+                    time.sleep(provision_seconds / num_steps) # OpenStack
+                    with slice_object.getWriteLock() :
+                        writing[0] = True
+                        vm = VirtualMachine(slice_object)
+                        for sliver in slice_object.getSlivers().values() :
+                            sliver.setAllocationState(constants.provisioned)
+                        slice_object.removeSliver(vm)
+                        writing[0] = False
+            done.set()
+
+        def status() :
+            while not done.isSet() :
+                start_time = time.time()
+                lock = getattr(slice_object, status_lock_name)()
+                with lock :
+                    waits.append(time.time() - start_time)
+                    if writing[0] : failures.append('reader saw writer')
+                    slivers = slice_object.getSlivers().values()
+                    utils.SliverList().getStatusOfSlivers(slivers)
+                    if writing[0] : failures.append('reader saw writer')
+                time.sleep(0.001)
+
+        threads = [threading.Thread(target=status) \
+                       for i in range(num_readers)]
+        threads.append(threading.Thread(target=provision))
+        for t in threads : t.start()
+        for t in threads : t.join()
+        waits.sort()
+        print "Status with %s: %d calls, median wait %.1f ms, max %.1f ms, %d failures" % \
+            (status_lock_name, len(waits), waits[len(waits) / 2] * 1000, 
+             waits[-1] * 1000, len(failures))
+        return failures
+
+    failures = run('getReadLock') + run('getLock')
+    if failures : sys.exit(1)
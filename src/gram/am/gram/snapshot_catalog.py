@@ -0,0 +1,193 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Catalog of the snapshots in a snapshot directory.
+#
+# Listing and sorting the snapshot directory to find the latest snapshot
+# gets slow once it holds thousands of snapshots.  The aggregate manager
+# registers each snapshot it writes with the catalog, which keeps an index
+# of the snapshots (oldest first) and a pointer to the latest one in the
+# 'catalog' subdirectory of the snapshot directory (see snapshot_format.py,
+# whose find_latest_snapshot the monitoring tools use).  A background thread
+# removes snapshots beyond config.snapshot_maintain_limit or older than
+# config.snapshot_maintain_days.  The latest snapshot is never removed.
+
+import collections
+import os
+import threading
+import time
+
+import config
+import Archiving
+import snapshot_format
+
+
+class SnapshotCatalog :
+
+    def __init__(self, snapshot_directory) :
+        self._directory = snapshot_directory
+        self._catalog_directory = \
+            os.path.join(snapshot_directory, 
+                         snapshot_format.CATALOG_SUBDIRECTORY)
+        self._index_filename = os.path.join(self._catalog_directory,
+                                            snapshot_format.INDEX_FILENAME)
+        self._latest_filename = \
+            os.path.join(self._catalog_directory, 
+                         snapshot_format.LATEST_FILENAME)
+        self._lock = threading.Condition(threading.Lock())
+        self._snapshots = collections.deque() # (write time, name), oldest first
+        self._thread = None
+        self._load()
+
+    def _load(self) :
+        if not os.path.exists(self._catalog_directory) :
+            os.makedirs(self._catalog_directory)
+        if os.path.exists(self._index_filename) :
+            file = open(self._index_filename, 'r')
+            try :
+                for line in file :
+                    parts = line.split(None, 1)
+                    if len(parts) == 2 :
+                        self._snapshots.append((float(parts[0]), 
+                                                parts[1].strip()))
+            finally :
+                file.close()
+        else :
+            # No catalog yet: build one from the snapshots in the directory
+            for snapshot in snapshot_format.list_snapshots(self._directory) :
+                self._snapshots.append((os.path.getmtime(snapshot),
+                                        os.path.basename(snapshot)))
+            self._write_index()
+            config.logger.info("Cataloged %d snapshots in %s" % \
+                                   (len(self._snapshots), self._directory))
+        if len(self._snapshots) > 0 and \
+                not os.path.exists(self._latest_filename) :
+            self._write_latest(self._snapshots[-1][1])
+
+    def _write_index(self) :
+        lines = ["%.3f %s\n" % (write_time, name) \
+                     for write_time, name in self._snapshots]
+        Archiving.write_file_atomically(self._index_filename,
+                                        lambda file: file.write(''.join(lines)))
+
+    def _write_latest(self, name) :
+        Archiving.write_file_atomically(self._latest_filename,
+                                        lambda file: file.write(name + '\n'))
+
+    def add(self, filename) :
+        """
+            Register a snapshot that has been written
+        """
+        name = os.path.basename(filename)
+        self._lock.acquire()
+        try :
+            write_time = time.time()
+            self._snapshots.append((write_time, name))
+            file = open(self._index_filename, 'a')
+            try :
+                file.write("%.3f %s\n" % (write_time, name))
+            finally :
+                file.close()
+            self._write_latest(name)
+            if len(self._snapshots) > config.snapshot_maintain_limit :
+                self._lock.notifyAll()
+        finally :
+            self._lock.release()
+
+    def getSnapshots(self) :
+        """
+            Returns the snapshot files, oldest first
+        """
+        self._lock.acquire()
+        try :
+            return [os.path.join(self._directory, name) \
+                        for write_time, name in self._snapshots]
+        finally :
+            self._lock.release()
+
+    def getLatest(self) :
+        self._lock.acquire()
+        try :
+            if len(self._snapshots) == 0 :
+                return None
+            return os.path.join(self._directory, self._snapshots[-1][1])
+        finally :
+            self._lock.release()
+
+    def prune(self) :
+        """
+            Remove the snapshots beyond config.snapshot_maintain_limit and
+            those older than config.snapshot_maintain_days (if set).
+            Returns the number of snapshots removed.
+        """
+        max_count = max(1, config.snapshot_maintain_limit)
+        oldest_time = None
+        if config.snapshot_maintain_days :
+            oldest_time = time.time() - config.snapshot_maintain_days * 86400
+        removed = []
+        self._lock.acquire()
+        try :
+            while len(self._snapshots) > 1 and \
+                    (len(self._snapshots) > max_count or \
+                         (oldest_time is not None and \
+                              self._snapshots[0][0] < oldest_time)) :
+                removed.append(self._snapshots.popleft()[1])
+            if len(removed) > 0 :
+                self._write_index()
+        finally :
+            self._lock.release()
+
+        for name in removed :
+            try :
+                os.unlink(os.path.join(self._directory, name))
+            except OSError, e :
+                config.logger.error("Failed to remove snapshot %s: %s" % \
+                                        (name, e))
+        if len(removed) > 0 :
+            config.logger.info("Removed %d old snapshots" % len(removed))
+        return len(removed)
+
+    def start(self) :
+        """
+            Start the thread that removes old snapshots every 
+            config.snapshot_prune_interval seconds, or sooner once there 
+            are more than config.snapshot_maintain_limit
+        """
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _run(self) :
+        while True :
+            self._lock.acquire()
+            try :
+                if len(self._snapshots) <= config.snapshot_maintain_limit :
+                    self._lock.wait(config.snapshot_prune_interval)
+            finally :
+                self._lock.release()
+            try :
+                self.prune()
+            except Exception, e :
+                config.logger.error("Failed to prune snapshots: %s" % e)
+            # Let snapshots accumulate a little between prunes
+            time.sleep(1)
@@ -0,0 +1,290 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Reading and writing of GRAM state snapshot files.
+#
+# Snapshots are written in one of two formats (config.snapshot_format):
+#
+# 'json': A JSON list of the encodings of the slices, slivers and other
+#    state of the aggregate (see Archiving.GramJSONEncoder).
+#
+# 'binary': A compact format for large aggregates, which can be written
+#    and read one object at a time.  The file starts with MAGIC and a 2
+#    byte format version, followed by records of a 1 byte type, a 4 byte
+#    (network order) length and the payload:
+#       PREFIX_RECORD: A URN prefix (everything up to the last '+').
+#          Prefixes are numbered from 0 in the order they appear.
+#       SLICE_RECORD: Start of a slice and its slivers (no payload).
+#       BLOB_RECORD: A zlib-compressed rspec, numbered from 0 in the order
+#          blobs appear.  Each distinct rspec is stored once per slice.
+#          (Slices keep one copy of each of their rspecs in 'rspecs';
+#          older snapshots have a copy in each sliver.)
+#       OBJECT_RECORD: The JSON encoding of an object, in which each URN
+#          is replaced by {"__urn__" : [prefix number, rest of URN]} and
+#          each rspec by {"__blob__" : blob number}.
+#       END_RECORD: End of the snapshot (no payload).
+#
+# Readers (the aggregate manager, gram-mon and opsmon) use
+# iterate_snapshot or load_snapshot, which read either format and return
+# the objects as json.loads would return them for a JSON snapshot, and
+# find_latest_snapshot, which uses the snapshot catalog kept by the
+# aggregate manager (see snapshot_catalog.py).  journal_format.load_state
+# also replays the state journal that may follow a snapshot.
+#
+# This module doesn't depend on the rest of GRAM so the monitoring tools
+# can use it.
+
+import json
+import os
+import struct
+import zlib
+
+MAGIC = 'GRAMSNAP'
+JSON_FORMAT_VERSION = 0 # Version reported for JSON snapshots
+BINARY_FORMAT_VERSION = 1 # Version of the binary format written
+
+PREFIX_RECORD = 'P'
+SLICE_RECORD = 'S'
+BLOB_RECORD = 'B'
+OBJECT_RECORD = 'O'
+END_RECORD = 'E'
+
+_RECORD_HEADER = '!cI'
+_RECORD_HEADER_SIZE = struct.calcsize(_RECORD_HEADER)
+_VERSION = '!H'
+_VERSION_SIZE = struct.calcsize(_VERSION)
+
+# The snapshot catalog is kept in this subdirectory of the snapshot
+# directory: LATEST_FILENAME holds the name of the latest snapshot and
+# INDEX_FILENAME lists the snapshots, oldest first
+CATALOG_SUBDIRECTORY = 'catalog'
+LATEST_FILENAME = 'latest'
+INDEX_FILENAME = 'index'
+
+# Attributes whose values (or, for RSPECS_ATTRIBUTE, the values in
+# whose dictionary) are stored as blobs
+BLOB_ATTRIBUTES = ('request_rspec', 'manifest_rspec')
+RSPECS_ATTRIBUTE = 'rspecs'
+
+
+class SnapshotFormatError(Exception) :
+    pass
+
+
+class BinarySnapshotEncoder :
+    """
+        Writes a binary snapshot to a file, one object at a time.
+        default is passed to json.dumps to encode objects it can't encode.
+    """
+
+    def __init__(self, file, default=None) :
+        self._file = file
+        self._default = default
+        self._prefixes = {} # URN prefix => number
+        self._blobs = {} # rspec => blob number, for the current slice
+        self._num_blobs = 0
+        file.write(MAGIC + struct.pack(_VERSION, BINARY_FORMAT_VERSION))
+
+    def _write_record(self, record_type, payload='') :
+        self._file.write(struct.pack(_RECORD_HEADER, record_type, 
+                                     len(payload)))
+        self._file.write(payload)
+
+    def _intern_urn(self, urn) :
+        split = urn.rfind('+') + 1
+        prefix = urn[:split]
+        if prefix not in self._prefixes :
+            self._prefixes[prefix] = len(self._prefixes)
+            self._write_record(PREFIX_RECORD, prefix.encode('utf-8'))
+        return {'__urn__' : [self._prefixes[prefix], urn[split:]]}
+
+    def _store_blob(self, rspec) :
+        if rspec not in self._blobs :
+            self._blobs[rspec] = self._num_blobs
+            self._num_blobs += 1
+            self._write_record(BLOB_RECORD, 
+                               zlib.compress(rspec.encode('utf-8')))
+        return {'__blob__' : self._blobs[rspec]}
+
+    def _compact(self, value) :
+        if isinstance(value, basestring) :
+            if value.startswith('urn:') and '+' in value :
+                return self._intern_urn(value)
+            return value
+        if isinstance(value, list) :
+            return [self._compact(item) for item in value]
+        if isinstance(value, dict) :
+            compacted = {}
+            for key, item in value.items() :
+                if key in BLOB_ATTRIBUTES and isinstance(item, basestring) :
+                    compacted[key] = self._store_blob(item)
+                elif key == RSPECS_ATTRIBUTE and isinstance(item, dict) :
+                    compacted[key] = \
+                        dict([(rspec_id, self._store_blob(rspec)) \
+                                  for rspec_id, rspec in item.items()])
+                else :
+                    compacted[key] = self._compact(item)
+            return compacted
+        return value
+
+    def start_slice(self) :
+        """
+            Start a slice: rspecs are shared among the objects written
+            until the next start_slice
+        """
+        self._blobs = {}
+        self._write_record(SLICE_RECORD)
+
+    def write_object(self, json_object) :
+        payload = json.dumps(self._compact(json_object), 
+                             default=self._default)
+        self._write_record(OBJECT_RECORD, payload)
+
+    def close(self) :
+        """
+            Write the end of the snapshot.  Doesn't close the file.
+        """
+        self._write_record(END_RECORD)
+
+
+def _read_exactly(file, size) :
+    data = file.read(size)
+    if len(data) != size :
+        raise SnapshotFormatError('Snapshot is truncated')
+    return data
+
+def _iterate_binary(file) :
+    prefixes = []
+    blobs = []
+    def expand(json_object) :
+        if '__urn__' in json_object :
+            prefix_number, rest = json_object['__urn__']
+            return prefixes[prefix_number] + rest
+        if '__blob__' in json_object :
+            return blobs[json_object['__blob__']]
+        return json_object
+
+    while True :
+        record_type, length = \
+            struct.unpack(_RECORD_HEADER, 
+                          _read_exactly(file, _RECORD_HEADER_SIZE))
+        payload = _read_exactly(file, length)
+        if record_type == OBJECT_RECORD :
+            yield json.loads(payload, object_hook=expand)
+        elif record_type == BLOB_RECORD :
+            blobs.append(zlib.decompress(payload).decode('utf-8'))
+        elif record_type == PREFIX_RECORD :
+            prefixes.append(payload.decode('utf-8'))
+        elif record_type == SLICE_RECORD :
+            # Blobs aren't shared between slices
+            blobs = [None] * len(blobs)
+        elif record_type == END_RECORD :
+            return
+        else :
+            raise SnapshotFormatError('Unknown snapshot record type %r' % \
+                                          record_type)
+
+def _read_version(file) :
+    """
+        Return the format version of the snapshot open in file, leaving
+        the file positioned after the version tag (binary snapshots) or at
+        the start (JSON snapshots)
+    """
+    header = file.read(len(MAGIC))
+    if header != MAGIC :
+        file.seek(0)
+        return JSON_FORMAT_VERSION
+    version, = struct.unpack(_VERSION, _read_exactly(file, _VERSION_SIZE))
+    return version
+
+def get_format_version(filename) :
+    """
+        Returns the format version of a snapshot file: JSON_FORMAT_VERSION
+        for JSON snapshots
+    """
+    file = open(filename, 'rb')
+    try :
+        return _read_version(file)
+    finally :
+        file.close()
+
+def iterate_snapshot(filename) :
+    """
+        Generate the objects in a snapshot file of any format
+    """
+    file = open(filename, 'rb')
+    try :
+        version = _read_version(file)
+        if version == JSON_FORMAT_VERSION :
+            for json_object in json.load(file) :
+                yield json_object
+        elif version == BINARY_FORMAT_VERSION :
+            for json_object in _iterate_binary(file) :
+                yield json_object
+        else :
+            raise SnapshotFormatError('Unsupported snapshot format version %d in %s' % \
+                                          (version, filename))
+    finally :
+        file.close()
+
+def load_snapshot(filename) :
+    """
+        Returns the list of objects in a snapshot file of any format
+    """
+    return list(iterate_snapshot(filename))
+
+def list_snapshots(directory) :
+    """
+        Returns the files in a snapshot directory, oldest first.  This
+        lists the whole directory: use find_latest_snapshot to find the
+        latest snapshot.
+    """
+    files = [os.path.join(directory, name) for name in os.listdir(directory)
+             if os.path.isfile(os.path.join(directory, name))]
+    files.sort(key = lambda name: os.path.getmtime(name))
+    return files
+
+def find_latest_snapshot(directory) :
+    """
+        Returns the latest snapshot file in a snapshot directory (None if 
+        there are none).  Uses the catalog's pointer to the latest snapshot
+        if there is one, otherwise lists the directory.
+    """
+    latest_filename = os.path.join(directory, CATALOG_SUBDIRECTORY, 
+                                   LATEST_FILENAME)
+    try :
+        file = open(latest_filename, 'r')
+        try :
+            snapshot = os.path.join(directory, file.read().strip())
+        finally :
+            file.close()
+        if os.path.isfile(snapshot) :
+            return snapshot
+    except IOError :
+        pass
+    if not os.path.isdir(directory) :
+        return None
+    files = list_snapshots(directory)
+    if len(files) == 0 :
+        return None
+    return files[-1]
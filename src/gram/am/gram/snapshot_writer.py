@@ -0,0 +1,234 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Background writer of aggregate state snapshots.
+#
+# Writing a snapshot (Archiving.write_state) encodes every slice and sliver
+# at the aggregate and waits for the disk, which is too slow to do on the
+# thread handling an AM API call.  With config.async_snapshots set,
+# GramManager.persist_state hands the state to a SnapshotWriter instead.
+# The caller encodes only the slice it changed (while it holds the slice's
+# lock, so the encoding is consistent); the encodings of the other slices
+# are kept from earlier calls.  The writer thread writes the latest state
+# in a new snapshot file through Archiving.write_encoded_state.  Calls
+# made while a snapshot is being written are merged into the next
+# snapshot.  A caller that needs the state on disk before it returns (e.g.
+# delete) asks for a synchronous write and waits for the snapshot that
+# includes its changes; if that snapshot can't be written, it gets a
+# SnapshotWriteError (the writer keeps retrying).  snapshot_written, if
+# given, is called with the name of each snapshot written (e.g. to add it
+# to the snapshot catalog).
+
+import json
+import threading
+import time
+import weakref
+
+import config
+import Archiving
+from manage_ssh_proxy import SSHProxyTable
+
+
+class SnapshotWriteError(Exception) :
+    pass
+
+
+class SnapshotWriter :
+
+    RETRY_INTERVAL = 5 # Seconds between attempts to write a snapshot
+
+    def __init__(self, stitching_handler, get_snapshot_filename,
+                 snapshot_written=None) :
+        self._stitching_handler = stitching_handler
+        self._get_snapshot_filename = get_snapshot_filename
+        self._snapshot_written = snapshot_written
+        self._lock = threading.Condition(threading.Lock())
+        # Slice URN => {URN => JSON encoding} of the slice and its slivers.
+        # Replaced rather than modified when a slice changes, so that the
+        # writer thread can use it without holding the lock.
+        self._encoded_slices = {}
+        # slice URN => (Slice, version) of the encoding in _encoded_slices
+        self._slice_versions = {}
+        self._deleted_slices = weakref.WeakKeyDictionary() # Slice => True
+        self._version = 0 # Version of the latest slice encoding
+        self._encoded_state = [] # Gram manager and SSH proxy state
+        self._requested = 0 # Number of the latest request for a snapshot
+        self._written = 0 # Latest request included in a written snapshot
+        self._failed = 0 # Latest request whose snapshot failed to write
+        self._error = None # Error of the latest failed write
+        self._writes = 0
+        self._thread = None
+
+    def start(self, slices) :
+        """
+            Start the writer thread with the encodings of the given
+            (restored) slices
+        """
+        encoder = Archiving.GramJSONEncoder(self._stitching_handler)
+        for slice_urn, slice_object in slices.items() :
+            version, self._encoded_slices[slice_urn] = \
+                self._encode_slice(encoder, slice_object)
+            self._slice_versions[slice_urn] = (slice_object, version)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    # Returns (version, JSON encodings) of a slice and its slivers.  The
+    # slice is encoded holding its read lock, so an encoding with a higher
+    # version never shows an older state of the slice.
+    def _encode_slice(self, encoder, slice_object) :
+        with slice_object.getReadLock() :
+            self._lock.acquire()
+            try :
+                self._version += 1
+                version = self._version
+            finally :
+                self._lock.release()
+            return version, Archiving.encode_slice(encoder, slice_object)
+
+    def persist(self, slices, slice_object, gram_manager, sync=False) :
+        """
+            Request a snapshot of the given slices after a change to 
+            slice_object (to any of them if slice_object is None).  If
+            slice_object is no longer in slices, it has been deleted.  If
+            sync is set, return once the snapshot has been written; raise
+            SnapshotWriteError if it could not be written.
+        """
+        if slice_object is None :
+            changed_slices = slices.values()
+        else :
+            changed_slices = [slice_object]
+        # Concurrent calls may store their encodings in either order: the
+        # versions of the encodings keep an older one from replacing a
+        # newer one.
+        encoder = Archiving.GramJSONEncoder(self._stitching_handler)
+        changed = {}
+        for slice_urn, the_slice in slices.items() :
+            if the_slice in changed_slices or \
+                    slice_urn not in self._encoded_slices :
+                changed[slice_urn] = (the_slice,) + \
+                    self._encode_slice(encoder, the_slice)
+
+        self._lock.acquire()
+        try :
+            if slice_object is not None and \
+                    slices.get(slice_object.getSliceURN()) is not slice_object :
+                # The slice has been deleted.  (Slices are only removed
+                # this way: slices may be missing from the slices of a
+                # call that started before they were added.)
+                self._deleted_slices[slice_object] = True
+            encoded_slices = {}
+            slice_versions = {}
+            for slice_urn, (the_slice, version) in \
+                    self._slice_versions.items() :
+                if the_slice not in self._deleted_slices :
+                    encoded_slices[slice_urn] = \
+                        self._encoded_slices[slice_urn]
+                    slice_versions[slice_urn] = (the_slice, version)
+            for slice_urn, (the_slice, version, encoded) in changed.items() :
+                if the_slice in self._deleted_slices :
+                    continue
+                stored = slice_versions.get(slice_urn)
+                if stored is not None and stored[0] is the_slice and \
+                        stored[1] > version :
+                    # A newer encoding has been stored already
+                    continue
+                encoded_slices[slice_urn] = encoded
+                slice_versions[slice_urn] = (the_slice, version)
+            self._encoded_slices = encoded_slices
+            self._slice_versions = slice_versions
+            # Encoded holding the lock, so that the latest call sets it
+            self._encoded_state = \
+                [json.dumps({"GRAM_MANAGER_STATE" : \
+                                 gram_manager.getPersistentState()}),
+                 json.dumps({"SSH_PROXY" : SSHProxyTable._get()})]
+            self._requested += 1
+            request = self._requested
+            self._lock.notifyAll()
+            if sync :
+                while self._written < request :
+                    if self._failed >= request :
+                        raise SnapshotWriteError(
+                            "Failed to write snapshot: %s" % self._error)
+                    self._lock.wait()
+        finally :
+            self._lock.release()
+
+    def _run(self) :
+        while True :
+            self._lock.acquire()
+            try :
+                while self._written == self._requested :
+                    self._lock.wait()
+                request = self._requested
+                encoded_slices = self._encoded_slices
+                encoded_state = self._encoded_state
+            finally :
+                self._lock.release()
+
+            start_time = time.time()
+            filename = self._get_snapshot_filename()
+            try :
+                Archiving.write_encoded_state(filename, encoded_slices,
+                                              encoded_state)
+            except Exception, e :
+                config.logger.error("Failed to write snapshot %s: %s" % \
+                                        (filename, e))
+                # Fail the synchronous requests waiting for this snapshot
+                # and try again (with any later changes) after a while
+                self._lock.acquire()
+                try :
+                    self._failed = request
+                    self._error = e
+                    self._lock.notifyAll()
+                finally :
+                    self._lock.release()
+                time.sleep(self.RETRY_INTERVAL)
+                continue
+            config.logger.info("Wrote snapshot %s in %.2f sec" % \
+                                   (filename, time.time() - start_time))
+
+            self._lock.acquire()
+            try :
+                self._writes += 1
+                self._written = request
+                self._lock.notifyAll()
+            finally :
+                self._lock.release()
+            if self._snapshot_written :
+                try :
+                    self._snapshot_written(filename)
+                except Exception, e :
+                    config.logger.error("Failed to add snapshot %s: %s" % \
+                                            (filename, e))
+
+    def getStatistics(self) :
+        """
+            Returns {'requests', 'writes'}: the number of snapshots 
+            requested and written
+        """
+        self._lock.acquire()
+        try :
+            return {'requests' : self._requested, 'writes' : self._writes}
+        finally :
+            self._lock.release()
@@ -0,0 +1,358 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Append-only journal of changes to the aggregate state.
+#
+# Archiving.write_state saves every slice and sliver at the aggregate (with
+# their request and manifest rspecs) to a new snapshot file, so the cost of
+# persisting state grows with the size of the aggregate rather than with
+# the size of a change.  When config.state_journal is set,
+# GramManager.persist_state instead appends to a journal the JSON encoding
+# of each slice and sliver that changed since the previous call (or a
+# record of its deletion), followed by a commit record, and fsyncs the
+# journal once per call.
+#
+# Journal records are written to numbered segment files in the 'journal'
+# subdirectory of the snapshot directory.  Once a segment holds
+# config.state_journal_compact_records records, a new segment is started
+# and a background thread writes a checkpoint: an ordinary snapshot file
+# holding the state up to the new segment and tagged with its number.  The
+# segments covered by the checkpoint are then removed.  read_state restores
+# a snapshot and replays the journal segments that follow it (see
+# journal_format.py, which the monitoring tools use to read the state).
+
+import json
+import os
+import sys
+import threading
+import time
+import weakref
+
+import config
+import Archiving
+import journal_format
+from journal_format import JOURNAL_SUBDIRECTORY, CHECKPOINT_MARKER, \
+    GRAM_MANAGER_STATE, SSH_PROXY, list_segments, segment_filename
+from manage_ssh_proxy import SSHProxyTable
+
+
+def read_state(filename, gram_manager, stitching_handler) :
+    """
+        Restore slices and slivers from a snapshot file and the journal
+        that follows it.  Returns a dictionary of slices indexed by
+        slice URN, like Archiving.read_state.
+    """
+    return Archiving.restore_objects(journal_format.load_state(filename),
+                                     gram_manager, stitching_handler)
+
+
+class StateJournal :
+    """
+        Journal of the changes to the slices and slivers at the aggregate.
+        get_snapshot_filename is called to name each checkpoint and
+        snapshot_written (if given) with the name of each checkpoint written.
+    """
+
+    def __init__(self, snapshot_directory, stitching_handler,
+                 get_snapshot_filename, snapshot_written=None) :
+        self._journal_directory = os.path.join(snapshot_directory, 
+                                               JOURNAL_SUBDIRECTORY)
+        self._stitching_handler = stitching_handler
+        self._get_snapshot_filename = get_snapshot_filename
+        self._snapshot_written = snapshot_written
+        self._lock = threading.Lock()
+        self._records = {} # key => JSON encoding of the object last journaled
+        self._slice_keys = {} # slice URN => keys of the slice and its slivers
+        # slice URN => (Slice, version) of the encoding last journaled
+        self._slice_versions = {}
+        self._deleted_slices = weakref.WeakKeyDictionary() # Slice => True
+        self._version_lock = threading.Lock()
+        self._version = 0 # Version of the latest slice encoding
+        self._ssh_proxy = {} # SSH proxy table last journaled
+        self._segment = None # The open journal segment file
+        self._segment_number = 0
+        self._segment_records = 0 # Records written to the open segment
+        self._compacting = False
+        self._sequence_number = 0 # Number of the last commit
+
+    def start(self, slices, gram_manager) :
+        """
+            Start journaling from the given (restored) slices.  Writes a
+            checkpoint of them and removes any older journal segments.
+        """
+        if not os.path.exists(self._journal_directory) :
+            os.makedirs(self._journal_directory)
+        segment_numbers = list_segments(self._journal_directory)
+        if len(segment_numbers) > 0 :
+            self._segment_number = segment_numbers[-1] + 1
+
+        encoder = Archiving.GramJSONEncoder(self._stitching_handler)
+        for slice_urn, slice_object in slices.items() :
+            version, encoded = self._encode_slice(encoder, slice_object)
+            self._records.update(encoded)
+            self._slice_keys[slice_urn] = set(encoded.keys())
+            self._slice_versions[slice_urn] = (slice_object, version)
+        self._records[GRAM_MANAGER_STATE] = \
+            json.dumps({GRAM_MANAGER_STATE : gram_manager.getPersistentState()})
+        self._ssh_proxy = dict(SSHProxyTable._get())
+        self._records[SSH_PROXY] = json.dumps({SSH_PROXY : self._ssh_proxy})
+
+        self._segment = open(segment_filename(self._journal_directory,
+                                               self._segment_number), 'a')
+        self._write_checkpoint(self._get_checkpoint_state(), 
+                               self._segment_number)
+
+    # Returns (version, JSON encodings) of a slice and its slivers.  The
+    # slice is encoded holding its read lock, so an encoding with a higher
+    # version never shows an older state of the slice.
+    def _encode_slice(self, encoder, slice_object) :
+        with slice_object.getReadLock() :
+            self._version_lock.acquire()
+            try :
+                self._version += 1
+                version = self._version
+            finally :
+                self._version_lock.release()
+            return version, Archiving.encode_slice(encoder, slice_object)
+
+    def record(self, slices, slice_object, gram_manager) :
+        """
+            Journal the changes to the given slice (to all slices if 
+            slice_object is None) and to the gram manager and SSH proxy 
+            state since the last call.  If slice_object is no longer in
+            slices, journal its deletion.  Returns the number of records
+            written.
+        """
+        if slice_object is None :
+            changed_slices = slices.values()
+        else :
+            changed_slices = [slice_object]
+
+        # Encode the slices before taking the lock.  Concurrent calls may
+        # journal their encodings in either order: the versions of the
+        # encodings keep an older one from replacing a newer one.
+        encoder = Archiving.GramJSONEncoder(self._stitching_handler)
+        encoded_slices = {}
+        for changed_slice in changed_slices :
+            slice_urn = changed_slice.getSliceURN()
+            if slices.get(slice_urn) is changed_slice :
+                encoded_slices[slice_urn] = (changed_slice,) + \
+                    self._encode_slice(encoder, changed_slice)
+
+        self._lock.acquire()
+        try :
+            lines = []
+            if slice_object is not None and \
+                    slices.get(slice_object.getSliceURN()) is not slice_object :
+                # The slice has been deleted.  (Slices are only removed
+                # this way: slices may be missing from the slices of a
+                # call that started before they were added.)
+                self._deleted_slices[slice_object] = True
+                slice_urn = slice_object.getSliceURN()
+                journaled = self._slice_versions.get(slice_urn)
+                if journaled is not None and journaled[0] is slice_object :
+                    del self._slice_versions[slice_urn]
+                    for key in self._slice_keys.pop(slice_urn) :
+                        lines.append(json.dumps({'delete' : key}) + '\n')
+                        del self._records[key]
+
+            for slice_urn, (changed_slice, version, encoded) in \
+                    encoded_slices.items() :
+                if changed_slice in self._deleted_slices :
+                    continue
+                journaled = self._slice_versions.get(slice_urn)
+                if journaled is not None and journaled[0] is changed_slice \
+                        and journaled[1] > version :
+                    # A newer encoding has been journaled already
+                    continue
+                self._slice_versions[slice_urn] = (changed_slice, version)
+                keys = set(encoded.keys())
+                for key in self._slice_keys.get(slice_urn, set()) - keys :
+                    lines.append(json.dumps({'delete' : key}) + '\n')
+                    del self._records[key]
+                for key, data in encoded.items() :
+                    if self._records.get(key) != data :
+                        lines.append('{"put": ' + data + '}\n')
+                        self._records[key] = data
+                self._slice_keys[slice_urn] = keys
+
+            data = json.dumps({GRAM_MANAGER_STATE : \
+                                   gram_manager.getPersistentState()})
+            if self._records.get(GRAM_MANAGER_STATE) != data :
+                lines.append('{"put": ' + data + '}\n')
+                self._records[GRAM_MANAGER_STATE] = data
+            ssh_proxy = SSHProxyTable._get()
+            if ssh_proxy != self._ssh_proxy :
+                self._ssh_proxy = dict(ssh_proxy)
+                data = json.dumps({SSH_PROXY : self._ssh_proxy})
+                lines.append('{"put": ' + data + '}\n')
+                self._records[SSH_PROXY] = data
+
+            if len(lines) == 0 :
+                return 0
+            self._sequence_number += 1
+            lines.append(json.dumps({'commit' : self._sequence_number}) + '\n')
+            self._segment.write(''.join(lines))
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+            self._segment_records += len(lines)
+
+            if self._segment_records >= config.state_journal_compact_records \
+                    and not self._compacting :
+                self._start_compaction()
+            return len(lines)
+        finally :
+            self._lock.release()
+
+    # Called with self._lock held: start a new segment and write a 
+    # checkpoint of the state up to it in the background
+    def _start_compaction(self) :
+        self._segment.close()
+        self._segment_number += 1
+        self._segment_records = 0
+        self._segment = open(segment_filename(self._journal_directory,
+                                               self._segment_number), 'a')
+        self._compacting = True
+        compaction = threading.Thread(target=self._compact,
+                                      args=(self._get_checkpoint_state(),
+                                            self._segment_number))
+        compaction.setDaemon(True)
+        compaction.start()
+
+    # Called with self._lock held: returns the journaled state as
+    # ({slice URN => {URN => JSON encoding}}, [other JSON encodings])
+    def _get_checkpoint_state(self) :
+        encoded_slices = {}
+        for slice_urn, keys in self._slice_keys.items() :
+            encoded_slices[slice_urn] = \
+                dict([(key, self._records[key]) for key in keys])
+        encoded_state = [self._records[GRAM_MANAGER_STATE], 
+                         self._records[SSH_PROXY]]
+        return encoded_slices, encoded_state
+
+    def _compact(self, checkpoint_state, segment_number) :
+        try :
+            self._write_checkpoint(checkpoint_state, segment_number)
+        except Exception, e :
+            config.logger.error('Failed to write journal checkpoint: %s' % e)
+        self._lock.acquire()
+        try :
+            self._compacting = False
+        finally :
+            self._lock.release()
+
+    def _write_checkpoint(self, checkpoint_state, segment_number) :
+        """
+            Write the given state to a new snapshot file as a checkpoint
+            for the journal segments before segment_number, then remove 
+            those segments
+        """
+        start_time = time.time()
+        encoded_slices, encoded_state = checkpoint_state
+        marker = json.dumps({CHECKPOINT_MARKER : segment_number})
+        filename = self._get_snapshot_filename()
+        Archiving.write_encoded_state(filename, encoded_slices, 
+                                      encoded_state + [marker])
+        if self._snapshot_written :
+            self._snapshot_written(filename)
+
+        for old_segment_number in list_segments(self._journal_directory) :
+            if old_segment_number < segment_number :
+                os.unlink(segment_filename(self._journal_directory, 
+                                            old_segment_number))
+        config.logger.info('Wrote journal checkpoint %s in %.2f sec' % \
+                               (filename, time.time() - start_time))
+
+
+if __name__ == "__main__":
+    # Benchmark: compare the time taken to persist the aggregate state
+    # after a change to one slice by writing a full snapshot
+    # (Archiving.write_state) and by journaling the change.
+    # Usage: python state_journal.py [num_slivers ...]
+    import logging
+    import shutil
+    import tempfile
+    from resources import Slice, VirtualMachine, NetworkInterface, \
+        NetworkLink
+    import stitching
+
+    class _BenchmarkGramManager :
+        def getPersistentState(self) : return {}
+
+    logging.basicConfig()
+    config.logger = logging.getLogger('state_journal')
+    config.state_journal_compact_records = sys.maxint
+    config.stitching_info = {'edge_points' : [], 'aggregate_id' : None,
+                             'aggregate_url' : None}
+    rspec = '<node client_id="vm" exclusive="false">' + 'x' * 2000 + \
+        '</node>'
+    sizes = [1000, 10000, 100000]
+    if len(sys.argv) > 1 :
+        sizes = [int(size) for size in sys.argv[1:]]
+
+    for num_slivers in sizes :
+        # Slices of 5 VMs, each with a NIC on one link: 11 slivers
+        slices = {}
+        for slice_num in range(max(1, num_slivers / 11)) :
+            slice_urn = 'urn:publicid:IDN+geni:bench+slice+s%d' % slice_num
+            slice_object = Slice(slice_urn)
+            slice_object.setTenantUUID('tenant-%d' % slice_num)
+            slice_object.setManifestRspec(rspec)
+            link = NetworkLink(slice_object)
+            for vm_num in range(5) :
+                vm = VirtualMachine(slice_object)
+                vm.setManifestRspec(rspec)
+                nic = NetworkInterface(slice_object, vm)
+                vm.addNetworkInterface(nic)
+                nic.setLink(link)
+                link.addEndpoint(nic)
+            slices[slice_urn] = slice_object
+        changed_slice = slices.values()[0]
+        stitching_handler = stitching.Stitching()
+        gram_manager = _BenchmarkGramManager()
+        directory = tempfile.mkdtemp()
+        try :
+            start_time = time.time()
+            Archiving.write_state(os.path.join(directory, 'snapshot.json'),
+                                  gram_manager, slices, stitching_handler)
+            snapshot_time = time.time() - start_time
+
+            checkpoint_num = [0]
+            def get_snapshot_filename() :
+                checkpoint_num[0] += 1
+                return os.path.join(directory, 
+                                    'checkpoint_%d.json' % checkpoint_num[0])
+            journal = StateJournal(directory, stitching_handler, 
+                                   get_snapshot_filename)
+            journal.start(slices, gram_manager)
+            num_persists = 20
+            start_time = time.time()
+            for i in range(num_persists) :
+                changed_slice.getVMs()[0].setOperationalState('state-%d' % i)
+                journal.record(slices, changed_slice, gram_manager)
+            journal_time = (time.time() - start_time) / num_persists
+
+            print '%7d slivers: snapshot %8.1f ms, journal %6.2f ms' % \
+                (num_slivers, snapshot_time * 1000, journal_time * 1000)
+        finally :
+            shutil.rmtree(directory)
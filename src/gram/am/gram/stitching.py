@@ -29,6 +29,7 @@ import json
 import logging
 import sys
 import resources
+import rspec_parser
 from vlan_pool import VLANPool
 
 logger = logging.getLogger('gram.stitching')
@@ -202,6 +203,12 @@ class Stitching:
         data = json.loads(data)
         return data
 
+    # Return a value that changes whenever the VLAN tags available at
+    # any edge point (and so the stitching advertisement) change
+    def getAvailabilityVersion(self):
+        return sum(edge_point._vlans.getChangeCount() \
+                       for edge_point in self._edge_points.values())
+
     def isLinkOfEdgePoint(self, link):
         return link in self._edge_points
 
@@ -323,52 +330,32 @@ class Stitching:
         return doc
 
     # Allocate VLAN's for stitching links
+    # The request is given as a string or (shared) rspec_parser.RequestRSpec
     # Return success, message, error_code
     def allocate_external_vlan_tags(self, link_sliver_object, request_rspec, is_v2_allocation):
-        if isinstance(request_rspec, basestring): request_rspec = parseString(request_rspec)
-        error_string, error_code, request_details = \
-            self.parseRequestRSpec(request_rspec)
-        if not request_details:
+        request_rspec = rspec_parser.parse(request_rspec)
+        if request_rspec.getStitching() is None:
             return True, '', constants.SUCCESS # No stitching, no error
 
         sliver_id = link_sliver_object.getSliverURN()
 
-        request = request_rspec.getElementsByTagName('rspec')[0]
-        stitching_request = request.getElementsByTagName('stitching')[0]
-        stitching_request_paths = stitching_request.getElementsByTagName('path')
-
-#        print "SRP = %s" % stitching_request_paths
-
-        for path in stitching_request_paths:
-#            print "PATH = %s" % path.toxml()
-            path_id = path.attributes['id'].value
-#            print "PATH_ID = %s LINK_ID = %s" % (path_id, link_sliver_object.getName())
-            if path_id != link_sliver_object.getName(): continue
-            stitching_request_hops = path.getElementsByTagName('hop')
-            for hop in stitching_request_hops:
-#                print "   HOP = %s" % hop.toxml()
-                links = hop.getElementsByTagName('link')
-                for request_link in links:
-#                    print "      REQUEST_LINK = %s" % request_link.toxml()
-                    link_id = request_link.attributes['id'].value
-
-                    # Allocate a VLAN for manifest based on request
-                    # and stick in appropriate field of manifest
-#                    print 'allocating stitching vlan'
-#                    print self._edge_points
-#                    print "EDGE_POINTS = %s" % self._edge_points
-#                    print "LINK_ID = %s " % link_id
-
-#		    stitchport = self._edge_points[link_id]
-#		    edge_point = self._edge_points[stitchport]
-#		    print "%s" % edge_point
-#                    print link_id
+        # The path with the link client_id
+        for path in request_rspec.getStitchingPaths(link_sliver_object.getName()):
+            for hop in rspec_parser.findAll(path, 'hop'):
+                for request_link in rspec_parser.findAll(hop, 'link'):
+                    link_id = request_link.get('id')
                     if link_id in self._edge_points: # One of my links
-                        success, tag = self.allocateVLAN(link_id, 
-                                                         request_link, 
-                                                         sliver_id, 
-                                                         True,
-                                                         is_v2_allocation)
+                        request_suggested = \
+                            rspec_parser.findText(request_link, 
+                                                  'suggestedVLANRange')
+                        request_available = \
+                            rspec_parser.findText(request_link, 
+                                                  'vlanRangeAvailability')
+                        success, tag, available = \
+                            self.selectVLAN(link_id, sliver_id, True, 
+                                            is_v2_allocation,
+                                            request_suggested, 
+                                            request_available)
                         if not success:
                             return False, "Failure to allocate VLAN in requested range", constants.VLAN_UNAVAILABLE
                         else:
@@ -431,6 +418,21 @@ class Stitching:
             (link_id, sliver_id, allocate, is_v2_allocation, hop_link.toxml()))
 
         request_suggested, request_available = self.parseVLANTagInfo(hop_link)
+        success, selected_vlan, available = \
+            self.selectVLAN(link_id, sliver_id, allocate, is_v2_allocation,
+                            request_suggested, request_available)
+        if not success: return False, None # Failure
+        self.setVLANTagInfo(hop_link, selected_vlan, available)
+
+        return True, selected_vlan # Success
+
+    # Select the VLAN tag for a sliver on the given edge point link, given
+    # the suggested and available tags of the request
+    # If 'allocate', pick a new tag (if available)
+    # If not 'allocate', use the one that is already allocated
+    # Return success, the tag and the availability to put in the manifest
+    def selectVLAN(self, link_id, sliver_id, allocate, is_v2_allocation,
+                   request_suggested, request_available):
         edge_point = self._edge_points[link_id]
         if allocate:
             # Grab a new tag from available list
@@ -441,7 +443,7 @@ class Stitching:
             selected_vlan, success = \
                 edge_point.allocateTag(request_suggested, request_available, \
                                            is_v2_allocation)
-            if not success: return False, None # Failure
+            if not success: return False, None, None # Failure
             self._reservations[sliver_id] = {'vlan_tag' : selected_vlan,
                                              'link' : link_id}
         else:
@@ -449,9 +451,7 @@ class Stitching:
             reservation = self._reservations[sliver_id]
             selected_vlan = reservation['vlan_tag']
             available = selected_vlan
-        self.setVLANTagInfo(hop_link, selected_vlan, available)
-
-        return True, selected_vlan # Success
+        return True, selected_vlan, available
 
     def setVLANTagInfo(self, hop_link, suggested, available):
         availability_nodes = hop_link.getElementsByTagName('vlanRangeAvailability')
@@ -489,16 +489,13 @@ class Stitching:
         return has_my_cmi and has_another_cmi
 
     # Find the hop that corresponds to an edge point
-    def findLocalHop(self, stitching, link_id):
+    # in the stitching path of the given link of a rspec_parser.RequestRSpec
+    def findLocalHop(self, request, link_id):
         local_hop = None
-        paths = stitching.getElementsByTagName('path')
-        for path in paths:
-            if path.attributes['id'].value != link_id: continue
-            hops = path.getElementsByTagName('hop')
-            for hop in hops:
-                hop_links = hop.getElementsByTagName('link')
-                for hop_link in hop_links:
-                    hop_link_id = hop_link.attributes['id'].value
+        for path in request.getStitchingPaths(link_id):
+            for hop in rspec_parser.findAll(path, 'hop'):
+                for hop_link in rspec_parser.findAll(hop, 'link'):
+                    hop_link_id = hop_link.get('id')
                     if self.isLinkOfEdgePoint(hop_link_id):
                         local_hop = hop
                         break
@@ -533,46 +530,43 @@ class Stitching:
         error_code = constants.SUCCESS
         request_details = None
 
-        if isinstance(request_rspec, basestring):
-            request_rspec = parseString(request_rspec)
-        request = request_rspec.getElementsByTagName('rspec')[0]
+        # A string or (shared) rspec_parser.RequestRSpec
+        request_rspec = rspec_parser.parse(request_rspec)
 
-        nodes = request.getElementsByTagName('node')
+        nodes = request_rspec.getNodes()
         
 
 #        print ' parsing stitching rspec'
         # Find nodes that is mine that has an interface in a stitching link
         my_nodes_by_interface = {}
         for node in nodes:
-            node_attributes = node.attributes
+            node_attributes = node.attrib
             if not node_attributes.has_key('component_manager_id') :
                 continue
-            cmid = node.attributes['component_manager_id'].value
+            cmid = node_attributes['component_manager_id']
             if cmid == self._aggregate_id:
-                node_id = node.attributes['client_id'].value
-                interfaces = node.getElementsByTagName('interface')
+                node_id = node_attributes['client_id']
+                interfaces = rspec_parser.findAll(node, 'interface')
                 for interface in interfaces:
-                    interface_id= interface.attributes['client_id'].value
+                    interface_id= interface.get('client_id')
                     my_nodes_by_interface[interface_id] = node_id
 
         # Find links that contain my CM
-        links = [child for child in request.childNodes if child.nodeName == 'link']
+        links = request_rspec.getLinks()
         my_links = []
         for link in links:
-            cms = link.getElementsByTagName('component_manager')
+            cms = rspec_parser.findAll(link, 'component_manager')
             for cm in cms:
-                if cm.attributes['name'].value == self._aggregate_id:
+                if cm.get('name') == self._aggregate_id:
                     my_links.append(link)
                     break
 
         # Find hops that are mine ad involved in link-referenced stitching
-        stitching_elts = request.getElementsByTagName('stitching')
-        if len(stitching_elts) > 0:
-            stitching = stitching_elts[0]
+        if request_rspec.getStitching() is not None:
             my_hops_by_path_id = {}
             for link in my_links:
-                link_id = link.attributes['client_id'].value
-                my_hop = self.findLocalHop(stitching, link_id)
+                link_id = link.get('client_id')
+                my_hop = self.findLocalHop(request_rspec, link_id)
                 my_hops_by_path_id[link_id] = my_hop
 
 #            print "MY NODES and IFS:" + str(my_nodes_by_interface)
@@ -623,7 +617,7 @@ if __name__ == '__main__':
     sliver_id2 = link_sliver2.getSliverURN()
 
     success, msg, code = \
-        stitching.allocate_external_vlan_tags(link_sliver1, request, True);
+        stitching.allocate_external_vlan_tags(link_sliver1, request_raw, True);
     if not success:
         print "Error: %s %s %s" % (success, msg, code)
     manifest, output, code = stitching.generateManifest(request, 
@@ -645,7 +639,7 @@ if __name__ == '__main__':
         print "Link %s EP %s" % (link, edge_point)
 
     success, msg, code = \
-        stitching.allocate_external_vlan_tags(link_sliver2, request, True);
+        stitching.allocate_external_vlan_tags(link_sliver2, request_raw, True);
     if not success:
         print "Error: %s %s %s" % (success, msg, code)
     manifest, output, code = stitching.generateManifest(request, 
@@ -656,7 +650,7 @@ if __name__ == '__main__':
 
 
     success, msg, code = \
-        stitching.allocate_external_vlan_tags(link_sliver2, request, False);
+        stitching.allocate_external_vlan_tags(link_sliver2, request_raw, False);
     if not success:
         print "Error: %s %s %s" % (success, msg, code)
     manifest, output, code = stitching.generateManifest(request, 
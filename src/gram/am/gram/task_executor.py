@@ -0,0 +1,184 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Run a set of tasks (e.g. the OpenStack calls that provision a slice) on
+# a bounded pool of worker threads, honoring dependencies between them.
+#
+# A task is started once all the tasks it depends on have finished.  A
+# task fails if its function raises an exception; tasks that depend on a
+# failed task are not run at all.  For example, provisionResources creates
+# each link's network in its own task and each NIC's port in a task that
+# depends on the task for the NIC's link:
+#
+#    graph = task_executor.TaskGraph(config.provision_concurrency)
+#    net_task = graph.add('net-create ' + link.getName(), create_net, (link,))
+#    graph.add('port-create ' + nic.getName(), create_port, (nic,),
+#              depends_on=[net_task])
+#    if not graph.run() :
+#        ... graph.getFailedTasks() ...
+
+import Queue
+import threading
+import time
+
+import config
+
+# Task states
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SKIPPED = 'skipped' # A task it depends on failed
+
+
+class Task:
+    def __init__(self, name, function, args, depends_on):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.state = PENDING
+        self.result = None # Return value of function
+        self.exception = None # Exception raised by function
+        self.start_time = None
+        self.end_time = None
+        self._dependencies = list(depends_on)
+        self._dependents = []
+        self._num_unfinished_dependencies = len(self._dependencies)
+
+    def getDuration(self):
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def __str__(self):
+        return "#<Task %s %s>" % (self.name, self.state)
+
+
+class TaskGraph:
+
+    def __init__(self, max_workers, name='tasks'):
+        self._max_workers = max(1, int(max_workers))
+        self._name = name
+        self._tasks = []
+        self._lock = threading.Lock()
+        self._ready = Queue.Queue()
+        self._num_unfinished = 0
+        self._done = threading.Event()
+
+    def add(self, name, function, args=(), depends_on=()):
+        """
+            Add a task that calls function(*args) after all tasks in
+            depends_on (tasks previously added to this graph) have
+            succeeded.  Returns the Task.
+        """
+        task = Task(name, function, args, depends_on)
+        for dependency in task._dependencies:
+            dependency._dependents.append(task)
+        self._tasks.append(task)
+        return task
+
+    def getTasks(self):
+        return self._tasks
+
+    def getFailedTasks(self):
+        """
+            Tasks that failed or were not run, in the order added
+        """
+        return [task for task in self._tasks \
+                    if task.state in [FAILED, SKIPPED]]
+
+    def run(self):
+        """
+            Run all the tasks and wait for them to finish.
+            Returns True if all tasks succeeded, False otherwise.
+        """
+        if len(self._tasks) == 0:
+            return True
+        start_time = time.time()
+        self._num_unfinished = len(self._tasks)
+        self._done.clear()
+        for task in self._tasks:
+            if task._num_unfinished_dependencies == 0:
+                self._ready.put(task)
+
+        num_workers = min(self._max_workers, len(self._tasks))
+        workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._work,
+                                      name='%s-%d' % (self._name, i))
+            worker.setDaemon(True)
+            workers.append(worker)
+            worker.start()
+
+        # Event.wait without a timeout can't be interrupted in python 2
+        while not self._done.isSet():
+            self._done.wait(1)
+        for worker in workers:
+            self._ready.put(None) # Tell the worker to exit
+        for worker in workers:
+            worker.join()
+
+        num_failed = len(self.getFailedTasks())
+        config.logger.info('Ran %d %s (%d failed) in %.2f sec with %d workers' \
+                               % (len(self._tasks), self._name, num_failed,
+                                  time.time() - start_time, num_workers))
+        return num_failed == 0
+
+    def _work(self):
+        while True:
+            task = self._ready.get()
+            if task is None:
+                return
+            task.state = RUNNING
+            task.start_time = time.time()
+            try:
+                task.result = task.function(*task.args)
+                task.state = SUCCEEDED
+            except Exception, e:
+                config.logger.error('Task %s failed: %s' % (task.name, str(e)))
+                task.exception = e
+                task.state = FAILED
+            task.end_time = time.time()
+            self._finished(task)
+
+    def _finished(self, task):
+        self._lock.acquire()
+        try:
+            finished = [task]
+            while finished:
+                task = finished.pop()
+                self._num_unfinished -= 1
+                for dependent in task._dependents:
+                    dependent._num_unfinished_dependencies -= 1
+                    if task.state != SUCCEEDED and dependent.state == PENDING:
+                        dependent.state = SKIPPED
+                    if dependent._num_unfinished_dependencies > 0:
+                        continue
+                    if dependent.state == SKIPPED:
+                        finished.append(dependent)
+                    else:
+                        self._ready.put(dependent)
+            if self._num_unfinished == 0:
+                self._done.set()
+        finally:
+            self._lock.release()
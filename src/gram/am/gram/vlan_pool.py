@@ -39,6 +39,7 @@ class VLANPool:
         self._available_vlans = [v for v in self._all_vlans]
         self._temporary_allocations = {} # tag => timestamp
         self._name = name
+        self._changes = 0 # Number of successful allocations and frees
 
     # Parse a comma-separated set of sorted tags into a list of tags
     # if 'any' return 'any'
@@ -95,6 +96,11 @@ class VLANPool:
     def getAvailableVLANs(self):
         return self._available_vlans
 
+    # Return the number of changes to the available tags (e.g. to tell
+    # whether a copy of dumpAvailableVLANs is still current)
+    def getChangeCount(self):
+        return self._changes
+
     # Return whether a given tag belongs to this pool but is allocated
     def isAllocated(self, tag):
         return tag in self._all_vlans and tag not in self._available_vlans
@@ -121,6 +127,7 @@ class VLANPool:
             if tag not in self._available_vlans: return False, None
             
             self._available_vlans.remove(tag)
+            self._changes += 1
 
             config.logger.info( "Allocated %d from VLAN pool %s" % \
                                     (tag, self._name))
@@ -135,6 +142,7 @@ class VLANPool:
             if tag in self._available_vlans: return False
             self._available_vlans.append(tag)
             self._available_vlans.sort()
+            self._changes += 1
             config.logger.info("Freed %d to VLAN pool %s" % (tag, self._name))
             return True
 
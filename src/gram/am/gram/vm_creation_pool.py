@@ -0,0 +1,189 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Pool of worker threads that create VMs for all slices.
+#
+# At most config.vm_creation_max_concurrent VMs are created at once over
+# all slices, and at most config.vm_creation_max_per_slice for any one
+# slice.  VM creation requests wait in a queue of at most
+# config.vm_creation_queue_size requests; submit blocks while the slice
+# is at its limit or the queue is full, so a huge request rspec can't
+# swamp the control node or the nova API.
+
+import Queue
+import random
+import threading
+import time
+
+import config
+
+
+class VMCreationRequest:
+    def __init__(self, slice_urn, name, function, args):
+        self.slice_urn = slice_urn
+        self.name = name
+        self.function = function
+        self.args = args
+        self.result = None
+        self.exception = None
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self._done = threading.Event()
+
+    def wait(self):
+        """
+            Wait for the request to finish and return the result of its
+            function
+        """
+        # Event.wait without a timeout can't be interrupted in python 2
+        while not self._done.isSet():
+            self._done.wait(1)
+        return self.result
+
+    def getQueueTime(self):
+        """
+            Seconds from submission until a worker started the request
+        """
+        if self.start_time is None:
+            return time.time() - self.submit_time
+        return self.start_time - self.submit_time
+
+    def getRunTime(self):
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+
+class VMCreationPool:
+
+    def __init__(self):
+        self._lock = threading.Condition(threading.Lock())
+        self._queue = None # Created with the workers on first use
+        self._workers = []
+        self._num_in_progress = {} # slice URN => # requests queued or running
+        self._num_running = 0
+
+    def _start(self):
+        # Called with self._lock held
+        if self._queue is not None:
+            return
+        self._queue = Queue.Queue(config.vm_creation_queue_size)
+        for i in range(config.vm_creation_max_concurrent):
+            worker = threading.Thread(target=self._work,
+                                      name='vm-creation-%d' % i)
+            worker.setDaemon(True)
+            self._workers.append(worker)
+            worker.start()
+
+    def submit(self, slice_urn, name, function, args):
+        """
+            Queue a request to call function(*args) to create a VM for the
+            given slice.  Blocks while the slice has its maximum number of
+            requests queued or running or the queue is full.
+            Returns the VMCreationRequest.
+        """
+        request = VMCreationRequest(slice_urn, name, function, args)
+        self._lock.acquire()
+        try:
+            self._start()
+            while self._num_in_progress.get(slice_urn, 0) >= \
+                    config.vm_creation_max_per_slice:
+                self._lock.wait(1)
+            self._num_in_progress[slice_urn] = \
+                self._num_in_progress.get(slice_urn, 0) + 1
+        finally:
+            self._lock.release()
+        self._queue.put(request)
+        return request
+
+    def _work(self):
+        while True:
+            request = self._queue.get()
+            self._lock.acquire()
+            self._num_running += 1
+            self._lock.release()
+            request.start_time = time.time()
+            try:
+                request.result = request.function(*request.args)
+            except Exception, e:
+                config.logger.error('Failed to create VM %s: %s' % \
+                                        (request.name, str(e)))
+                request.exception = e
+            request.end_time = time.time()
+
+            self._lock.acquire()
+            try:
+                self._num_running -= 1
+                self._num_in_progress[request.slice_urn] -= 1
+                if self._num_in_progress[request.slice_urn] == 0:
+                    del self._num_in_progress[request.slice_urn]
+                self._lock.notifyAll()
+            finally:
+                self._lock.release()
+            request._done.set()
+
+    def getStatus(self):
+        """
+            Returns {'running', 'queued', 'slices' : {slice URN => # requests
+            queued or running}}
+        """
+        self._lock.acquire()
+        try:
+            num_queued = 0
+            if self._queue is not None:
+                num_queued = self._queue.qsize()
+            return {'running' : self._num_running,
+                    'queued' : num_queued,
+                    'slices' : dict(self._num_in_progress)}
+        finally:
+            self._lock.release()
+
+
+def call_with_backoff(description, function, args, is_retryable):
+    """
+        Call function(*args), retrying up to config.vm_creation_max_retries
+        times if it raises an exception for which is_retryable(exception)
+        is True (e.g. the nova API rate limited us).  The n'th retry waits
+        a random time between 0 and config.vm_creation_retry_backoff * 2**n
+        seconds, so that VMs that were rate limited together don't all
+        retry at once.
+    """
+    attempt = 0
+    while True:
+        try:
+            return function(*args)
+        except Exception, e:
+            if attempt >= config.vm_creation_max_retries or \
+                    not is_retryable(e):
+                raise
+            delay = random.uniform(0, config.vm_creation_retry_backoff * \
+                                       (2 ** attempt))
+            attempt += 1
+            config.logger.info('%s was rate limited, retry %d in %.1f sec' % \
+                                   (description, attempt, delay))
+            time.sleep(delay)
+
+
+# The pool shared by the aggregate manager
+pool = VMCreationPool()
@@ -0,0 +1,113 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Short-lived cache of the status of the VMs of each tenant (slice), shared
+# by the Status and Describe calls for the slice.
+#
+# A snapshot of a tenant's VM states (and of the console logs of the VMs
+# whose images report boot completion there) is fetched at most once every
+# config.vm_status_refresh_interval seconds, because nova rate limits
+# these calls and omni clients poll Status constantly.  Callers that ask
+# while a snapshot is being fetched wait for it rather than fetching it
+# again.
+
+import threading
+import time
+
+import config
+
+
+class VMStatusSnapshot:
+    def __init__(self, states, console_logs, fetch_time):
+        self.states = states # VM UUID => nova status
+        self.console_logs = console_logs # VM UUID => output or None
+        self.fetch_time = fetch_time
+
+
+class VMStatusCache:
+
+    def __init__(self):
+        self._lock = threading.Condition(threading.Lock())
+        self._snapshots = {} # tenant UUID => VMStatusSnapshot
+        self._in_flight = set() # tenants whose snapshot is being fetched
+
+    def _is_fresh(self, snapshot, console_vm_uuids, now):
+        if snapshot is None or \
+                now - snapshot.fetch_time >= config.vm_status_refresh_interval:
+            return False
+        for vm_uuid in console_vm_uuids:
+            if not snapshot.console_logs.has_key(vm_uuid):
+                return False
+        return True
+
+    def get(self, tenant_uuid, console_vm_uuids, fetch):
+        """
+            Return a recent VMStatusSnapshot for the tenant, with the console
+            logs of (at least) the VMs in console_vm_uuids.  If there is
+            none, fetch(console_vm_uuids) is called to get
+            (states, console_logs).
+        """
+        self._lock.acquire()
+        try:
+            while True:
+                snapshot = self._snapshots.get(tenant_uuid)
+                if self._is_fresh(snapshot, console_vm_uuids, time.time()):
+                    return snapshot
+                if tenant_uuid not in self._in_flight:
+                    break
+                # Another thread is refreshing this tenant.  Use its result.
+                self._lock.wait()
+            self._in_flight.add(tenant_uuid)
+        finally:
+            self._lock.release()
+
+        snapshot = None
+        try:
+            states, console_logs = fetch(console_vm_uuids)
+            snapshot = VMStatusSnapshot(states, console_logs, time.time())
+        finally:
+            self._lock.acquire()
+            try:
+                if snapshot is not None:
+                    self._snapshots[tenant_uuid] = snapshot
+                self._in_flight.discard(tenant_uuid)
+                self._lock.notifyAll()
+            finally:
+                self._lock.release()
+        return snapshot
+
+    def invalidate(self, tenant_uuid):
+        """
+            Discard the tenant's snapshot, e.g. because a VM was rebooted
+            or the tenant deleted
+        """
+        self._lock.acquire()
+        try:
+            if self._snapshots.has_key(tenant_uuid):
+                del self._snapshots[tenant_uuid]
+        finally:
+            self._lock.release()
+
+
+# The cache shared by the aggregate manager
+status_cache = VMStatusCache()
@@ -0,0 +1,190 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Background tracking of VMs booted in asynchronous provisioning mode
+# (config.async_provisioning).
+#
+# Provision returns as soon as nova has accepted the boot requests.  The
+# watcher thread then polls the status of all the VMs it is watching with
+# a single list call every config.vm_watcher_poll_interval seconds and
+# updates their operational state: geni_configuring while nova is
+# building them and geni_failed if the boot fails.  Once a VM is ACTIVE,
+# the watcher finishes setting it up (floating IP, management address,
+# SSH proxy; these run in parallel for VMs that became ACTIVE together)
+# and marks it geni_ready.  VMs restored from a snapshot in state
+# geni_configuring are watched again.
+
+import threading
+import time
+
+import config
+import constants
+import task_executor
+
+
+class VMWatcher:
+
+    def __init__(self):
+        self._lock = threading.Condition(threading.Lock())
+        self._list_states = None
+        self._finish_vm = None
+        self._watched = {} # VM UUID => (VirtualMachine, on_finished)
+        self._thread = None
+
+    def setFunctions(self, list_states, finish_vm):
+        """
+            list_states() returns {VM UUID => nova status} for all VMs.
+            finish_vm(vm_object, vm_uuid) sets up a VM that became ACTIVE
+            and returns True on success.
+        """
+        self._list_states = list_states
+        self._finish_vm = finish_vm
+
+    def watch(self, vm_object, on_finished=None):
+        """
+            Track the given (booting) VM until it is ready or failed, then
+            call on_finished() if given (with the lock of the VM's slice
+            held)
+        """
+        self._lock.acquire()
+        try:
+            self._watched[vm_object.getUUID()] = (vm_object, on_finished)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='vm-watcher')
+                self._thread.setDaemon(True)
+                self._thread.start()
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+
+    def isWatching(self, vm_object):
+        self._lock.acquire()
+        try:
+            return self._watched.has_key(vm_object.getUUID())
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        while True:
+            self._lock.acquire()
+            try:
+                while len(self._watched) == 0:
+                    self._lock.wait(60)
+            finally:
+                self._lock.release()
+            time.sleep(config.vm_watcher_poll_interval)
+            try:
+                self._poll()
+            except Exception, e:
+                config.logger.error('VM watcher failed to poll VMs: %s' % \
+                                        str(e))
+
+    def _poll(self):
+        states = self._list_states()
+        self._lock.acquire()
+        try:
+            watched = self._watched.items()
+        finally:
+            self._lock.release()
+
+        # Hold the lock of each VM's slice while its VM is updated and set
+        # up, so the slice isn't changed (e.g. deleted or expired) in the
+        # meantime.  The VMs of a slice that is busy are left for the next
+        # poll.
+        locked_slices = []
+        busy_slices = []
+        try:
+            active = []
+            finished = []
+            for vm_uuid, (vm_object, on_finished) in watched:
+                slice_object = vm_object.getSlice()
+                if slice_object in busy_slices:
+                    continue
+                if slice_object not in locked_slices:
+                    if not slice_object.getLock().acquire(False):
+                        busy_slices.append(slice_object)
+                        continue
+                    locked_slices.append(slice_object)
+                if not slice_object.getAllSlivers().has_key( \
+                        vm_object.getSliverURN()):
+                    # The VM has been deleted
+                    finished.append((vm_uuid, None))
+                    continue
+                state = states.get(vm_uuid)
+                if state == 'BUILD':
+                    with slice_object.getWriteLock():
+                        vm_object.setOperationalState(constants.configuring)
+                elif state == 'ACTIVE':
+                    active.append((vm_uuid, vm_object, on_finished))
+                else:
+                    # ERROR, or the VM has gone
+                    config.logger.error('VM %s failed to boot: status %s' % \
+                                            (vm_object.getName(), state))
+                    with slice_object.getWriteLock():
+                        vm_object.setOperationalState(constants.failed)
+                    finished.append((vm_uuid, on_finished))
+
+            finish_tasks = \
+                task_executor.TaskGraph(config.provision_concurrency,
+                                        'VM setup tasks')
+            for vm_uuid, vm_object, on_finished in active:
+                finish_tasks.add('set up VM %s' % vm_object.getName(),
+                                 self._finish_vm, (vm_object, vm_uuid))
+                finished.append((vm_uuid, on_finished))
+            finish_tasks.run()
+            for task, (vm_uuid, vm_object, on_finished) in \
+                    zip(finish_tasks.getTasks(), active):
+                with vm_object.getSlice().getWriteLock():
+                    if task.result:
+                        vm_object.setOperationalState(constants.ready)
+                    else:
+                        vm_object.setOperationalState(constants.failed)
+
+            self._lock.acquire()
+            try:
+                for vm_uuid, on_finished in finished:
+                    if self._watched.has_key(vm_uuid):
+                        del self._watched[vm_uuid]
+            finally:
+                self._lock.release()
+
+            # Call each on_finished callback (e.g. save the slice's state)
+            # once
+            callbacks = []
+            for vm_uuid, on_finished in finished:
+                if on_finished is not None and on_finished not in callbacks:
+                    callbacks.append(on_finished)
+            for on_finished in callbacks:
+                try:
+                    on_finished()
+                except Exception, e:
+                    config.logger.error('VM watcher callback failed: %s' % \
+                                            str(e))
+        finally:
+            for slice_object in locked_slices:
+                slice_object.getLock().release()
+
+
+# The watcher shared by the aggregate manager
+watcher = VMWatcher()
@@ -23,6 +23,8 @@
 
 from gram.am.gram import open_stack_interface
 from gram.am.gram import Archiving
+from gram.am.gram import snapshot_format
+from gram.am.gram import journal_format
 from gram.am.gram import config
 from gram.am.gram import stitching
 import sys
@@ -128,21 +130,17 @@ def monitor(parms):
 
  snapshot_dir = config.gram_snapshot_directory + "/" + getpass.getuser()
 
- allF = []
- files = os.listdir(snapshot_dir)
- for f in files:
-  filename = os.path.join(snapshot_dir, f)
-  if(os.path.isfile(filename)):
-#    print filename
-    allF.append(filename)
-
- if allF:
-  nfiles = sorted(allF, key=os.path.getctime)
-  oldest = nfiles[0]
-  newest = nfiles[-1]
-
-  print "Latest snapshot file: " + newest + "\n"
-  myslices = Archiving.read_state(newest, None, stitching_handler)
+ # Use the aggregate manager's pointer to the latest snapshot rather
+ # than listing the (possibly very large) snapshot directory
+ newest = snapshot_format.find_latest_snapshot(snapshot_dir)
+
+ if newest:
+  print "Latest snapshot file: " + newest + " (format version %d)\n" % \
+      snapshot_format.get_format_version(newest)
+  # With the state journal on, the snapshot is a checkpoint followed by
+  # the journal
+  myslices = Archiving.restore_objects(journal_format.load_state(newest),
+                                      None, stitching_handler)
   sliver = {}
 
   for i, slice in myslices.iteritems():